@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite - offline performance measurements for the forensics pipeline.
+
+Generates synthetic camera-like images (0.3MP to 48MP, JPEG and PNG), times
+every stage of analyze_image() separately, runs an in-process load test of
+the FastAPI app and writes p50/p95/p99 latency, throughput and peak memory
+as JSON. The compare mode flags regressions against a saved baseline.
+
+Usage (from the backend directory):
+  python benchmark.py run --out bench.json
+  python benchmark.py run --sizes 0.3,2,12 --formats jpeg --repeat 10 --concurrency 1,4,16
+  python benchmark.py compare baseline.json bench.json --threshold 0.10
+  python benchmark.py ela --sizes 2,12 --tolerance 0.05
+  python benchmark.py cascade --sizes 2,12 --out cascade.json
+  python benchmark.py threads --size 12 --repeat 8 --out threads.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import forensics
+from engine import AnalysisEngine, available_cores
+
+# Megapixel presets -> (width, height), 4:3 like phone sensors
+RESOLUTIONS = {
+    "0.3": (640, 480),
+    "2": (1632, 1224),
+    "12": (4000, 3000),
+    "24": (5664, 4248),
+    "48": (8000, 6000),
+}
+
+STAGES = ("decode", "resize", "gradients", "histogram_gaps", "ela", "visualization")
+
+
+def synthetic_image(width, height, seed=0):
+    """
+    Camera-like test image: smooth scene content plus per-pixel sensor noise.
+    Built with OpenCV primitives so 48MP stays within a few hundred MB.
+    """
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    img = cv2.resize(scene, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = np.empty((height, width, 3), dtype=np.uint8)
+    # Per-channel bounds: a scalar would only fill the first (blue) channel
+    cv2.randu(noise, (0, 0, 0), (24, 24, 24))
+    cv2.add(img, noise, dst=img)
+    noise.fill(12)
+    cv2.subtract(img, noise, dst=img)
+    return img
+
+
+def graded_image(width, height, noise, blur=0.0, seed=0):
+    """synthetic_image with adjustable grain: blur models AI smoothness, noise models sensor grain."""
+    img = synthetic_image(width, height, seed=seed)
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if noise:
+        # Signed grain in int16 (uint8 would clip the negative half), saturated back to uint8
+        grain = np.empty(img.shape, dtype=np.int16)
+        cv2.randn(grain, (0, 0, 0), (noise, noise, noise))
+        img = cv2.add(img, grain, dtype=cv2.CV_8U)
+    return img
+
+
+def encode(img, fmt):
+    ext = ".jpg" if fmt == "jpeg" else ".png"
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), 92] if fmt == "jpeg" else [int(cv2.IMWRITE_PNG_COMPRESSION), 1]
+    ok, buffer = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError(f"Could not encode {fmt}")
+    return buffer.tobytes()
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_stages(image_bytes, target_dim=forensics.TARGET_DIM):
+    """
+    Run the analyze_image() pipeline stage by stage.
+    Returns {stage: seconds} for one pass.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    img = forensics.decode_image(image_bytes, target_dim)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    h, w = img.shape[:2]
+    scale = target_dim / max(h, w)
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)))
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    timings["resize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    features = forensics.extract_features(img, gray, keep_magnitude=True)
+    timings["gradients"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forensics.calculate_histogram_gaps(img)
+    timings["histogram_gaps"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forensics.calculate_ela_score(img, threshold=forensics.ELA_AI_THRESHOLD)
+    timings["ela"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forensics.render_gradient(features["magnitude"])
+    timings["visualization"] = time.perf_counter() - start
+
+    return timings
+
+
+def bench_pipeline(images, repeat):
+    """Per-stage and end-to-end timings for every synthetic image."""
+    results = {}
+    for name, image_bytes in images.items():
+        print(f"  {name}: {len(image_bytes) / 1e6:.1f} MB", flush=True)
+        run_stages(image_bytes)  # Warm-up (OpenCV/BLAS initialisation, page faults)
+
+        samples = {stage: [] for stage in STAGES}
+        totals = []
+        for _ in range(repeat):
+            for stage, seconds in run_stages(image_bytes).items():
+                samples[stage].append(seconds)
+            start = time.perf_counter()
+            forensics.analyze_image(image_bytes)
+            totals.append(time.perf_counter() - start)
+
+        # Python-visible peak of one analyze_image call (NumPy/OpenCV buffers)
+        tracemalloc.start()
+        forensics.analyze_image(image_bytes)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            "bytes": len(image_bytes),
+            "stages": {stage: summarize(values) for stage, values in samples.items()},
+            "analyze_image": summarize(totals),
+            "throughput_ips": round(len(totals) / sum(totals), 3),
+            "peak_traced_mb": round(traced_peak / (1024 * 1024), 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+
+async def _load_level(app, image_bytes, requests, concurrency):
+    import httpx
+
+    latencies = []
+    statuses = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        async def one():
+            async with slots:
+                start = time.perf_counter()
+                response = await client.post("/analyze", files={"file": ("bench.jpg", image_bytes, "image/jpeg")})
+                # Fast 503 rejections would flatter the percentiles: they are only counted
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "latency": summarize(latencies or [0.0]),
+        "throughput_rps": round(len(latencies) / elapsed, 3),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_load(image_bytes, requests, concurrency_levels, use_cache=False):
+    """In-process load test of the FastAPI app (no network, no uvicorn)."""
+    try:
+        import httpx  # noqa: F401  (optional, only needed for the load test)
+    except ImportError:
+        print("  httpx is not installed - skipping the load test (pip install httpx)")
+        return {}
+
+    if not use_cache:
+        # Identical uploads would otherwise be answered from the result cache
+        os.environ["RESULT_CACHE_MB"] = "0"
+        os.environ.pop("RESULT_CACHE_DB", None)
+    # Every request comes from one client: measure the engine, not the rate limit
+    os.environ["RATE_LIMIT_RATE"] = "0"
+    import main
+
+    async def run_all():
+        results = {}
+        async with main.lifespan(main.app):
+            await _load_level(main.app, image_bytes, min(requests, 4), 1)  # Warm-up
+            for level in concurrency_levels:
+                print(f"  concurrency {level}: {requests} requests", flush=True)
+                results[f"c{level}"] = await _load_level(main.app, image_bytes, requests, level)
+        return results
+
+    return asyncio.run(run_all())
+
+
+def command_run(args):
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    for size in sizes:
+        if size not in RESOLUTIONS:
+            sys.exit(f"Unknown size {size}MP, choose from {', '.join(RESOLUTIONS)}")
+
+    print("Generating synthetic images...", flush=True)
+    images = {}
+    for size in sizes:
+        width, height = RESOLUTIONS[size]
+        img = synthetic_image(width, height, seed=args.seed)
+        for fmt in formats:
+            images[f"{fmt}_{size}mp"] = encode(img, fmt)
+        del img
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "analysis_version": forensics.ANALYSIS_VERSION,
+            "repeat": args.repeat,
+        },
+    }
+
+    print("Timing pipeline stages...", flush=True)
+    report["pipeline"] = bench_pipeline(images, args.repeat)
+
+    if args.load_requests > 0:
+        load_name = f"jpeg_{args.load_size}mp"
+        if load_name not in images:
+            width, height = RESOLUTIONS[args.load_size]
+            images[load_name] = encode(synthetic_image(width, height, seed=args.seed), "jpeg")
+        levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        print(f"Load testing /analyze with {load_name}...", flush=True)
+        report["load"] = bench_load(images[load_name], args.load_requests, levels, args.cache)
+
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+def _metrics(report):
+    """Flatten a report to {path: (value, higher_is_better)}."""
+    metrics = {}
+    for name, entry in report.get("pipeline", {}).items():
+        for stage, summary in entry["stages"].items():
+            for key in ("p50_ms", "p95_ms"):
+                metrics[f"pipeline.{name}.{stage}.{key}"] = (summary[key], False)
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"pipeline.{name}.analyze_image.{key}"] = (entry["analyze_image"][key], False)
+        metrics[f"pipeline.{name}.peak_traced_mb"] = (entry["peak_traced_mb"], False)
+    for level, entry in report.get("load", {}).items():
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"load.{level}.{key}"] = (entry["latency"][key], False)
+        metrics[f"load.{level}.throughput_rps"] = (entry["throughput_rps"], True)
+    return metrics
+
+
+def command_compare(args):
+    with open(args.baseline) as f:
+        baseline = _metrics(json.load(f))
+    with open(args.current) as f:
+        current = _metrics(json.load(f))
+
+    regressions = []
+    for path, (value, higher_is_better) in sorted(current.items()):
+        if path not in baseline:
+            continue
+        base_value = baseline[path][0]
+        if base_value <= 0:
+            continue
+        change = (value - base_value) / base_value
+        worse = -change if higher_is_better else change
+        marker = ""
+        if worse > args.threshold:
+            # Sub-millisecond stages are dominated by timer noise
+            if not path.endswith("_ms") or abs(value - base_value) >= args.min_ms:
+                marker = "  <-- REGRESSION"
+                regressions.append(path)
+        if marker or args.verbose:
+            print(f"{path:70s} {base_value:10.3f} -> {value:10.3f} ({change:+.1%}){marker}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"No regressions above {args.threshold:.0%} across {len(current)} metrics")
+
+
+def command_ela(args):
+    """
+    Agreement check: sampled ELA vs the full JPEG round trip.
+
+    Sweeps sensor noise levels (clean AI-like to grainy camera-like) on every
+    resolution. Fails when the relative error exceeds the tolerance or the
+    ELA_AI_THRESHOLD decision differs from the full computation.
+    """
+    failures = 0
+    rows = []
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        width, height = RESOLUTIONS[size]
+        for noise in (0, 2, 4, 8, 24):
+            img = graded_image(width, height, noise, seed=args.seed)
+            # Same input as analyze_image sees
+            scale = forensics.TARGET_DIM / max(height, width)
+            if scale < 1.0:
+                img = cv2.resize(img, (int(width * scale), int(height * scale)))
+
+            start = time.perf_counter()
+            full = forensics.calculate_ela_score(img, mode="full")
+            full_ms = (time.perf_counter() - start) * 1000.0
+            start = time.perf_counter()
+            sampled = forensics.calculate_ela_score(img, mode="sampled", tolerance=args.tolerance,
+                                                    threshold=forensics.ELA_AI_THRESHOLD)
+            sampled_ms = (time.perf_counter() - start) * 1000.0
+
+            error = abs(sampled - full) / max(full, 1e-6)
+            agree = (sampled < forensics.ELA_AI_THRESHOLD) == (full < forensics.ELA_AI_THRESHOLD)
+            ok = agree and error <= args.tolerance
+            failures += not ok
+            rows.append({"size": size, "noise": noise, "full": round(full, 4), "sampled": round(sampled, 4),
+                         "relative_error": round(error, 5), "decision_agrees": agree,
+                         "full_ms": round(full_ms, 2), "sampled_ms": round(sampled_ms, 2)})
+            print(f"{size:>4}MP noise {noise:2d}: full {full:7.4f} ({full_ms:6.1f}ms)  "
+                  f"sampled {sampled:7.4f} ({sampled_ms:6.1f}ms)  err {error:6.2%}{'' if ok else '  <-- FAIL'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=2)
+    if failures:
+        print(f"\n{failures} case(s) outside the {args.tolerance:.0%} tolerance or with a different decision")
+        sys.exit(1)
+    print(f"Sampled ELA agrees with the full score on all {len(rows)} cases")
+
+
+def command_cascade(args):
+    """
+    Early-exit cascade report: fraction of images decided on the tile sample,
+    classification agreement with the full pass and latency of both modes.
+    Exits 1 when any classification differs.
+    """
+    cases = []
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        width, height = RESOLUTIONS[size]
+        for blur in (0.0, 1.0, 2.5):
+            for noise in (0, 3, 6, 12, 24, 48):
+                cases.append((f"{size}mp_b{blur}_n{noise}", encode(graded_image(width, height, noise, blur, args.seed), "jpeg")))
+
+    rows = []
+    full_times, cascade_times = [], []
+    for name, image_bytes in cases:
+        forensics.analyze_image(image_bytes, cascade=False)  # Warm-up
+        start = time.perf_counter()
+        full = forensics.analyze_image(image_bytes, cascade=False)
+        full_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cascaded = forensics.analyze_image(image_bytes, cascade=True)
+        cascade_times.append(time.perf_counter() - start)
+
+        decided_at = cascaded["meta"]["decided_at"]
+        agree = forensics._score_bucket(full["trust_score"]) == forensics._score_bucket(cascaded["trust_score"])
+        rows.append({"image": name, "full_score": full["trust_score"], "cascade_score": cascaded["trust_score"],
+                     "decided_at": decided_at, "classification_agrees": agree})
+        print(f"  {name:22s} full {full['trust_score']:3d}  cascade {cascaded['trust_score']:3d} "
+              f"({decided_at}){'' if agree else '  <-- MISMATCH'}", flush=True)
+
+    early = sum(row["decided_at"] == "proxy" for row in rows)
+    mismatches = sum(not row["classification_agrees"] for row in rows)
+    report = {
+        "images": len(rows),
+        "early_exit_fraction": round(early / len(rows), 3),
+        "classification_mismatches": mismatches,
+        "full": summarize(full_times),
+        "cascade": summarize(cascade_times),
+        "cases": rows,
+    }
+    print(f"\nEarly exit: {early}/{len(rows)} ({report['early_exit_fraction']:.0%}), "
+          f"p50 {report['full']['p50_ms']:.1f}ms -> {report['cascade']['p50_ms']:.1f}ms, "
+          f"{mismatches} classification mismatch(es)")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if mismatches:
+        sys.exit(1)
+
+
+# Native thread budgets compared by the threads command
+THREAD_CONFIGS = (
+    ("unmanaged", {"native_threads": 0}),   # workers = cores, library default threads
+    ("inter", {"parallelism": "inter"}),
+    ("intra", {"parallelism": "intra"}),
+)
+
+
+async def _bench_engine(engine, image_bytes, repeat, jobs):
+    await engine.warm_up(forensics.analyze_image, image_bytes)
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await engine.run(forensics.analyze_image, image_bytes)
+        latencies.append(time.perf_counter() - start)
+
+    # Keep the engine saturated without tripping admission control
+    slots = asyncio.Semaphore(engine.capacity)
+
+    async def one():
+        async with slots:
+            await engine.run(forensics.analyze_image, image_bytes)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(jobs)))
+    return summarize(latencies), jobs / (time.perf_counter() - start)
+
+
+def command_threads(args):
+    """
+    Native thread budget report: single-image latency (one request at a time)
+    and saturated throughput of the inter and intra parallelism modes, next to
+    unmanaged library defaults. Exits 1 when intra is not the lowest-latency
+    mode or inter not the highest-throughput one (within --tolerance).
+    """
+    width, height = RESOLUTIONS[args.size]
+    image_bytes = encode(graded_image(width, height, 6, seed=args.seed), "jpeg")
+    cores = available_cores()
+    jobs = args.jobs or 4 * cores
+    saved_env = dict(os.environ)
+
+    results = {}
+    for name, config in THREAD_CONFIGS:
+        # Spawned worker processes import NumPy/forensics after the engine exported
+        # the budget (the fork context would inherit this process' modules)
+        engine = AnalysisEngine(mode=args.executor, max_jobs_per_worker=100000, timeout=600, **config)
+        try:
+            latency, throughput = asyncio.run(_bench_engine(engine, image_bytes, args.repeat, jobs))
+        finally:
+            engine.shutdown()
+            os.environ.clear()
+            os.environ.update(saved_env)
+        results[name] = {
+            "workers": engine.workers,
+            "native_threads": engine.native_threads,
+            "latency": latency,
+            "throughput_per_s": round(throughput, 2),
+        }
+        print(f"  {name:10s} {engine.workers:3d} workers x {engine.native_threads or 'default':>7} threads  "
+              f"latency p50 {latency['p50_ms']:8.1f}ms  throughput {throughput:6.2f} img/s", flush=True)
+
+    failures = []
+    slack = 1 + args.tolerance
+    if results["intra"]["latency"]["p50_ms"] > results["inter"]["latency"]["p50_ms"] * slack:
+        failures.append("intra is not the lowest-latency mode")
+    if results["inter"]["throughput_per_s"] * slack < results["intra"]["throughput_per_s"]:
+        failures.append("inter is not the highest-throughput mode")
+    if results["inter"]["throughput_per_s"] * slack < results["unmanaged"]["throughput_per_s"]:
+        failures.append("inter is slower than the unmanaged defaults")
+
+    report = {"cores": cores, "executor": args.executor, "image": f"{args.size}MP", "jobs": jobs,
+              "modes": results, "failures": failures}
+    print(f"\n{cores} cores: " + ("; ".join(failures) if failures else "both modes meet their goal"))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if failures:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RealorAI forensics benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the benchmarks and write a JSON report")
+    run.add_argument("--sizes", default="0.3,2,12,24,48", help="Megapixel presets (%s)" % ",".join(RESOLUTIONS))
+    run.add_argument("--formats", default="jpeg,png", help="jpeg and/or png")
+    run.add_argument("--repeat", type=int, default=5, help="Timed passes per image")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--load-requests", type=int, default=32, help="Requests per concurrency level (0 = skip)")
+    run.add_argument("--load-size", default="12", help="Megapixel preset used for the load test")
+    run.add_argument("--concurrency", default="1,4,16", help="Concurrency levels for the load test")
+    run.add_argument("--cache", action="store_true", help="Keep the result cache enabled during the load test")
+    run.add_argument("--out", default="bench.json")
+    run.set_defaults(func=command_run)
+
+    compare = sub.add_parser("compare", help="Compare a report against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown")
+    compare.add_argument("--min-ms", type=float, default=1.0, help="Ignore latency changes smaller than this")
+    compare.add_argument("--verbose", action="store_true", help="Print every metric")
+    compare.set_defaults(func=command_compare)
+
+    ela = sub.add_parser("ela", help="Check sampled ELA against the full ELA score")
+    ela.add_argument("--sizes", default="2,12,48", help="Megapixel presets (%s)" % ",".join(RESOLUTIONS))
+    ela.add_argument("--tolerance", type=float, default=forensics.ELA_TOLERANCE, help="Allowed relative error")
+    ela.add_argument("--seed", type=int, default=0)
+    ela.add_argument("--out", default=None, help="Optional JSON report")
+    ela.set_defaults(func=command_ela)
+
+    cascade = sub.add_parser("cascade", help="Early-exit rate and agreement of the cascade mode")
+    cascade.add_argument("--sizes", default="2,12", help="Megapixel presets (%s)" % ",".join(RESOLUTIONS))
+    cascade.add_argument("--seed", type=int, default=0)
+    cascade.add_argument("--out", default=None, help="Optional JSON report")
+    cascade.set_defaults(func=command_cascade)
+
+    threads = sub.add_parser("threads", help="Latency and throughput of the native thread budget modes")
+    threads.add_argument("--size", default="12", help="Megapixel preset (%s)" % ",".join(RESOLUTIONS))
+    threads.add_argument("--executor", default="process", choices=("process", "thread"))
+    threads.add_argument("--repeat", type=int, default=8, help="Sequential requests for the latency figure")
+    threads.add_argument("--jobs", type=int, default=0, help="Requests for the throughput figure (default: 4 x cores)")
+    threads.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative shortfall")
+    threads.add_argument("--seed", type=int, default=0)
+    threads.add_argument("--out", default=None, help="Optional JSON report")
+    threads.set_defaults(func=command_threads)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
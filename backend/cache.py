@@ -0,0 +1,246 @@
+"""
+Result Cache - content-addressed cache in front of analyze_image().
+
+Re-submitted images are answered from the cache without decoding them.
+
+  - Key: SHA-256 of the uploaded bytes + forensics.ANALYSIS_VERSION (+ variant),
+    so calibration changes invalidate old entries automatically; a non-default
+    ANALYSIS_TARGET_DIM, ANALYSIS_CASCADE, REDUCED_DECODE and sampled ELA_MODE
+    are part of the version as well
+  - Tier 1: in-process LRU, evicted by total serialized size
+  - Tier 2 (optional): SQLite file that survives restarts
+
+Configuration (environment variables):
+  RESULT_CACHE_MB               memory tier budget in MB (default: 64, 0 = disabled)
+  RESULT_CACHE_DB               path of the SQLite tier (default: unset = disabled)
+  RESULT_CACHE_DB_MAX_ENTRIES   rows kept in the SQLite tier (default: 100000)
+"""
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+
+@functools.lru_cache(maxsize=None)
+def analysis_version(target_dim=None) -> str:
+    """
+    forensics.ANALYSIS_VERSION plus the settings that change results.
+
+    target_dim defaults to forensics.TARGET_DIM (ANALYSIS_TARGET_DIM).
+    """
+    # Imported here so importing the cache does not pull in cv2/numpy
+    try:
+        from . import forensics
+    except ImportError:  # Imported from the backend directory
+        import forensics
+    # Scores depend on the analysis resolution, so a changed TARGET_DIM gets its own keys;
+    # cascade results carry a different meta (decided_at), so they do too
+    target_dim = forensics.TARGET_DIM if target_dim is None else target_dim
+    version = (
+        forensics.ANALYSIS_VERSION if target_dim == 2048
+        else f"{forensics.ANALYSIS_VERSION}@{target_dim}"
+    )
+    # Reduced decode lowers the noise floor of large JPEGs; sampled ELA is an
+    # estimate (within ELA_TOLERANCE) of the full round trip's error level
+    if forensics.REDUCED_DECODE:
+        version += "+rd"
+    if forensics.ELA_MODE != "full":
+        version += f"+ela{forensics.ELA_TOLERANCE:g}"
+    return version + ("+cascade" if forensics.ANALYSIS_CASCADE else "")
+
+
+def content_key(contents, variant: str = "") -> str:
+    """Cache key for an upload: content hash + analysis version (+ variant)."""
+    # SHA-256 is hardware accelerated on current x86/ARM CPUs (faster than BLAKE2/MD5 there)
+    digest = hashlib.sha256(contents).hexdigest()
+    version = analysis_version()
+    return f"{version}:{variant}:{digest}" if variant else f"{version}:{digest}"
+
+
+class SQLiteResultStore:
+    """Disk tier: key -> orjson blob, pruned oldest-first past max_entries."""
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  key TEXT UNIQUE NOT NULL,"
+            "  value BLOB NOT NULL)"
+        )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, value))
+            self._writes += 1
+            # Prune in batches rather than on every insert
+            if self._writes % 256 == 0:
+                self._conn.execute(
+                    "DELETE FROM results WHERE id <= (SELECT MAX(id) FROM results) - ?",
+                    (self.max_entries,)
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk: SQLiteResultStore = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries = OrderedDict()  # key -> serialized result (bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Counters for operators
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        max_bytes = int(float(os.environ.get("RESULT_CACHE_MB", "64")) * 1024 * 1024)
+        disk = None
+        db_path = os.environ.get("RESULT_CACHE_DB")
+        if db_path:
+            try:
+                disk = SQLiteResultStore(db_path, int(os.environ.get("RESULT_CACHE_DB_MAX_ENTRIES", "100000")))
+            except sqlite3.Error as e:
+                logging.warning(f"Result cache disk tier disabled: {e}")
+        return cls(max_bytes=max_bytes, disk=disk)
+
+    def _remember(self, key: str, blob: bytes):
+        # Caller holds the lock
+        if len(blob) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = blob
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key: str):
+        """Return the cached result dict for key, or None."""
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return orjson.loads(blob)
+
+        if self.disk is not None:
+            try:
+                blob = self.disk.get(key)
+            except sqlite3.Error as e:
+                logging.warning(f"Result cache disk read failed: {e}")
+                blob = None
+            if blob is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, blob)
+                return orjson.loads(blob)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: dict):
+        blob = orjson.dumps(result)
+        with self._lock:
+            self._remember(key, blob)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, blob)
+            except sqlite3.Error as e:
+                logging.warning(f"Result cache disk write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "version": analysis_version(),
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "disk_tier": self.disk.path if self.disk is not None else None,
+        }
+
+
+class TTLStore:
+    """
+    Short-lived in-process store: entries expire after ttl seconds and the
+    oldest are evicted once the total size passes max_bytes.
+    Used for gradient visualizations fetched separately by result ID.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_bytes: int = 32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        # Caller holds the lock
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _expire(self, now: float):
+        # Insertion order == expiry order (fixed ttl), so stop at the first live entry
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._drop(key)
+
+    def put(self, key: str, value: bytes):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (now + self.ttl, value)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def get(self, key: str):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "ttl": self.ttl}
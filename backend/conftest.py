@@ -0,0 +1,8 @@
+"""pytest setup: the backend modules import each other by bare name (run from this directory)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# test_api.py is a manual script against a running server (python test_api.py <image>)
+collect_ignore = ["test_api.py"]
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Index - reuse results for re-encoded, resized or stripped copies.
+
+The result cache only recognizes byte-identical uploads, so a viral image
+re-saved by every platform it passed through was analyzed from scratch each
+time. analyze_image() now hashes the analysis-size grayscale it already has
+(forensics.perceptual_hash) and asks this index before the expensive stages:
+  - an indexed hash within NEAR_DUP_DISTANCE bits returns its stored result,
+    with meta.near_duplicate = {"distance", "known_ai"}
+  - a known-AI hash (bulk loaded, see below) within the distance returns
+    trust_score 0 without analyzing
+  - otherwise the image is analyzed and its hash and result are added
+Hashes are searched by multi-index hashing: split into distance + 1 bit
+ranges, any hash within the distance matches one range exactly (pigeonhole),
+so a lookup checks a few dict buckets instead of every entry (~0.3 ms at
+100k hashes, where a BK-tree visits most of its nodes for 64-bit hashes).
+
+Each engine worker process holds its own index (installed by
+startup.warm_worker). With NEAR_DUP_DB every entry is also written to SQLite
+and loaded when a worker starts, so the index survives restarts and workers
+share what the others learned on their next start. Stored results are only
+reused for the same analysis version (cache.analysis_version) and hash method.
+
+Bulk loading known-AI images (directories, zip/tar archives) or hashes
+(.txt files, one hex hash per line) into NEAR_DUP_DB:
+  python dedup.py known-ai generated/ samples.zip hashes.txt
+  python dedup.py stats
+
+Configuration (environment variables):
+  NEAR_DUP              "1" enables the index (default: "0")
+  NEAR_DUP_DISTANCE     max differing bits (of 64) that count as a duplicate (default: 6)
+  NEAR_DUP_HASH         "phash" (default) or "dhash"
+  NEAR_DUP_DB           SQLite file persisting the index (default: unset = memory only)
+  NEAR_DUP_MAX_ENTRIES  stored results kept (default: 100000; known-AI hashes are never dropped)
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+import orjson
+
+
+# trust_score reported for matches of bulk-loaded known-AI hashes
+KNOWN_AI_SCORE = 0
+
+
+class MultiIndex:
+    """Set of 64-bit hashes searchable by Hamming distance (multi-index hashing)."""
+
+    def __init__(self, max_distance: int, bits: int = 64):
+        # max_distance + 1 disjoint bit ranges: a hash within max_distance
+        # differs in at most max_distance of them, so one matches exactly
+        chunks = max_distance + 1
+        bounds = [round(i * bits / chunks) for i in range(chunks + 1)]
+        self.max_distance = max_distance
+        self._ranges = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._ranges]  # chunk value -> set of hashes
+
+    def add(self, value: int):
+        for (shift, mask), table in zip(self._ranges, self._tables):
+            table.setdefault((value >> shift) & mask, set()).add(value)
+
+    def remove(self, value: int):
+        for (shift, mask), table in zip(self._ranges, self._tables):
+            chunk = (value >> shift) & mask
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, value: int):
+        """All (distance, hash) within max_distance of value, nearest first."""
+        candidates = set()
+        for (shift, mask), table in zip(self._ranges, self._tables):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        return sorted(
+            (distance, candidate) for candidate in candidates
+            if (distance := (value ^ candidate).bit_count()) <= self.max_distance
+        )
+
+
+class SQLiteHashStore:
+    """Disk tier: one row per (method, hash, kind, version); results as orjson blobs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  method TEXT NOT NULL,"
+            "  hash TEXT NOT NULL,"      # 16 hex digits (SQLite integers are signed)
+            "  kind TEXT NOT NULL,"      # "result" or "known_ai"
+            "  version TEXT NOT NULL,"   # analysis version of a result, "" for known_ai
+            "  value BLOB,"
+            "  UNIQUE (method, hash, kind, version))"
+        )
+
+    def load(self, method: str, version: str, max_results: int):
+        """Known-AI hashes plus the newest max_results results, oldest first: (hash, kind, value)."""
+        with self._lock:
+            known = self._conn.execute(
+                "SELECT hash, kind, value FROM hashes WHERE method = ? AND kind = 'known_ai' ORDER BY id",
+                (method,)
+            ).fetchall()
+            results = self._conn.execute(
+                "SELECT hash, kind, value FROM hashes WHERE method = ? AND kind = 'result' AND version = ?"
+                " ORDER BY id DESC LIMIT ?",
+                (method, version, max_results)
+            ).fetchall()
+        return [(int(h, 16), kind, value) for h, kind, value in known + results[::-1]]
+
+    def put_many(self, method: str, rows):
+        """Insert or replace (hash, kind, version, value) rows in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (method, hash, kind, version, value) VALUES (?, ?, ?, ?, ?)",
+                    [(method, f"{h:016x}", kind, version, value) for h, kind, version, value in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def prune(self, method: str, version: str, max_results: int):
+        """Drop all but the newest max_results results of this method and version."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM hashes WHERE method = ? AND kind = 'result' AND version = ? AND id NOT IN ("
+                "  SELECT id FROM hashes WHERE method = ? AND kind = 'result' AND version = ?"
+                "  ORDER BY id DESC LIMIT ?)",
+                (method, version, method, version, max_results)
+            )
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT method, kind, COUNT(*) FROM hashes GROUP BY method, kind ORDER BY method, kind"
+            ).fetchall()
+        return {f"{method}/{kind}": count for method, kind, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class NearDuplicateIndex:
+    def __init__(self, distance: int = 6, method: str = "phash", version: str = "",
+                 max_entries: int = 100000, store: SQLiteHashStore = None):
+        """
+        Args:
+            distance: Max Hamming distance counted as a duplicate
+            method: forensics.perceptual_hash method the hashes were made with
+            version: Analysis version; stored results of other versions are ignored
+            max_entries: Results kept (oldest dropped first); known-AI hashes are not counted
+            store: Optional persistence (loaded now, written on every add)
+        """
+        self.distance = distance
+        self.method = method
+        self.version = version
+        self.max_entries = max_entries
+        self.store = store
+        self._results = OrderedDict()  # hash -> result blob, oldest first
+        self._known_ai = set()
+        self._hashes = MultiIndex(distance)  # both of the above
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        # Counters for operators
+        self.hits = 0
+        self.known_ai_hits = 0
+        self.misses = 0
+
+        if store is not None:
+            for value, kind, blob in store.load(method, version, max_entries):
+                if kind == "known_ai":
+                    self._insert_known_ai(value)
+                else:
+                    self._insert_result(value, blob)
+
+    @classmethod
+    def from_env(cls):
+        """The configured index, or None when NEAR_DUP is off."""
+        if os.environ.get("NEAR_DUP", "0") != "1":
+            return None
+        import forensics
+        from cache import analysis_version
+        store = None
+        db_path = os.environ.get("NEAR_DUP_DB")
+        if db_path:
+            try:
+                store = SQLiteHashStore(db_path)
+            except sqlite3.Error as e:
+                logging.warning(f"Near-duplicate index persistence disabled: {e}")
+        return cls(
+            distance=int(os.environ.get("NEAR_DUP_DISTANCE", "6")),
+            method=forensics.PERCEPTUAL_HASH,
+            version=analysis_version(),
+            max_entries=int(os.environ.get("NEAR_DUP_MAX_ENTRIES", "100000")),
+            store=store,
+        )
+
+    def _insert_result(self, value: int, blob: bytes) -> bool:
+        # Caller holds the lock (or is the constructor)
+        if value in self._known_ai:
+            return False
+        if value in self._results:
+            self._results.move_to_end(value)
+        else:
+            self._hashes.add(value)
+        self._results[value] = blob
+        if len(self._results) > self.max_entries:
+            oldest, _ = self._results.popitem(last=False)
+            self._hashes.remove(oldest)
+        return True
+
+    def _insert_known_ai(self, value: int):
+        # Caller holds the lock (or is the constructor); replaces a stored result
+        if value in self._known_ai:
+            return
+        if self._results.pop(value, None) is None:
+            self._hashes.add(value)
+        self._known_ai.add(value)
+
+    def lookup(self, value: int):
+        """
+        Result for the nearest indexed hash within the distance (known-AI hashes first).
+
+        Returns:
+            A result dict with meta.near_duplicate, or None
+        """
+        with self._lock:
+            matches = self._hashes.search(value)
+            if not matches:
+                self.misses += 1
+                return None
+            known_ai = [match for match in matches if match[1] in self._known_ai]
+            distance, match = (known_ai or matches)[0]
+            if known_ai:
+                self.known_ai_hits += 1
+                result = {"trust_score": KNOWN_AI_SCORE, "meta": {}}
+            else:
+                self.hits += 1
+                result = orjson.loads(self._results[match])
+        result.setdefault("meta", {})["near_duplicate"] = {"distance": distance, "known_ai": bool(known_ai)}
+        return result
+
+    def add(self, value: int, result: dict):
+        """Index the result of an analyzed image."""
+        blob = orjson.dumps(result)
+        with self._lock:
+            if not self._insert_result(value, blob):
+                return
+            self._writes += 1
+            prune = self.store is not None and self._writes % 256 == 0
+        if self.store is not None:
+            try:
+                self.store.put_many(self.method, [(value, "result", self.version, blob)])
+                if prune:
+                    self.store.prune(self.method, self.version, self.max_entries)
+            except sqlite3.Error as e:
+                logging.warning(f"Near-duplicate index write failed: {e}")
+
+    def add_known_ai(self, values) -> int:
+        """Index hashes of known AI-generated images; returns the number added."""
+        values = list(values)
+        with self._lock:
+            for value in values:
+                self._insert_known_ai(value)
+        if self.store is not None:
+            self.store.put_many(self.method, [(value, "known_ai", "", None) for value in values])
+        return len(values)
+
+    def stats(self) -> dict:
+        return {
+            "method": self.method,
+            "distance": self.distance,
+            "results": len(self._results),
+            "known_ai": len(self._known_ai),
+            "hits": self.hits,
+            "known_ai_hits": self.known_ai_hits,
+            "misses": self.misses,
+            "db": self.store.path if self.store is not None else None,
+        }
+
+
+def iter_known_ai_hashes(paths, method):
+    """Yield (source, hash) for hex hash lists (.txt) and images below paths."""
+    try:
+        from . import forensics, score
+    except ImportError:  # Run as a script from the backend directory
+        import forensics
+        import score
+
+    images = []
+    for path in paths:
+        if path.lower().endswith(".txt"):
+            with open(path) as f:
+                for number, line in enumerate(f, 1):
+                    line = line.split("#")[0].strip()
+                    if line:
+                        try:
+                            yield f"{path}:{number}", int(line, 16)
+                        except ValueError:
+                            logging.error(f"Skipping invalid hash at {path}:{number}: {line}")
+        else:
+            images.append(path)
+    for source, data in score.iter_sources(images):
+        try:
+            value = forensics.image_hash(data, method=method)
+        except Exception as e:
+            logging.error(f"Skipping {source}: {type(e).__name__}: {e}")
+            continue
+        if value is None:
+            logging.error(f"Skipping {source}: image too uniform to hash")
+            continue
+        yield source, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the persisted near-duplicate index (NEAR_DUP_DB)")
+    parser.add_argument("--db", default=os.environ.get("NEAR_DUP_DB"), help="SQLite file (default: NEAR_DUP_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    known_ai = commands.add_parser("known-ai", help="Bulk load hashes of known AI-generated images")
+    known_ai.add_argument("paths", nargs="+", help="Images, directories, zip/tar archives or .txt hash lists")
+    known_ai.add_argument("--method", default=os.environ.get("NEAR_DUP_HASH", "phash"), choices=("phash", "dhash"),
+                          help="Hash method (must match the server's NEAR_DUP_HASH)")
+    commands.add_parser("stats", help="Row counts per hash method and kind")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(levelname)s: %(message)s")
+    if not args.db:
+        parser.error("no index file: pass --db or set NEAR_DUP_DB")
+    store = SQLiteHashStore(args.db)
+    try:
+        if args.command == "known-ai":
+            added = set()
+            batch = []
+            for _, value in iter_known_ai_hashes(args.paths, args.method):
+                if value not in added:
+                    added.add(value)
+                    batch.append((value, "known_ai", "", None))
+                if len(batch) >= 1000:
+                    store.put_many(args.method, batch)
+                    batch = []
+            if batch:
+                store.put_many(args.method, batch)
+            print(f"Added {len(added)} known-AI hashes to {args.db}")
+        else:
+            for key, count in store.counts().items():
+                print(f"{key}: {count}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+"""
+Analysis Engine - bounded, dedicated executor for analyze_image().
+
+Replaces the default asyncio.to_thread executor (unbounded queue, no cap on
+concurrent decodes) with:
+  - a process pool or a thread pool sized to the number of cores
+  - a bounded admission queue (EngineBusy -> 503 + Retry-After)
+  - per-job timeouts (AnalysisTimeout -> 504)
+  - worker recycling after N jobs
+  - an explicit native thread budget: OpenCV and BLAS start one internal
+    thread per core by default, so N concurrent analyses oversubscribed the
+    machine N times. Each worker gets cores / workers native threads instead:
+      inter  one worker per core, single-threaded analyses (max throughput)
+      intra  one worker using every core for one image (lowest latency)
+  - weighted fair dispatch: admitted jobs wait in a FairQueue and free
+    workers take them interleaved across clients (weighted by their share),
+    so one client's backlog cannot starve everybody else
+
+Configuration (environment variables):
+  ANALYSIS_EXECUTOR      "thread" (default) or "process"
+  ANALYSIS_PARALLELISM   "inter" (default) or "intra"
+  ANALYSIS_WORKERS       worker count (default: cores for inter, 1 for intra)
+  ANALYSIS_NATIVE_THREADS  OpenCV/BLAS threads per worker (default: cores / workers,
+                         0 = leave the library defaults alone)
+  ANALYSIS_QUEUE_SIZE    jobs allowed to wait for a worker (default: 2 * workers)
+  ANALYSIS_TIMEOUT       seconds a request waits for its result (default: 30)
+  ANALYSIS_MAX_JOBS      recycle workers after this many jobs (default: 500, 0 = never)
+  ANALYSIS_FAIR_QUEUE    "1" (default) dispatches fairly across clients, "0" first come, first served
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Thread limits read by OpenBLAS, MKL, BLIS, Accelerate, OpenMP and numexpr when loaded
+BLAS_THREAD_VARS = (
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS",
+)
+
+
+def available_cores() -> int:
+    """Cores this process may run on (respects CPU affinity, unlike os.cpu_count())."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:  # Not available on macOS/Windows
+        return os.cpu_count() or 1
+
+
+def limit_native_threads(threads: int):
+    """
+    Cap the internal thread pools of OpenCV and BLAS in the current process.
+
+    BLAS libraries size their pools from the environment when NumPy is first
+    imported, so the engine also exports BLAS_THREAD_VARS before any worker
+    imports it; threadpoolctl, if installed, resizes pools already loaded.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        pass
+    import cv2
+    cv2.setNumThreads(threads)
+
+
+def _init_worker(native_threads, initializer, initargs):
+    # Runs at the start of every worker thread/process, before any job
+    if native_threads:
+        limit_native_threads(native_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class EngineBusy(Exception):
+    """Raised when the admission queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Analysis queue is full")
+        self.retry_after = retry_after
+
+
+class AnalysisTimeout(Exception):
+    """Raised when a job does not finish within the configured timeout."""
+
+
+def _timed_call(fn, args, kwargs):
+    # Runs inside the worker: report the pure compute time back to the engine
+    # so Retry-After estimates are not inflated by queueing.
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class FairQueue:
+    """
+    Weighted fair dispatch of admitted jobs to a fixed number of slots.
+
+    Start-time fair queuing: a client's jobs get virtual start tags spaced
+    1/weight apart, never earlier than the tag dispatched last, and a free
+    slot always takes the smallest tag. Clients with a backlog get their
+    weighted share while others wait, and everything when they are alone.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._busy = 0
+        self._heap = []      # (tag, seq, future) of waiting jobs
+        self._finish = {}    # client -> tag following its latest job
+        self._vtime = 0.0    # tag of the job dispatched last
+        self._seq = itertools.count()
+        self._loop = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(not future.done() for _, _, future in self._heap)
+
+    async def acquire(self, client=None, weight: float = 1.0):
+        """Wait for a slot; release() it when the job is finished."""
+        self._loop = asyncio.get_running_loop()
+        if len(self._finish) > 10000:
+            # Forget idle clients (no job tagged after the current virtual time)
+            self._finish = {c: tag for c, tag in self._finish.items() if tag > self._vtime}
+        tag = max(self._vtime, self._finish.get(client, 0.0))
+        self._finish[client] = tag + 1.0 / max(weight, 1e-3)
+
+        future = self._loop.create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted, but the waiter gave up in the meantime
+            raise
+
+    def _dispatch(self):
+        while self._heap and self._busy < self.slots:
+            tag, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue  # Waiter timed out or went away
+            self._busy += 1
+            self._vtime = tag
+            future.set_result(None)
+
+    def release(self):
+        self._busy -= 1
+        self._dispatch()
+
+    def release_threadsafe(self):
+        """release() from an executor callback thread."""
+        try:
+            self._loop.call_soon_threadsafe(self.release)
+        except RuntimeError:
+            pass  # Event loop already closed (shutdown)
+
+
+class AnalysisEngine:
+    def __init__(self, mode="thread", workers=None, queue_size=None, timeout=30.0,
+                 max_jobs_per_worker=500, initializer=None, initargs=(), parallelism="inter",
+                 native_threads=None, tile_workers=None, fair=True):
+        """
+        Args:
+            parallelism: "inter" (default workers = cores) or "intra" (default workers = 1)
+            native_threads: OpenCV/BLAS threads per worker (None = cores // workers, 0 = unmanaged)
+            tile_workers: Threads for tiled analysis (None = the native budget of a process,
+                all cores for the shared pool of the thread executor)
+            fair: Dispatch admitted jobs through a FairQueue (per-client interleaving)
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown executor mode: {mode}")
+        if parallelism not in ("inter", "intra"):
+            raise ValueError(f"Unknown parallelism: {parallelism}")
+        self.mode = mode
+        self.parallelism = parallelism
+        cores = available_cores()
+        self.workers = max(1, workers or (cores if parallelism == "inter" else 1))
+        self.native_threads = max(1, cores // self.workers) if native_threads is None else native_threads
+        if tile_workers is None and self.native_threads:
+            # forensics' tile pool is per process: shared by every worker thread
+            tile_workers = cores if mode == "thread" else self.native_threads
+        self.tile_workers = tile_workers
+        self.queue_size = max(0, self.workers * 2 if queue_size is None else queue_size)
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker or 0
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self._fair = FairQueue(self.workers) if fair else None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0          # admitted jobs not yet finished (running + waiting)
+        self._jobs_since_recycle = 0
+        self._avg_job_seconds = 0.5  # EWMA of compute time, seeds Retry-After
+
+        # Counters for operators
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls, **overrides):
+        workers = int(os.environ.get("ANALYSIS_WORKERS", "0")) or None
+        queue_size = os.environ.get("ANALYSIS_QUEUE_SIZE")
+        native_threads = os.environ.get("ANALYSIS_NATIVE_THREADS")
+        tile_workers = int(os.environ.get("ANALYSIS_TILE_WORKERS", "0")) or None
+        config = {
+            "mode": os.environ.get("ANALYSIS_EXECUTOR", "thread").lower(),
+            "parallelism": os.environ.get("ANALYSIS_PARALLELISM", "inter").lower(),
+            "workers": workers,
+            "native_threads": int(native_threads) if native_threads is not None else None,
+            "tile_workers": tile_workers,
+            "queue_size": int(queue_size) if queue_size is not None else None,
+            "timeout": float(os.environ.get("ANALYSIS_TIMEOUT", "30")),
+            "max_jobs_per_worker": int(os.environ.get("ANALYSIS_MAX_JOBS", "500")),
+            "fair": os.environ.get("ANALYSIS_FAIR_QUEUE", "1") == "1",
+        }
+        config.update(overrides)
+        return cls(**config)
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    @property
+    def avg_job_seconds(self) -> float:
+        """Moving average of the pure compute time per job."""
+        return self._avg_job_seconds
+
+    @property
+    def queue_depth(self) -> int:
+        """Admitted jobs that are waiting for a free worker."""
+        return max(0, self._in_flight - self.workers)
+
+    def _export_thread_budget(self):
+        # Read when NumPy and forensics are first imported: lazily in this process
+        # (thread executor) or at start-up of each worker process
+        if not self.native_threads:
+            return
+        for var in BLAS_THREAD_VARS:
+            os.environ[var] = str(self.native_threads)
+        if self.tile_workers:
+            os.environ["ANALYSIS_TILE_WORKERS"] = str(self.tile_workers)
+        if self.parallelism == "intra" and self.tile_workers > 1:
+            # Tiles are the unit of parallelism inside one image (exact, same scores)
+            os.environ.setdefault("ANALYSIS_TILED", "on")
+
+    def _create_executor(self):
+        self._export_thread_budget()
+        initargs = (self.native_threads, self.initializer, self.initargs)
+        if self.mode == "process":
+            # max_tasks_per_child recycles each worker process natively; it
+            # requires a non-fork start method.
+            kwargs = {}
+            if self.max_jobs_per_worker:
+                kwargs["max_tasks_per_child"] = self.max_jobs_per_worker
+                kwargs["mp_context"] = multiprocessing.get_context("spawn")
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=initargs,
+                **kwargs,
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="analysis",
+            initializer=_init_worker,
+            initargs=initargs,
+        )
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+        logging.info(
+            f"Analysis engine started: {self.mode} x{self.workers} ({self.parallelism}, "
+            f"{self.native_threads or 'default'} native threads each), "
+            f"queue={self.queue_size}, timeout={self.timeout}s"
+        )
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            # Thread pools have no max_tasks_per_child: swap in a fresh pool
+            # every N jobs and let the old one drain in the background.
+            elif (self.mode == "thread" and self.max_jobs_per_worker
+                  and self._jobs_since_recycle >= self.max_jobs_per_worker * self.workers):
+                old, self._executor = self._executor, self._create_executor()
+                self._jobs_since_recycle = 0
+                old.shutdown(wait=False)
+            self._jobs_since_recycle += 1
+            return self._executor
+
+    def _reset_broken_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up."""
+        backlog = self._in_flight - self.capacity + 1
+        waves = max(1, math.ceil(max(backlog, self.workers) / self.workers))
+        return max(1, math.ceil(waves * self._avg_job_seconds))
+
+    def _admit(self):
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise EngineBusy(self.retry_after())
+            self._in_flight += 1
+
+    def _release(self, future):
+        if self._fair is not None:
+            self._fair.release_threadsafe()
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                return
+            _, elapsed = future.result()
+            self.completed += 1
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    async def run(self, fn, *args, client=None, weight=1.0, queue_wait=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the engine.
+
+        Args:
+            client: Who the job is for; jobs are dispatched fairly across clients
+            weight: The client's relative share of the workers
+            queue_wait: Seconds the job may wait for a worker before its timeout
+                starts (default: None, the timeout covers waiting and running).
+                Background jobs pass a wait to queue instead of failing.
+
+        Raises:
+            EngineBusy: The admission queue is full, or no worker was free
+                within queue_wait
+            AnalysisTimeout: The job exceeded the configured timeout
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        if self._fair is not None:
+            # Admitted jobs wait here, not in the executor queue, so free
+            # workers pick the next job by fair share instead of arrival
+            try:
+                await asyncio.wait_for(self._fair.acquire(client, weight),
+                                       self.timeout if queue_wait is None else queue_wait)
+            except BaseException as e:
+                with self._lock:
+                    self._in_flight -= 1
+                if isinstance(e, asyncio.TimeoutError):
+                    if queue_wait is not None:
+                        # The job never started: no capacity, not a slow analysis
+                        self.rejected += 1
+                        raise EngineBusy(self.retry_after())
+                    self.timed_out += 1
+                    raise AnalysisTimeout(f"Analysis exceeded {self.timeout}s")
+                raise
+            if queue_wait is not None:
+                deadline = loop.time() + self.timeout
+        elif queue_wait is not None:
+            # No dispatch point to restart the clock at: the job may spend
+            # queue_wait in the executor queue on top of its timeout
+            deadline += queue_wait
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_timed_call, fn, args, kwargs)
+        except BaseException:
+            with self._lock:
+                self._in_flight -= 1
+            if self._fair is not None:
+                self._fair.release()
+            raise
+
+        # The slot is released when the job really finishes, not when the caller
+        # gives up, so a timed-out job still counts against capacity.
+        future.add_done_callback(self._release)
+
+        try:
+            result, _ = await asyncio.wait_for(asyncio.wrap_future(future), max(0.0, deadline - loop.time()))
+            return result
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            future.cancel()  # Only succeeds if the job has not started yet
+            raise AnalysisTimeout(f"Analysis exceeded {self.timeout}s")
+        except BrokenProcessPool:
+            self.failed += 1
+            self._reset_broken_executor(executor)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+    async def warm_up(self, fn, *args):
+        """
+        Start every worker by submitting fn(*args) once per worker at the same time.
+
+        Pools spawn workers on demand, so concurrent jobs make them start (and
+        run the initializer) now instead of on the first real requests. Bypasses
+        admission and is not counted in the job stats.
+
+        Returns:
+            The results of the warm-up jobs
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            executor = self._executor
+        futures = [executor.submit(fn, *args) for _ in range(self.workers)]
+        return await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "parallelism": self.parallelism,
+            "workers": self.workers,
+            "native_threads": self.native_threads,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "fair_waiting": self._fair.waiting if self._fair is not None else None,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "avg_job_seconds": round(self._avg_job_seconds, 4),
+        }
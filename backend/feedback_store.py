@@ -0,0 +1,378 @@
+"""
+Local Feedback Store - SQLite (WAL) fallback used when Supabase is not configured.
+
+Replaces the read-whole-file / append / rewrite-whole-file cycle on
+feedback_local.json:
+  - O(1) inserts regardless of how many records exist
+  - safe concurrent writers (threads and uvicorn worker processes)
+  - batched fsync: commits only reach the WAL (synchronous=NORMAL); a
+    background checkpoint makes them durable every FEEDBACK_SYNC_INTERVAL seconds
+  - one-time migration of the legacy JSON array file (left untouched on disk)
+  - keyset-paginated reads plus incremental CSV / NDJSON / Parquet encoders,
+    so admin exports stream in constant memory
+  - a spill table for records the Supabase writer could not deliver; they
+    are claimed, replayed and deleted by feedback_writer.FeedbackWriter
+
+Configuration (environment variables):
+  FEEDBACK_DB               SQLite file (default: feedback_local.db)
+  FEEDBACK_SYNC_INTERVAL    seconds between durability checkpoints (default: 1.0)
+"""
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import orjson
+
+# Column order matches the legacy JSON records (and the CSV export)
+FIELDS = ("filename", "ai_score", "user_verdict", "actual_category", "comments", "contribute_data", "timestamp")
+
+LEGACY_JSON_FILE = "feedback_local.json"
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class LocalFeedbackStore:
+    def __init__(self, path: str = "feedback_local.db", legacy_json: str = LEGACY_JSON_FILE,
+                 sync_interval: float = 1.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback ("
+            "  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  filename TEXT,"
+            "  ai_score INTEGER,"
+            "  user_verdict TEXT,"
+            "  actual_category TEXT,"
+            "  comments TEXT,"
+            "  contribute_data INTEGER,"
+            "  timestamp TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS feedback_timestamp ON feedback (timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS feedback_verdict ON feedback (user_verdict)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Undelivered Supabase records (whole record as orjson); claimed_until
+        # leases a row to one replaying process at a time
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback_spill ("
+            "  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  record BLOB NOT NULL,"
+            "  claimed_until REAL)"
+        )
+
+        if legacy_json:
+            self.migrate_legacy_json(legacy_json)
+
+        self._syncer = threading.Thread(target=self._sync_loop, name="feedback-sync", daemon=True)
+        self._syncer.start()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.environ.get("FEEDBACK_DB", "feedback_local.db"),
+            sync_interval=float(os.environ.get("FEEDBACK_SYNC_INTERVAL", "1.0")),
+        )
+
+    @staticmethod
+    def _row(record: dict) -> tuple:
+        values = [record.get(field) for field in FIELDS]
+        contribute = values[FIELDS.index("contribute_data")]
+        values[FIELDS.index("contribute_data")] = None if contribute is None else int(bool(contribute))
+        return tuple(values)
+
+    @staticmethod
+    def _record(row) -> dict:
+        record = dict(zip(FIELDS, row))
+        if record["contribute_data"] is not None:
+            record["contribute_data"] = bool(record["contribute_data"])
+        return record
+
+    def migrate_legacy_json(self, json_path: str) -> int:
+        """Import the old JSON array file once; returns the number of imported records."""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock:
+            # IMMEDIATE takes the write lock first, so concurrent workers migrate once
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = self._conn.execute(
+                    "SELECT value FROM store_meta WHERE key = 'migrated_json'"
+                ).fetchone()
+                if done:
+                    self._conn.execute("COMMIT")
+                    return 0
+                try:
+                    with open(json_path, "r") as f:
+                        records = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.warning(f"Skipping feedback migration from {json_path}: {e}")
+                    records = []
+                if isinstance(records, dict):
+                    records = [records]
+                self._conn.executemany(
+                    f"INSERT INTO feedback ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                    (self._row(r) for r in records if isinstance(r, dict))
+                )
+                self._conn.execute(
+                    "INSERT INTO store_meta (key, value) VALUES ('migrated_json', ?)", (os.path.abspath(json_path),)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logging.info(f"Migrated {len(records)} feedback records from {json_path} to {self.path}")
+        return len(records)
+
+    def insert(self, record: dict):
+        """Append one feedback record (O(1), no fsync on the request path)."""
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO feedback ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                self._row(record)
+            )
+            self._dirty = True
+
+    def insert_many(self, records: list):
+        """Append several records in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT INTO feedback ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                    [self._row(record) for record in records]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._dirty = True
+
+    def spill_many(self, records: list):
+        """Keep records the Supabase writer could not deliver, for a later replay."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO feedback_spill (record) VALUES (?)", [(orjson.dumps(record),) for record in records]
+            )
+            self._dirty = True
+
+    def claim_spilled(self, limit: int, lease: float = 60.0):
+        """
+        Up to limit spilled (id, record) pairs, oldest first, leased for lease
+        seconds so other worker processes skip them. delete_spilled() them once
+        delivered, release_spilled() them otherwise; expired leases are reclaimed.
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock first, so two workers never claim the same rows
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, record FROM feedback_spill WHERE claimed_until IS NULL OR claimed_until < ?"
+                    " ORDER BY id LIMIT ?",
+                    (now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE feedback_spill SET claimed_until = ? WHERE id = ?", [(now + lease, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(row_id, orjson.loads(record)) for row_id, record in rows]
+
+    def release_spilled(self, ids: list):
+        with self._lock:
+            self._conn.executemany("UPDATE feedback_spill SET claimed_until = NULL WHERE id = ?", [(i,) for i in ids])
+
+    def delete_spilled(self, ids: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM feedback_spill WHERE id = ?", [(i,) for i in ids])
+            self._dirty = True
+
+    def spilled_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM feedback_spill").fetchone()[0]
+
+    @staticmethod
+    def _where(since: str = None, until: str = None, verdict: str = None):
+        clauses, params = [], []
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if verdict:
+            clauses.append("user_verdict = ?")
+            params.append(verdict)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, since: str = None, until: str = None, verdict: str = None) -> int:
+        where, params = self._where(since, until, verdict)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM feedback{where}", params).fetchone()[0]
+
+    def page(self, limit: int = 100, offset: int = 0, since: str = None, until: str = None,
+             verdict: str = None) -> list:
+        """
+        One page of records, newest first.
+
+        Args:
+            limit, offset: Page window
+            since, until: ISO timestamp bounds (since inclusive, until exclusive)
+            verdict: Only records with this user_verdict
+        """
+        where, params = self._where(since, until, verdict)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM feedback{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def iter_pages(self, page_size: int = 500, since: str = None, until: str = None, verdict: str = None):
+        """
+        Yield every matching record in pages of page_size, newest first.
+
+        Uses keyset pagination on id, so each page is an index seek (no OFFSET
+        scan) and rows inserted during an export never shift the window.
+        """
+        where, params = self._where(since, until, verdict)
+        where = where + (" AND " if where else " WHERE ")
+        last_id = None
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, {', '.join(FIELDS)} FROM feedback{where}id < ? ORDER BY id DESC LIMIT ?",
+                    params + [last_id if last_id is not None else 2 ** 63 - 1, page_size]
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [self._record(row[1:]) for row in rows]
+            if len(rows) < page_size:
+                return
+
+    def sync(self):
+        """Make all committed records durable (checkpoint the WAL, which fsyncs)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.sync_interval):
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                logging.warning(f"Feedback store sync failed: {e}")
+
+    def close(self):
+        self._closed.set()
+        self.sync()
+        with self._lock:
+            self._conn.close()
+
+
+class _ChunkSink:
+    """Write-only file object that hands ParquetWriter output back in chunks."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def encode_pages(pages, fmt: str = "csv", fields=None):
+    """
+    Turn an async iterator of record pages into export bytes, one page at a time.
+
+    Args:
+        pages: Async iterator yielding lists of record dicts
+        fmt: One of EXPORT_FORMATS
+        fields: Column order (default: keys of the first record)
+
+    Yields:
+        Encoded chunks; only one page is held in memory at a time
+    """
+    if fmt == "ndjson":
+        async for page in pages:
+            yield b"".join(orjson.dumps(record) + b"\n" for record in page)
+        return
+
+    if fmt == "parquet":
+        # Optional dependency, only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        sink = _ChunkSink()
+        writer = None
+        try:
+            async for page in pages:
+                if writer is None:
+                    # Schema from the first page; all-null columns become strings
+                    schema = pa.Table.from_pylist(page).schema
+                    columns = fields or schema.names
+                    schema = pa.schema([
+                        (name, pa.string() if pa.types.is_null(schema.field(name).type) else schema.field(name).type)
+                        for name in columns
+                    ])
+                    writer = pq.ParquetWriter(sink, schema)
+                # One row group per page
+                writer.write_table(pa.Table.from_pylist(page, schema=schema))
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        finally:
+            if writer is not None:
+                writer.close()
+        yield sink.drain()
+        return
+
+    buffer = io.StringIO()
+    writer = None
+    async for page in pages:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(fields or page[0].keys()), extrasaction="ignore")
+            writer.writeheader()
+        for record in page:
+            writer.writerow(record)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
@@ -0,0 +1,262 @@
+"""
+Feedback Writer - asynchronous, batched inserts into the Supabase feedback table.
+
+submit_feedback() used to call the synchronous supabase client inside the event
+loop, blocking every other request for a full network round trip. Instead:
+  - the endpoint only enqueues the record (non-blocking) and returns
+  - a background task flushes batches as one multi-row PostgREST insert when
+    FEEDBACK_BATCH_SIZE records are queued or FEEDBACK_FLUSH_INTERVAL seconds passed
+  - one httpx.AsyncClient keeps the HTTPS connection alive between flushes
+  - transient failures (network, 408/429/5xx) are retried with exponential backoff;
+    batches that still fail, and records arriving while the queue is full, are
+    spilled to the local feedback store so nothing is lost
+  - spilled records are replayed to Supabase when the writer starts and after
+    every successful insert, then deleted locally (at least once: a crash
+    between the insert and the delete sends them again)
+
+The writer talks to the PostgREST endpoint (SUPABASE_URL/rest/v1/feedback)
+directly, so it can be pointed at any local stub HTTP server for testing.
+
+Configuration (environment variables):
+  FEEDBACK_BATCH_SIZE       records per insert (default: 50)
+  FEEDBACK_FLUSH_INTERVAL   max seconds a record waits before a flush (default: 1.0)
+  FEEDBACK_QUEUE_SIZE       records buffered in memory (default: 10000)
+  FEEDBACK_MAX_RETRIES      retries per batch before spilling (default: 5)
+"""
+import asyncio
+import logging
+import os
+import random
+from typing import Callable, List, Optional
+
+import httpx
+
+
+# Statuses worth retrying; any other 4xx will fail the same way again
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+MAX_BACKOFF = 30.0
+
+_STOP = object()
+
+
+class FeedbackWriter:
+    def __init__(self, url: str, key: str, table: str = "feedback", batch_size: int = 50,
+                 flush_interval: float = 1.0, queue_size: int = 10000, max_retries: int = 5,
+                 backoff: float = 0.5, spill_store: Optional[Callable[[], object]] = None,
+                 exclude_fields=("timestamp",), client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            url, key: Supabase project URL and API key
+            spill_store: Returns the local store (feedback_store.LocalFeedbackStore)
+                undeliverable records are spilled to and replayed from; called
+                in a thread, so the store is only opened when first needed
+            exclude_fields: Record keys not sent to the table (Supabase sets created_at itself)
+            client: Pre-configured AsyncClient (tests); created on start() otherwise
+        """
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/{table}"
+        self.key = key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.spill_store = spill_store
+        self.exclude_fields = set(exclude_fields)
+
+        self._client = client
+        self._owns_client = client is None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spill_tasks = set()
+
+        self._written = 0
+        self._batches = 0
+        self._retries = 0
+        self._spilled = 0
+        self._replayed = 0
+        self._replay_pending = spill_store is not None  # Check for leftovers on start
+
+    @classmethod
+    def from_env(cls, url: str, key: str, spill_store=None):
+        return cls(
+            url, key,
+            batch_size=int(os.environ.get("FEEDBACK_BATCH_SIZE", "50")),
+            flush_interval=float(os.environ.get("FEEDBACK_FLUSH_INTERVAL", "1.0")),
+            queue_size=int(os.environ.get("FEEDBACK_QUEUE_SIZE", "10000")),
+            max_retries=int(os.environ.get("FEEDBACK_MAX_RETRIES", "5")),
+            spill_store=spill_store,
+        )
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "apikey": self.key,
+                    "Authorization": f"Bearer {self.key}",
+                    "Content-Type": "application/json",
+                    "Prefer": "return=minimal",
+                },
+                timeout=httpx.Timeout(10.0),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2),
+            )
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run(), name="feedback-writer")
+
+    def submit(self, record: dict):
+        """Queue one record; never blocks (spills to the local store when the queue is full)."""
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._spill_later([record])
+
+    async def stop(self, timeout: float = 10.0):
+        """Flush what is queued within timeout seconds, spill the rest, then close the connection."""
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            # A full queue (remote down) only frees up as fast as batches are
+            # written, so waiting for room counts against the same timeout
+            await asyncio.wait_for(self._queue.put(_STOP), timeout)
+            await asyncio.wait_for(self._task, max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            logging.warning("Feedback writer did not drain in time, spilling the rest locally")
+            # The batch being written spills itself when cancelled
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            leftover = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    leftover.append(item)
+            if leftover:
+                await self._spill(leftover)
+        self._task = None
+        if self._spill_tasks:
+            await asyncio.gather(*self._spill_tasks, return_exceptions=True)
+        if self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        await self._replay()
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # Take what is already queued without waiting
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+    async def _insert(self, batch: List[dict], max_retries: int) -> Optional[str]:
+        """One multi-row insert with up to max_retries retries; the last error, or None on success."""
+        payload = [
+            {k: v for k, v in record.items() if k not in self.exclude_fields} for record in batch
+        ]
+        for attempt in range(max_retries + 1):
+            try:
+                response = await self._client.post(self.endpoint, json=payload)
+                if response.status_code < 300:
+                    self._batches += 1
+                    return None
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                retryable = response.status_code in RETRYABLE_STATUS
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+                retryable = True
+
+            if not retryable or attempt == max_retries:
+                return error
+            self._retries += 1
+            # Exponential backoff with jitter so workers do not retry in lockstep
+            delay = min(MAX_BACKOFF, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(delay)
+
+    async def _write(self, batch: List[dict]):
+        try:
+            error = await self._insert(batch, self.max_retries)
+        except asyncio.CancelledError:
+            await asyncio.shield(self._spill(batch))
+            raise
+        if error is None:
+            self._written += len(batch)
+            # Supabase is reachable again: deliver what was spilled meanwhile
+            await self._replay()
+            return
+        logging.error(f"Feedback insert failed ({error}), spilling {len(batch)} records to the local store")
+        await self._spill(batch)
+
+    async def _replay(self):
+        """Send spilled records to Supabase batch by batch until none are left or an insert fails."""
+        if not self._replay_pending:
+            return
+        while True:
+            try:
+                store = await asyncio.to_thread(self.spill_store)
+                claimed = await asyncio.to_thread(store.claim_spilled, self.batch_size)
+            except Exception as e:
+                logging.error(f"Could not read spilled feedback: {e}")
+                return
+            if not claimed:
+                self._replay_pending = False
+                return
+            ids = [row_id for row_id, _ in claimed]
+            try:
+                # No retries: the records are safe locally, the next successful insert tries again
+                error = await self._insert([record for _, record in claimed], 0)
+            except BaseException:
+                await asyncio.shield(asyncio.to_thread(store.release_spilled, ids))
+                raise
+            if error is not None:
+                await asyncio.to_thread(store.release_spilled, ids)
+                logging.warning(f"Replaying spilled feedback failed ({error}), will retry")
+                return
+            await asyncio.to_thread(store.delete_spilled, ids)
+            self._replayed += len(ids)
+            logging.info(f"Replayed {len(ids)} spilled feedback records")
+
+    async def _spill(self, records: List[dict]):
+        self._spilled += len(records)
+        if self.spill_store is None:
+            logging.error(f"Dropped {len(records)} feedback records (no local store configured)")
+            return
+        try:
+            await asyncio.to_thread(lambda: self.spill_store().spill_many(records))
+            self._replay_pending = True
+        except Exception as e:
+            logging.error(f"Feedback spill failed, {len(records)} records lost: {e}")
+
+    def _spill_later(self, records: List[dict]):
+        task = asyncio.create_task(self._spill(records))
+        self._spill_tasks.add(task)
+        task.add_done_callback(self._spill_tasks.discard)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self._written,
+            "batches": self._batches,
+            "retries": self._retries,
+            "spilled": self._spilled,
+            "replayed": self._replayed,
+        }
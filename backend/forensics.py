@@ -1,72 +1,258 @@
 import cv2
 import numpy as np
-import base64
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger("forensics")
 
-def calculate_histogram_gaps(image_rgb, gap_threshold=0):
+# Bump whenever scoring or calibration changes: cached results are keyed on it
+ANALYSIS_VERSION = "4"
+
+# Analysis resolution (longest side) - the eigenvalue calibration assumes 2048px.
+# 0 analyzes at native resolution (scores are then not on the calibrated scale).
+TARGET_DIM = int(os.environ.get("ANALYSIS_TARGET_DIM", "2048"))
+
+# Decompression bomb guard, checked against the header before decoding
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(200_000_000)))
+
+# Opt-in: let libjpeg decode large JPEGs at 1/2, 1/4 or 1/8 scale. DCT-domain
+# scaling averages away part of the sensor noise the eigenvalue score measures,
+# so it stays off until the score is calibrated for reduced decodes
+REDUCED_DECODE = os.environ.get("REDUCED_DECODE", "0") == "1"
+# A reduced decode keeps at least this multiple of target_dim on its longest side
+REDUCED_DECODE_MARGIN = 2
+
+# ELA accuracy/speed: "full" re-encodes the whole image (the reference), "sampled"
+# re-encodes tiles until the estimate is within ELA_TOLERANCE (relative, 3 sigma);
+# test_ela.py checks that both reach the same ELA_AI_THRESHOLD decision
+ELA_MODE = os.environ.get("ELA_MODE", "full")
+ELA_TOLERANCE = float(os.environ.get("ELA_TOLERANCE", "0.05"))
+ELA_QUALITY = 90
+
+# Mean error level below which an image is treated as suspiciously resilient (see analyze_image)
+ELA_AI_THRESHOLD = 1.5
+
+# Sampled ELA geometry. The margin is one 4:2:0 MCU (16px): libjpeg's chroma
+# upsampling never reads past it, so each tile's error is bit-identical to
+# the same pixels in a full-image round trip.
+ELA_TILE = 256
+ELA_MARGIN = 16
+ELA_MIN_TILES = 8
+
+# Tiled analysis: per-tile statistics merged exactly, so peak memory follows the
+# tile size instead of the image size. "auto" tiles images of at least
+# ANALYSIS_TILED_MIN_PIXELS (i.e. when TARGET_DIM is raised or disabled).
+ANALYSIS_TILED = os.environ.get("ANALYSIS_TILED", "auto")
+TILED_MIN_PIXELS = int(os.environ.get("ANALYSIS_TILED_MIN_PIXELS", str(16_000_000)))
+# Multiple of the 16px JPEG MCU so per-tile ELA is exact
+TILE_SIZE = max(16, int(os.environ.get("ANALYSIS_TILE", "512")) // 16 * 16)
+TILE_WORKERS = int(os.environ.get("ANALYSIS_TILE_WORKERS", "0")) or os.cpu_count() or 1
+# Longest side of the gradient visualization when none is requested in tiled mode
+TILED_PREVIEW_DIM = 2048
+
+# Early-exit cascade (opt-in): score a sparse, deterministic sample of small
+# tiles first (CASCADE_FRACTION of the pixels - the budget of a 512px proxy of
+# a 2048px image, but at the calibrated resolution) and stop there when the
+# whole error interval maps to one classify_trust_score bucket
+ANALYSIS_CASCADE = os.environ.get("ANALYSIS_CASCADE", "0") == "1"
+CASCADE_FRACTION = float(os.environ.get("ANALYSIS_CASCADE_FRACTION", "0.0625"))
+CASCADE_TILE = 64
+CASCADE_MIN_TILES = 32
+CASCADE_Z = 3.0
+# ELA only feeds the 1.5 decision; this wide tolerance still samples every tile
+# (exact) within 25% of the threshold
+CASCADE_ELA_TOLERANCE = 0.25
+
+# Upper bounds of the classify_trust_score buckets (0-20, 21-40, ...)
+SCORE_BOUNDARIES = (20, 40, 49, 65, 85)
+
+# Perceptual hash of the near-duplicate index: "phash" (8x8 DCT signs) or "dhash"
+# (9x8 gradient signs); see dedup.py
+PERCEPTUAL_HASH = os.environ.get("NEAR_DUP_HASH", "phash")
+# Thumbnails flatter than this (std of 0-255 gray) get no hash: any two would match
+HASH_MIN_STD = 2.0
+
+# Near-duplicate index consulted by analyze_image() (dedup.NearDuplicateIndex).
+# Installed per process by the API's engine workers (startup.warm_worker); None = off
+near_duplicate_index = None
+
+
+class ImageTooLarge(ValueError):
+    """Header dimensions exceed MAX_IMAGE_PIXELS."""
+
+
+class UnreadableImageHeader(ValueError):
+    """The dimensions could not be read from the header, so the bomb guard cannot run."""
+
+
+def read_image_header(image_bytes):
     """
-    Detect Pixel Value Gaps (The Comb Effect) to identify retouching/color-grading.
-    Counts zero bins sandwiched between non-zero bins across all RGB channels.
-    Returns the total gap count across all channels (sum of gaps in R, G, B).
+    Read format and dimensions from the file header without decoding pixels.
+    
+    Supports JPEG (SOFn), PNG (IHDR), WebP (VP8/VP8L/VP8X), GIF, BMP and
+    TIFF (first IFD).
     
-    OPTIMIZED: Vectorized histogram gap detection using NumPy operations.
+    Returns:
+        (format, width, height) or None if the format is not recognised
     """
-    # Handle both RGB and grayscale images
-    if len(image_rgb.shape) == 3 and image_rgb.shape[2] == 3:
-        # RGB image - check all channels individually
-        channels = [image_rgb[:, :, 0], image_rgb[:, :, 1], image_rgb[:, :, 2]]
-    else:
-        # Grayscale or single channel
-        channels = [image_rgb]
+    data = memoryview(image_bytes)
+    size = len(data)
     
-    total_gap_count = 0
+    # PNG: fixed-position IHDR chunk
+    if size >= 24 and bytes(data[:8]) == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
     
-    for channel in channels:
-        # Convert to uint8 if needed (in-place operation where possible)
-        if channel.dtype != np.uint8:
-            channel_uint8 = np.clip(channel, 0, 255, out=None).astype(np.uint8)
-        else:
-            channel_uint8 = channel
-        
-        # Calculate histogram (256 bins for 0-255) - optimized cv2 call
-        hist = cv2.calcHist([channel_uint8], [0], None, [256], [0, 256])
-        hist = hist.flatten()  # Already a 1D array, but ensure it's contiguous
-        
-        # Vectorized gap detection (fully optimized)
-        # Find significant gaps (zero bins between non-zero bins)
-        min_pixel_count = np.max(hist) * 0.01  # Ignore gaps if surrounding bins are too small
-        
-        # Create boolean mask for zero bins (excluding first and last)
-        hist_middle = hist[1:255]  # Work with middle section
-        zero_mask = (hist_middle == 0)
-        
-        if not np.any(zero_mask):
-            continue  # No gaps in this channel
-        
-        # Vectorized before/after checks using NumPy rolling windows
-        # Pad hist to handle edge cases
-        hist_padded = np.pad(hist, (3, 3), mode='constant', constant_values=0)
-        
-        # Create rolling windows for before (3 bins) and after (3 bins)
-        # For each zero bin at position i (in original hist), check:
-        # - Before: hist_padded[i-1:i+2] (3 bins before)
-        # - After: hist_padded[i+4:i+7] (3 bins after)
-        zero_indices = np.where(zero_mask)[0] + 1  # +1 because we sliced [1:255], +3 for padding offset
-        zero_indices_padded = zero_indices + 3  # Account for padding
-        
-        # Vectorized checks: create arrays of before/after slices
-        before_windows = np.array([hist_padded[idx-3:idx] for idx in zero_indices_padded])
-        after_windows = np.array([hist_padded[idx+1:idx+4] for idx in zero_indices_padded])
-        
-        # Check if any bin in each window exceeds threshold
-        has_before = np.any(before_windows > min_pixel_count, axis=1)
-        has_after = np.any(after_windows > min_pixel_count, axis=1)
+    # JPEG: walk the marker segments up to the first Start Of Frame
+    if size >= 4 and bytes(data[:2]) == b"\xff\xd8":
+        pos = 2
+        while pos + 9 < size:
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:  # Fill byte
+                pos += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # Standalone markers
+                pos += 2
+                continue
+            (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+            # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+                return "jpeg", width, height
+            pos += 2 + length
+        return None
+    
+    # WebP: RIFF container with a lossy, lossless or extended first chunk
+    if size >= 30 and bytes(data[:4]) == b"RIFF" and bytes(data[8:12]) == b"WEBP":
+        chunk = bytes(data[12:16])
+        if chunk == b"VP8X":
+            width = 1 + int.from_bytes(data[24:27], "little")
+            height = 1 + int.from_bytes(data[27:30], "little")
+            return "webp", width, height
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        return None
+    
+    # GIF: logical screen size
+    if size >= 10 and bytes(data[:4]) == b"GIF8":
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+    
+    # BMP: BITMAPINFOHEADER (height is negative for top-down bitmaps)
+    if size >= 26 and bytes(data[:2]) == b"BM":
+        width, height = struct.unpack("<ii", data[18:26])
+        return "bmp", abs(width), abs(height)
+    
+    # TIFF: ImageWidth (256) and ImageLength (257) tags of the first IFD
+    if size >= 8 and bytes(data[:4]) in (b"II*\x00", b"MM\x00*"):
+        order = "<" if data[0] == ord("I") else ">"
+        (ifd,) = struct.unpack(order + "I", data[4:8])
+        if ifd + 2 > size:
+            return None
+        (entries,) = struct.unpack(order + "H", data[ifd:ifd + 2])
+        dims = {}
+        for pos in range(ifd + 2, min(ifd + 2 + 12 * entries, size - 11), 12):
+            tag, kind = struct.unpack(order + "HH", data[pos:pos + 4])
+            if tag in (256, 257):
+                # SHORT (3) or LONG (4), stored left-aligned in the value field
+                fmt = "H" if kind == 3 else "I"
+                dims[tag] = struct.unpack(order + fmt, data[pos + 8:pos + 8 + struct.calcsize(fmt)])[0]
+        if 256 in dims and 257 in dims:
+            return "tiff", dims[256], dims[257]
+        return None
+    
+    return None
+
+
+def decode_image(image_bytes, target_dim=TARGET_DIM, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Decode an upload to BGR, rejecting decompression bombs up front.
+    
+    With REDUCED_DECODE, JPEGs at least twice target_dim use the decoder's
+    DCT-domain scaling (IMREAD_REDUCED_COLOR_2/4/8), picking the strongest
+    reduction that keeps the longest side >= REDUCED_DECODE_MARGIN * target_dim.
+    The caller still resizes to exactly target_dim afterwards.
+    
+    Raises:
+        ImageTooLarge: Header dimensions exceed max_pixels
+        UnreadableImageHeader: No dimensions in the header (fails closed when max_pixels is set)
+        ValueError: The bytes could not be decoded
+    """
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    header = read_image_header(image_bytes)
+    flag = cv2.IMREAD_COLOR
+    
+    if header is None and max_pixels:
+        raise UnreadableImageHeader("Could not read the image dimensions")
+    
+    if header is not None:
+        fmt, width, height = header
+        if max_pixels and width * height > max_pixels:
+            raise ImageTooLarge(f"Image too large: {width}x{height} exceeds {max_pixels} pixels")
         
-        # Count gaps where both conditions are true
-        gap_count = np.sum(has_before & has_after)
+        # Only libjpeg scales during decode; other formats would be decoded at
+        # full size and resized internally, which gains nothing
+        if REDUCED_DECODE and fmt == "jpeg" and target_dim:
+            longest = max(width, height)
+            for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if longest // factor >= REDUCED_DECODE_MARGIN * target_dim:
+                    flag = reduced_flag
+                    break
+    
+    img = cv2.imdecode(nparr, flag)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def channel_histograms(image):
+    """
+    256-bin histogram of every channel, shape (channels, 256), float32.
+    
+    calcHist reads each channel straight from the interleaved buffer, so
+    no color conversion or channel split copy is made. Channel order
+    follows the image (BGR for OpenCV images); gap counts do not depend on it.
+    """
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    channels = image.shape[2] if image.ndim == 3 else 1
+    return np.stack([
+        cv2.calcHist([image], [c], None, [256], [0, 256]).ravel() for c in range(channels)
+    ])
+
+
+def calculate_histogram_gaps(image, gap_threshold=0, histograms=None):
+    """
+    Detect Pixel Value Gaps (The Comb Effect) to identify retouching/color-grading.
+    Counts zero bins sandwiched between non-zero bins across all color channels.
+    Returns the total gap count across all channels (sum of gaps in R, G, B).
+    
+    OPTIMIZED: All channels are checked at once (see count_histogram_gaps).
+    
+    Args:
+        image: BGR/RGB or single channel image (ignored when histograms is given)
+        gap_threshold: Gap count above which the image is flagged as retouched
+        histograms: Precomputed (channels, 256) histograms, e.g. from extract_features
         
-        # Sum gap count across all channels
-        total_gap_count += gap_count
+    Returns:
+        is_retouched, total_gap_count
+    """
+    if histograms is None:
+        histograms = channel_histograms(image)
+    
+    total_gap_count = count_histogram_gaps(histograms)
     
     # Flag as retouched if total gap count exceeds threshold
     is_retouched = total_gap_count > gap_threshold
@@ -74,7 +260,45 @@ def calculate_histogram_gaps(image_rgb, gap_threshold=0):
     return is_retouched, total_gap_count
 
 
-def calculate_ela_score(img):
+def count_histogram_gaps(histograms):
+    """
+    Count the significant gaps in one or more 256-bin channel histograms.
+    
+    A gap is a zero bin with a populated bin (> 1% of that channel's peak)
+    within 3 bins on both sides. Every channel is handled in the same NumPy
+    operations: a sliding-window max over the "populated" mask gives the
+    before/after checks for all 256 bins at once.
+    
+    Args:
+        histograms: (256,), (256, 1) or (channels, 256) histogram array
+        
+    Returns:
+        gap_count: Total number of gaps over all channels (int)
+    """
+    hists = np.asarray(histograms, dtype=np.float64).reshape(-1, 256)
+    
+    # Ignore gaps if surrounding bins are too small
+    min_pixel_count = hists.max(axis=1, keepdims=True) * 0.01
+    populated = hists > min_pixel_count
+    
+    # Zero bins, excluding the first and last
+    zero_mask = hists == 0
+    zero_mask[:, 0] = False
+    zero_mask[:, 255] = False
+    if not zero_mask.any():
+        return 0
+    
+    # window_any[:, j] is True when any of bins j-3..j-1 is populated
+    # (3 bins of padding on each side stand in for the out-of-range bins)
+    padded = np.pad(populated, ((0, 0), (3, 3)))
+    window_any = np.lib.stride_tricks.sliding_window_view(padded, 3, axis=1).max(axis=2)
+    has_before = window_any[:, 0:256]  # bins i-3..i-1
+    has_after = window_any[:, 4:260]   # bins i+1..i+3
+    
+    return int(np.count_nonzero(zero_mask & has_before & has_after))
+
+
+def calculate_ela_score(img, mode=None, tolerance=None, threshold=None):
     """
     Error Level Analysis (ELA) - Detects JPEG compression artifacts.
     
@@ -83,13 +307,21 @@ def calculate_ela_score(img):
     
     Args:
         img: BGR image (numpy array)
+        mode: "full" or "sampled" (default: ELA_MODE)
+        tolerance: Relative error bound for "sampled" (default: ELA_TOLERANCE)
+        threshold: Decision threshold the caller compares against; sampling
+            continues while the estimate is within the error bound of it
         
     Returns:
         ela_score: Mean error level (float)
     """
+    mode = mode or ELA_MODE
+    if mode == "sampled":
+        return sampled_ela_score(img, ELA_TOLERANCE if tolerance is None else tolerance, threshold)
+    
     # Step A: Take the original image img
     # Step B: Save it to a memory buffer as a JPEG at 90% quality
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), ELA_QUALITY]
     _, buffer = cv2.imencode('.jpg', img, encode_param)
     
     # Step C: Load it back (img_compressed)
@@ -111,52 +343,638 @@ def calculate_ela_score(img):
     return float(ela_score)
 
 
-def analyze_image(image_bytes):
-    # 1. Decode Image
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def _ela_tile(img, y0, y1, x0, x1):
+    """JPEG round trip of one tile (plus MCU margin); returns (error sum, values)."""
+    h, w = img.shape[:2]
+    cy0, cx0 = max(0, y0 - ELA_MARGIN), max(0, x0 - ELA_MARGIN)
+    cy1, cx1 = min(h, y1 + ELA_MARGIN), min(w, x1 + ELA_MARGIN)
+    crop = np.ascontiguousarray(img[cy0:cy1, cx0:cx1])
+    _, buffer = cv2.imencode('.jpg', crop, [int(cv2.IMWRITE_JPEG_QUALITY), ELA_QUALITY])
+    crop_compressed = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    inner = (slice(y0 - cy0, y1 - cy0), slice(x0 - cx0, x1 - cx0))
+    diff = cv2.absdiff(crop[inner], crop_compressed[inner])
+    return float(np.sum(cv2.sumElems(diff))), diff.size
+
+
+def sampled_ela_score(img, tolerance=ELA_TOLERANCE, threshold=None, z=3.0):
+    """
+    ELA estimated from a deterministic subsample of tiles.
     
-    if img is None:
-        raise ValueError("Could not decode image")
+    Tiles lie on a 16px-aligned grid and are visited in a fixed low-discrepancy
+    order (golden-ratio sequence), so the same image always yields the same
+    score. Tiles are added in rounds until the z-sigma standard error of the
+    mean error (with finite population correction) is below tolerance x score
+    and, when threshold is given, the estimate is more than tolerance x score
+    away from the threshold. If every tile ends up sampled the result equals the full
+    calculate_ela_score exactly.
+    
+    Args:
+        img: BGR image (numpy array)
+        tolerance: Relative error bound
+        threshold: Decision threshold the estimate must be clear of
+        z: Sigmas of the error bound
+        
+    Returns:
+        ela_score: Mean error level (float)
+    """
+    h, w = img.shape[:2]
+    rows, cols = -(-h // ELA_TILE), -(-w // ELA_TILE)
+    n_tiles = rows * cols
+    if n_tiles <= ELA_MIN_TILES:
+        return calculate_ela_score(img, mode="full")
+    
+    order = np.argsort((np.arange(n_tiles) * 0.6180339887498949) % 1.0, kind="stable")
+    sums = np.zeros(n_tiles)
+    counts = np.zeros(n_tiles)
+    
+    sampled = 0
+    while sampled < n_tiles:
+        batch = order[sampled:sampled + max(ELA_MIN_TILES, sampled // 2)]
+        for index in batch:
+            y0, x0 = (index // cols) * ELA_TILE, (index % cols) * ELA_TILE
+            sums[index], counts[index] = _ela_tile(img, y0, min(h, y0 + ELA_TILE), x0, min(w, x0 + ELA_TILE))
+        sampled += len(batch)
+        
+        taken = order[:sampled]
+        estimate = sums[taken].sum() / counts[taken].sum()
+        if sampled == n_tiles:
+            break
+        # Ratio estimator variance over the sampled tiles (tiles differ in size at the edges)
+        tile_means = sums[taken] / counts[taken]
+        weights = counts[taken] / counts[taken].mean()
+        spread = np.sqrt(np.sum((weights * (tile_means - estimate)) ** 2) / (sampled - 1))
+        error = z * spread / np.sqrt(sampled) * np.sqrt(1.0 - sampled / n_tiles)
+        bound = tolerance * max(estimate, 1e-6)
+        # Near the threshold keep going (all tiles = exact) rather than trust a
+        # variance estimated from a handful of tiles
+        if error <= bound and (threshold is None or abs(estimate - threshold) > bound):
+            break
+    
+    return float(estimate)
+
+
+def _eigenvalues_from_moments(n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy):
+    """Ascending eigenvalues of the gradient covariance, from exact integer sums."""
+    # Covariance from the exact sums: C = (N * S_ab - S_a * S_b) / (N * (N - 1)),
+    # identical to np.cov(M, rowvar=False) without the Nx2 float64 matrix
+    if n <= 1:
+        return 0.0, 0.0
+    denom = n * (n - 1)
+    c_xx = n * sum_gxx - sum_gx * sum_gx
+    c_yy = n * sum_gyy - sum_gy * sum_gy
+    c_xy = n * sum_gxy - sum_gx * sum_gy
+    
+    # Closed-form eigenvalues of the symmetric 2x2 matrix [[a, b], [b, c]].
+    # The larger one comes from the trace, the smaller one from det / larger
+    # (avoids cancellation); the determinant numerator is an exact integer.
+    trace = (c_xx + c_yy) / denom
+    spread = np.hypot((c_xx - c_yy) / denom, 2 * c_xy / denom)
+    val_2 = (trace + spread) / 2.0
+    if val_2 > 0:
+        val_1 = ((c_xx * c_yy - c_xy * c_xy) / (denom * denom)) / val_2
+    else:
+        val_1 = 0.0
+    return float(val_1), float(val_2)
+
+
+def _contrast_from_moments(n, sum_i, sum_ii):
+    """Population std of the luminance from exact integer sums."""
+    return float(np.sqrt((n * sum_ii - sum_i * sum_i) / (n * n))) if n else 0.0
+
+
+def extract_features(img, gray, band_rows=256, keep_magnitude=True, timings=None):
+    """
+    Fused feature extractor - one banded pass over the image.
+    
+    Replaces the float64 Sobel -> column_stack -> np.cov -> np.linalg.eig chain,
+    the three calcHist calls and the separate std/magnitude passes. Each band of
+    rows is processed once: int16 Sobel (exact for uint8 input), integer sums of
+    gx, gy, gx^2, gy^2, gx*gy, per-channel histograms, gray sums for the contrast
+    and (optionally) the float32 gradient magnitude. Temporaries are bounded by
+    the band size instead of the image size.
+    
+    Args:
+        img: BGR image (uint8 numpy array)
+        gray: Grayscale version of img (uint8 numpy array)
+        band_rows: Rows processed per band
+        keep_magnitude: Also fill a float32 gradient magnitude image
+        timings: Optional dict receiving "gradients" and "eigen" seconds
+        
+    Returns:
+        features: dict with "eigenvalues" (ascending pair of the gradient
+        covariance), "histograms" (B, G, R float32 256-bin arrays, same as
+        calcHist), "contrast" (std of gray) and "magnitude" (or None)
+    """
+    start = time.perf_counter()
+    h, w = gray.shape[:2]
+    
+    # Exact integer accumulators (Python ints never overflow)
+    n = 0
+    sum_gx = sum_gy = 0
+    sum_gxx = sum_gyy = sum_gxy = 0
+    sum_i = sum_ii = 0
+    hist_acc = np.zeros((3, 256), dtype=np.float64)
+    magnitude = np.empty((h, w), dtype=np.float32) if keep_magnitude else None
+    
+    for y0 in range(0, h, band_rows):
+        y1 = min(y0 + band_rows, h)
+        
+        # One halo row on each side so the 3x3 Sobel sees the real neighbours;
+        # at the true image border the band border matches the full-image border
+        top = max(y0 - 1, 0)
+        bottom = min(y1 + 1, h)
+        core = slice(y0 - top, y0 - top + (y1 - y0))
+        
+        gray_band = gray[top:bottom]
+        g_x = cv2.Sobel(gray_band, cv2.CV_16S, 1, 0, ksize=3)[core]
+        g_y = cv2.Sobel(gray_band, cv2.CV_16S, 0, 1, ksize=3)[core]
+        
+        # Gradient second moments. |g| <= 1020, so every partial dot product of a
+        # band stays far below 2**53 and float64 (BLAS) sums are exact integers.
+        g_x_flat = g_x.astype(np.float64).ravel()
+        g_y_flat = g_y.astype(np.float64).ravel()
+        n += g_x_flat.size
+        sum_gx += int(g_x_flat.sum())
+        sum_gy += int(g_y_flat.sum())
+        sum_gxx += int(np.dot(g_x_flat, g_x_flat))
+        sum_gyy += int(np.dot(g_y_flat, g_y_flat))
+        sum_gxy += int(np.dot(g_x_flat, g_y_flat))
+        
+        # Contrast (first and second moments of the luminance)
+        gray_flat = gray[y0:y1].astype(np.float64).ravel()
+        sum_i += int(gray_flat.sum())
+        sum_ii += int(np.dot(gray_flat, gray_flat))
+        
+        # Per-channel histograms straight from BGR (no RGB conversion copy)
+        img_band = img[y0:y1]
+        for c in range(3):
+            hist_acc[c] += cv2.calcHist([img_band], [c], None, [256], [0, 256]).ravel()
+        
+        if keep_magnitude:
+            magnitude[y0:y1] = cv2.magnitude(g_x.astype(np.float32), g_y.astype(np.float32))
+    
+    gradients_done = time.perf_counter()
+    
+    val_1, val_2 = _eigenvalues_from_moments(n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy)
+    contrast = _contrast_from_moments(n, sum_i, sum_ii)
+    
+    if timings is not None:
+        timings["gradients"] = gradients_done - start
+        timings["eigen"] = time.perf_counter() - gradients_done
+    
+    return {
+        "eigenvalues": (val_1, val_2),
+        "histograms": hist_acc.astype(np.float32),
+        "contrast": contrast,
+        "magnitude": magnitude,
+    }
+
+
+_tile_pool = None
+_tile_pool_lock = threading.Lock()
+
+
+def _get_tile_pool():
+    global _tile_pool
+    with _tile_pool_lock:
+        if _tile_pool is None:
+            _tile_pool = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="forensics-tile")
+        return _tile_pool
+
+
+def _gradient_moments(gray, core):
+    """
+    Exact integer moments of one gray region given with a 1px halo.
+    
+    Returns:
+        ((n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy, sum_i, sum_ii), g_x, g_y)
+        for the core (halo excluded); g_x / g_y are the int16 core gradients
+    """
+    g_x = cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3)[core]
+    g_y = cv2.Sobel(gray, cv2.CV_16S, 0, 1, ksize=3)[core]
+    
+    # Exact integer sums (float64 dot products of a tile stay far below 2**53)
+    g_x_flat = g_x.astype(np.float64).ravel()
+    g_y_flat = g_y.astype(np.float64).ravel()
+    gray_flat = gray[core].astype(np.float64).ravel()
+    moments = (
+        g_x_flat.size,
+        int(g_x_flat.sum()), int(g_y_flat.sum()),
+        int(np.dot(g_x_flat, g_x_flat)), int(np.dot(g_y_flat, g_y_flat)), int(np.dot(g_x_flat, g_y_flat)),
+        int(gray_flat.sum()), int(np.dot(gray_flat, gray_flat)),
+    )
+    return moments, g_x, g_y
+
+
+def _tile_features(img, y0, y1, x0, x1, with_ela, preview_scale):
+    """
+    Mergeable statistics of one tile (see tiled_features).
+    
+    The tile is read with a 1px halo on every side, so the 3x3 Sobel of each
+    core pixel sees exactly the neighbours it has in the full image (and the
+    same border reflection where the tile touches the image edge).
+    """
+    h, w = img.shape[:2]
+    top, left = max(y0 - 1, 0), max(x0 - 1, 0)
+    bottom, right = min(y1 + 1, h), min(x1 + 1, w)
+    core = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+    
+    # Grayscale is per pixel, so converting the tile equals cropping the full conversion
+    gray = cv2.cvtColor(img[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+    moments, g_x, g_y = _gradient_moments(gray, core)
+    
+    img_tile = img[y0:y1, x0:x1]
+    hist = np.stack([cv2.calcHist([img_tile], [c], None, [256], [0, 256]).ravel() for c in range(3)])
+    
+    # Tile origins are 16px aligned, so this is the exact full-image error of the tile
+    ela = _ela_tile(img, y0, y1, x0, x1) if with_ela else (0.0, 0)
+    
+    preview = None
+    if preview_scale is not None:
+        magnitude = cv2.magnitude(g_x.astype(np.float32), g_y.astype(np.float32))
+        mag_min, mag_max, _, _ = cv2.minMaxLoc(magnitude)
+        py0, py1 = int(y0 * preview_scale), max(int(y0 * preview_scale) + 1, int(y1 * preview_scale))
+        px0, px1 = int(x0 * preview_scale), max(int(x0 * preview_scale) + 1, int(x1 * preview_scale))
+        preview = (py0, py1, px0, px1, mag_min, mag_max,
+                   cv2.resize(magnitude, (px1 - px0, py1 - py0), interpolation=cv2.INTER_AREA))
+    
+    return moments, hist, ela, preview
+
+
+def tiled_features(img, tile=TILE_SIZE, with_ela=False, preview_dim=None, timings=None):
+    """
+    Tiled, parallel version of extract_features for very large images.
+    
+    Every tile (tile x tile pixels, 16px aligned) yields integer gradient and
+    luminance moments, channel histograms and optionally its exact ELA error
+    sum; all of them are sums, so merging the tiles gives exactly the
+    full-image values. No full-size gray, gradient or magnitude image is ever
+    built: peak memory is the decoded image plus a few tiles in flight.
+    Tiles run on a shared thread pool (OpenCV and NumPy release the GIL).
+    
+    Args:
+        img: BGR image (uint8 numpy array)
+        tile: Tile side in pixels (multiple of 16)
+        with_ela: Also compute the full ELA score (ELA_MODE="full")
+        preview_dim: Longest side of the gradient preview, or None for no preview
+        timings: Optional dict receiving "gradients" and "eigen" seconds
+        
+    Returns:
+        features: extract_features keys ("magnitude" is None) plus "ela_score"
+        (None unless with_ela) and "gradient_preview" ((float32 image, min, max) or None)
+    """
+    start = time.perf_counter()
+    h, w = img.shape[:2]
+    
+    preview_scale = None
+    preview = None
+    if preview_dim:
+        preview_scale = min(1.0, preview_dim / max(h, w))
+        preview = np.zeros((max(1, int(h * preview_scale)), max(1, int(w * preview_scale))), dtype=np.float32)
+    
+    boxes = [(y0, min(y0 + tile, h), x0, min(x0 + tile, w)) for y0 in range(0, h, tile) for x0 in range(0, w, tile)]
+    moments = [0] * 8
+    hist_acc = np.zeros((3, 256), dtype=np.float64)
+    ela_sum, ela_count = 0.0, 0
+    mag_min, mag_max = np.inf, -np.inf
+    
+    pool = _get_tile_pool()
+    for tile_moments, hist, ela, tile_preview in pool.map(
+            lambda box: _tile_features(img, *box, with_ela, preview_scale), boxes):
+        moments = [total + value for total, value in zip(moments, tile_moments)]
+        hist_acc += hist
+        ela_sum += ela[0]
+        ela_count += ela[1]
+        if tile_preview is not None:
+            py0, py1, px0, px1, tile_min, tile_max, small = tile_preview
+            py1, px1 = min(py1, preview.shape[0]), min(px1, preview.shape[1])
+            preview[py0:py1, px0:px1] = small[:py1 - py0, :px1 - px0]
+            mag_min, mag_max = min(mag_min, tile_min), max(mag_max, tile_max)
+    
+    gradients_done = time.perf_counter()
+    n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy, sum_i, sum_ii = moments
+    val_1, val_2 = _eigenvalues_from_moments(n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy)
+    
+    if timings is not None:
+        timings["gradients"] = gradients_done - start
+        timings["eigen"] = time.perf_counter() - gradients_done
+    
+    return {
+        "eigenvalues": (val_1, val_2),
+        "histograms": hist_acc.astype(np.float32),
+        "contrast": _contrast_from_moments(n, sum_i, sum_ii),
+        "magnitude": None,
+        "ela_score": ela_sum / ela_count if with_ela and ela_count else None,
+        "gradient_preview": (preview, mag_min, mag_max) if preview is not None else None,
+    }
+
+
+def classify_trust_score(score: int) -> str:
+    """
+    Classify trust score into categories.
+    Returns the classification string.
+    """
+    if 0 <= score <= 20:
+        return "ai_generated"
+    elif 21 <= score <= 40:
+        return "likely_artificial"
+    elif 41 <= score <= 49:
+        return "mixed_signals"
+    elif 50 <= score <= 65:
+        return "low_quality_compressed"
+    elif 66 <= score <= 85:
+        return "digital_processed"
+    elif 86 <= score <= 100:
+        return "authentic_capture"
+    else:
+        # Fallback for edge cases
+        if score < 0:
+            return "ai_generated"
+        else:
+            return "authentic_capture"
+
+
+def _score_bucket(score):
+    """Index of the classify_trust_score bucket of an integer trust score."""
+    return sum(score > boundary for boundary in SCORE_BOUNDARIES)
+
+
+def score_from_metrics(base_score, is_edited_histogram, is_high_contrast, ela_score):
+    """
+    Final trust score from the individual metrics (steps 5-7 of analyze_image).
+    
+    Args:
+        base_score: Calibrated eigenvalue score (val_1 / 2000 * 100)
+        is_edited_histogram: Histogram gap check failed
+        is_high_contrast: RMS contrast check failed
+        ela_score: Mean ELA error (None when it cannot affect the result)
+        
+    Returns:
+        trust_score: int in 0..100
+    """
+    final_score = base_score
+    
+    # The "Authenticity Gate" (The Fix)
+    # If it looks real (High Score) BUT shows signs of editing:
+    if base_score > 85:
+        if is_edited_histogram or is_high_contrast:
+            # Force it down to "Retouched" category (Green)
+            # Cap at 80 (or 75 if both checks fail)
+            final_score = 80
+    
+    # If ela_score < 1.5 (Suspiciously resilient to compression):
+    # Cap Score at 45% (Ambiguous/AI).
+    # Override: Even if Entropy is high (100%), if ELA is low, it's likely a high-quality AI generation.
+    if ela_score is not None and ela_score < ELA_AI_THRESHOLD:
+        final_score = min(final_score, 45.0)  # Cap at 45% (Ambiguous/AI)
+    
+    # Ensure bounds
+    return max(0, min(100, int(final_score)))
+
+
+def cascade_estimate(gray, fraction=CASCADE_FRACTION, tile=CASCADE_TILE, z=CASCADE_Z):
+    """
+    Estimate the eigenvalues and contrast from a sparse sample of tiles.
+    
+    Tiles of tile x tile pixels are visited in a fixed golden-ratio order
+    (deterministic, spread over the whole frame). Error bars are z-sigma
+    delete-one jackknife errors over the sampled tiles with finite population
+    correction.
+    
+    Returns:
+        dict with "eigenvalues", "base_score", "base_error", "contrast",
+        "contrast_error" and "fraction" (of pixels sampled), or None when the
+        image is too small for sampling to pay off
+    """
+    h, w = gray.shape[:2]
+    rows, cols = -(-h // tile), -(-w // tile)
+    n_tiles = rows * cols
+    m = max(CASCADE_MIN_TILES, int(n_tiles * fraction))
+    if m * 2 > n_tiles:
+        return None
+    
+    order = np.argsort((np.arange(n_tiles) * 0.6180339887498949) % 1.0, kind="stable")[:m]
+    samples = []
+    for index in order:
+        y0, x0 = (index // cols) * tile, (index % cols) * tile
+        y1, x1 = min(h, y0 + tile), min(w, x0 + tile)
+        top, left = max(y0 - 1, 0), max(x0 - 1, 0)
+        halo = gray[top:min(y1 + 1, h), left:min(x1 + 1, w)]
+        moments, _, _ = _gradient_moments(halo, (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left)))
+        samples.append(moments)
+    
+    totals = [sum(values) for values in zip(*samples)]
+    
+    def estimate(moments):
+        n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy, sum_i, sum_ii = moments
+        val_1, val_2 = _eigenvalues_from_moments(n, sum_gx, sum_gy, sum_gxx, sum_gyy, sum_gxy)
+        return val_1, val_2, _contrast_from_moments(n, sum_i, sum_ii)
+    
+    val_1, val_2, contrast = estimate(totals)
+    leave_one_out = np.array([estimate([t - v for t, v in zip(totals, sample)]) for sample in samples])
+    jackknife = np.sqrt((m - 1) / m * np.sum((leave_one_out - leave_one_out.mean(axis=0)) ** 2, axis=0))
+    jackknife *= z * np.sqrt(1.0 - m / n_tiles)
+    
+    return {
+        "eigenvalues": (val_1, val_2),
+        "base_score": (val_1 / 2000.0) * 100,
+        "base_error": float(jackknife[0]) / 2000.0 * 100,
+        "contrast": contrast,
+        "contrast_error": float(jackknife[2]),
+        "fraction": sum(sample[0] for sample in samples) / (h * w),
+    }
+
+
+def cascade_decision(img, estimate, histograms):
+    """
+    Decide from a cascade_estimate whether the sample settles the result.
+    
+    The score is evaluated at both ends of the base score interval, at every
+    bucket boundary inside it and for both contrast outcomes when the contrast
+    interval straddles 75. ELA is only computed when it can matter (the cap
+    at 45 only bites above 45).
+    
+    Returns:
+        (trust_score, ela_score) when every candidate falls in the same
+        classify_trust_score bucket, else (None, ela_score)
+    """
+    base, error = estimate["base_score"], estimate["base_error"]
+    low, high = max(0.0, base - error), base + error
+    
+    is_edited_histogram, _ = calculate_histogram_gaps(None, gap_threshold=5, histograms=histograms)
+    contrast_flags = {estimate["contrast"] - estimate["contrast_error"] > 75,
+                      estimate["contrast"] + estimate["contrast_error"] > 75}
+    
+    ela_score = None
+    if high > 45:
+        ela_score = calculate_ela_score(img, tolerance=max(ELA_TOLERANCE, CASCADE_ELA_TOLERANCE),
+                                        threshold=ELA_AI_THRESHOLD)
+    
+    points = [low, high] + [b + d for b in SCORE_BOUNDARIES for d in (0, 1) if low <= b + d <= high]
+    buckets = {
+        _score_bucket(score_from_metrics(point, is_edited_histogram, flag, ela_score))
+        for point in points for flag in contrast_flags
+    }
+    if len(buckets) != 1:
+        return None, ela_score
+    return score_from_metrics(base, is_edited_histogram, estimate["contrast"] > 75, ela_score), ela_score
+
+
+def render_gradient(magnitude, preview_dim=None, value_range=None):
+    """
+    Encode the gradient magnitude as a JPEG for display.
+    
+    Args:
+        magnitude: float32 gradient magnitude from extract_features
+        preview_dim: Optional longest side of the preview (downscaled only)
+        value_range: (min, max) of the full-resolution magnitude when
+            magnitude is already a downscaled preview (tiled_features)
+        
+    Returns:
+        jpeg_bytes: Encoded visualization (bytes)
+    """
+    # Normalize for display
+    if value_range is None:
+        visual = cv2.normalize(magnitude, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    else:
+        low, high = value_range
+        alpha = 255.0 / (high - low) if high > low else 0.0
+        visual = cv2.convertScaleAbs(magnitude, alpha=alpha, beta=-low * alpha)
+    h, w = visual.shape[:2]
+    if preview_dim and max(h, w) > preview_dim:
+        scale = preview_dim / max(h, w)
+        visual = cv2.resize(visual, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', visual)
+    return buffer.tobytes()
+
+
+def perceptual_hash(image, method=PERCEPTUAL_HASH):
+    """
+    64-bit perceptual hash of a grayscale or BGR image.
+
+    Both methods work on an area-averaged 32x32 thumbnail, so re-encoding,
+    resizing, light crops and stripped metadata change only a few bits.
+
+    Returns:
+        The hash as an int, or None for (nearly) uniform images
+    """
+    h, w = image.shape[:2]
+    if h >= 32 and w >= 32:
+        # Centered crop to whole multiples of 32 makes INTER_AREA a plain box
+        # filter (~1 ms at 2048px instead of ~6); drops < 32 edge pixels
+        dy, dx = h % 32, w % 32
+        image = image[dy // 2:h - (dy - dy // 2), dx // 2:w - (dx - dx // 2)]
+    thumb = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA)
+    if thumb.ndim == 3:
+        thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    thumb = thumb.astype(np.float32)
+    if thumb.std() < HASH_MIN_STD:
+        return None
+    if method == "phash":
+        low = cv2.dct(thumb)[:8, :8].ravel()
+        bits = low > np.median(low[1:])  # The DC term would skew the median
+    elif method == "dhash":
+        small = cv2.resize(thumb, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).ravel()
+    else:
+        raise ValueError(f"Unknown perceptual hash: {method}")
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def image_hash(image_bytes, target_dim=TARGET_DIM, method=PERCEPTUAL_HASH):
+    """perceptual_hash() of an encoded image, computed like analyze_image() does."""
+    img = decode_image(image_bytes, target_dim)
+    h, w = img.shape[:2]
+    scale = target_dim / max(h, w) if target_dim else 1.0
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)))
+    return perceptual_hash(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), method)
+
+
+def analyze_image(image_bytes, target_dim=TARGET_DIM, visualize=False, preview_dim=None, tiled=None,
+                  cascade=None):
+    # Per-stage wall time, returned with the result (works across process pools)
+    timings = {}
+    if cascade is None:
+        cascade = ANALYSIS_CASCADE
+    
+    # 1. Decode Image (header-checked, reduced-resolution decode for large JPEGs)
+    start = time.perf_counter()
+    img = decode_image(image_bytes, target_dim)
+    timings["decode"] = time.perf_counter() - start
 
     # 2. Resize for consistent analysis (Standard Sina Method Baseline)
     # We resize to ensure the eigenvalue scale is consistent across 12MP vs 48MP cameras
-    target_dim = 2048
+    start = time.perf_counter()
     h, w = img.shape[:2]
-    scale = target_dim / max(h, w)
+    scale = target_dim / max(h, w) if target_dim else 1.0
     if scale < 1.0:
         img = cv2.resize(img, (int(w * scale), int(h * scale)))
+        h, w = img.shape[:2]
+    
+    # Very large analyses (raised/disabled TARGET_DIM) go through the tiled path
+    if tiled is None:
+        tiled = ANALYSIS_TILED == "on" or (ANALYSIS_TILED == "auto" and h * w >= TILED_MIN_PIXELS)
 
-    # 3. Convert to Grayscale (Luminance)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # 3. Convert to Grayscale (Luminance) - per tile in tiled mode
+    gray = None if tiled else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    timings["resize"] = time.perf_counter() - start
 
-    # 4. Gradient Extraction (Sobel)
-    # This detects the "Rate of Change" in pixel intensity
-    g_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    g_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    # 3a. Near-duplicate lookup (opt-in, see dedup.py)
+    # Re-encoded, resized or stripped copies of an indexed image reuse its
+    # stored result; known-AI hashes short-circuit. Visualizations always run.
+    index = near_duplicate_index if target_dim == TARGET_DIM else None
+    near_hash = None
+    if index is not None:
+        start = time.perf_counter()
+        near_hash = perceptual_hash(img if gray is None else gray)
+        match = index.lookup(near_hash) if near_hash is not None and not visualize else None
+        timings["near_duplicate"] = time.perf_counter() - start
+        if match is not None:
+            match["timings"] = timings
+            return match
 
-    # 5. Covariance Matrix Calculation (OPTIMIZED)
-    # We flatten gradients to create a Feature Vector
-    # Use ravel() instead of flatten() for better performance (no copy if possible)
-    g_x_flat = g_x.ravel()
-    g_y_flat = g_y.ravel()
+    # 3b. Early-exit cascade (opt-in, not with visualizations or tiling)
+    # Score a sparse tile sample first; clear-cut images stop here, borderline
+    # ones continue with the exact full-resolution pass below.
+    ela_score = None
+    if cascade and not tiled and not visualize:
+        start = time.perf_counter()
+        estimate = cascade_estimate(gray)
+        if estimate is not None:
+            trust_score, ela_score = cascade_decision(img, estimate, channel_histograms(img))
+            timings["proxy"] = time.perf_counter() - start
+            if trust_score is not None:
+                logger.debug("Cascade exit: base %.2f +- %.2f -> Final: %d",
+                             estimate["base_score"], estimate["base_error"], trust_score)
+                result = {
+                    "trust_score": trust_score,
+                    "meta": {
+                        "eigenvalues": list(estimate["eigenvalues"]),
+                        "decided_at": "proxy",
+                        "analyzed_fraction": round(estimate["fraction"], 4)
+                    }
+                }
+                if near_hash is not None:
+                    index.add(near_hash, result)
+                result["timings"] = timings
+                return result
 
-    # Stack them: M = [Gx, Gy] - use column_stack for efficiency
-    M = np.column_stack((g_x_flat, g_y_flat))
-    
-    # Calculate Covariance: C = (M.T * M) / N
-    # This measures how chaotic the texture is globally.
-    # np.cov is already optimized, but we can use rowvar=False for clarity
-    cov_matrix = np.cov(M, rowvar=False)
-    
-    # 6. Eigenvalues
-    # eigenvalues[0] is usually the smaller one (noise floor)
+    # 4-6. Gradients, Covariance & Eigenvalues (FUSED)
+    # A single banded pass computes the Sobel gradient second moments, the
+    # per-channel histograms, the contrast and the gradient magnitude.
+    # eigenvalues[0] is the smaller one (noise floor)
     # eigenvalues[1] is the larger one (edge strength)
-    eigenvalues, _ = np.linalg.eig(cov_matrix)
-    eigenvalues = np.sort(eigenvalues) # Sort ascending
-    
-    val_1 = eigenvalues[0]
-    val_2 = eigenvalues[1]
+    # The magnitude image is only kept when a visualization was requested
+    if tiled:
+        features = tiled_features(
+            img, with_ela=ELA_MODE == "full",
+            preview_dim=(preview_dim or TILED_PREVIEW_DIM) if visualize else None, timings=timings
+        )
+    else:
+        features = extract_features(img, gray, keep_magnitude=visualize, timings=timings)
+    val_1, val_2 = features["eigenvalues"]
+    eigenvalues = [val_1, val_2]
 
     # 7. The Scoring Logic (The Authenticity Index)
     # Real cameras produce chaotic noise -> Higher Eigenvalues
@@ -167,66 +985,66 @@ def analyze_image(image_bytes):
     # 2000.0 is a good baseline for 2048px images.
     base_score = (val_1 / 2000.0) * 100 
     
-    # 5. Final Scoring & Retouching Cap
-    final_score = base_score
-    
     # Metric 1: Channel-Wise Histogram Gaps ("The Comb Effect")
     # Check Red, Green, and Blue channels individually.
     # Boosting a "Sunset" often stretches the Red channel specifically, leaving gaps there
     # even if the global luminance looks fine.
-    img_uint8 = np.clip(img, 0, 255).astype(np.uint8)
-    # Convert BGR to RGB for channel-wise analysis
-    img_rgb = cv2.cvtColor(img_uint8, cv2.COLOR_BGR2RGB)
-    is_retouched, total_channel_gaps = calculate_histogram_gaps(img_rgb, gap_threshold=0)
-    is_edited_histogram = total_channel_gaps > 5
+    # The histograms come from the fused pass (BGR order, the sum is the same).
+    start = time.perf_counter()
+    is_edited_histogram, total_channel_gaps = calculate_histogram_gaps(
+        img, gap_threshold=5, histograms=features["histograms"]
+    )
+    timings["histogram"] = time.perf_counter() - start
     
     # Metric 2: RMS Contrast Check
     # Calculate the standard deviation of pixel intensities (img.std()).
     # Raw camera sensor data is usually "flat" (Low/Medium contrast).
     # Highly processed "Instagram-ready" photos have high contrast.
-    gray_uint8 = gray.astype(np.uint8)
-    contrast = float(np.std(gray_uint8))
+    contrast = features["contrast"]
     is_high_contrast = contrast > 75
     
-    # The "Authenticity Gate" (The Fix)
-    # If it looks real (High Score) BUT shows signs of editing:
-    if base_score > 85:
-        if is_edited_histogram or is_high_contrast:
-            # Force it down to "Retouched" category (Green)
-            # Cap at 80 (or 75 if both checks fail)
-            final_score = 80
-    
     # Compression Artifact Check (ELA)
     # Real Photos: High ELA Score (> 2.0). The high-frequency grain changes significantly when compressed.
     # AI Images: Low ELA Score (< 1.5). The "fake grain" often survives compression too perfectly.
-    ela_score = calculate_ela_score(img)
-    
-    # If ela_score < 1.5 (Suspiciously resilient to compression):
-    # Cap Score at 45% (Ambiguous/AI).
-    # Override: Even if Entropy is high (100%), if ELA is low, it's likely a high-quality AI generation.
-    if ela_score < 1.5:
-        final_score = min(final_score, 45.0)  # Cap at 45% (Ambiguous/AI)
+    # (Reused from the cascade or the tiles when already computed.)
+    start = time.perf_counter()
+    if ela_score is None:
+        ela_score = features.get("ela_score")
+    if ela_score is None:
+        ela_score = calculate_ela_score(img, threshold=ELA_AI_THRESHOLD)
+    timings["ela"] = time.perf_counter() - start
     
-    # Ensure bounds
-    final_score = max(0, min(100, int(final_score)))
+    # 5. Final Scoring & Retouching Cap (see score_from_metrics)
+    final_score = score_from_metrics(base_score, is_edited_histogram, is_high_contrast, ela_score)
     trust_score = final_score
     
-    # Debug Print
-    print(f"DEBUG: Contrast: {contrast:.1f} | RGB Gaps: {total_channel_gaps} | Base: {base_score} -> Final: {final_score}")
-
-    # 8. Generate Visual (Gradient Magnitude) - OPTIMIZED
-    # Use vectorized magnitude calculation (faster than cv2.magnitude for large images)
-    magnitude = np.sqrt(g_x * g_x + g_y * g_y)
-    # Normalize for display (in-place operation where possible)
-    magnitude = cv2.normalize(magnitude, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
-    _, buffer = cv2.imencode('.jpg', magnitude)
-    gradient_base64 = base64.b64encode(buffer).decode('utf-8')
+    # Debug Log (lazy formatting: free unless the "forensics" logger is at DEBUG)
+    logger.debug("Contrast: %.1f | RGB Gaps: %d | Base: %s -> Final: %d",
+                 contrast, total_channel_gaps, base_score, final_score)
 
     # Return Data
-    return {
+    result = {
         "trust_score": int(trust_score),
-        "gradient_image": gradient_base64,
         "meta": {
-            "eigenvalues": eigenvalues.tolist()
+            "eigenvalues": eigenvalues
         }
-    }
\ No newline at end of file
+    }
+    if cascade and not tiled and not visualize:
+        result["meta"]["decided_at"] = "full"
+    if near_hash is not None:
+        index.add(near_hash, result)
+
+    # 8. Generate Visual (Gradient Magnitude) - OPT-IN
+    # The float32 magnitude was filled band by band during the fused pass.
+    # Returned as raw JPEG bytes; the API decides between base64 and a URL.
+    if visualize:
+        start = time.perf_counter()
+        if tiled:
+            preview, low, high = features["gradient_preview"]
+            result["gradient_jpeg"] = render_gradient(preview, value_range=(low, high))
+        else:
+            result["gradient_jpeg"] = render_gradient(features["magnitude"], preview_dim)
+        timings["encode"] = time.perf_counter() - start
+
+    result["timings"] = timings
+    return result
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""
+Upload Ingestion - streaming, size-capped multipart reader for /analyze.
+
+FastAPI's UploadFile parameter buffers the whole request body before the
+endpoint runs. read_image_upload() instead feeds the raw body stream to the
+multipart parser chunk by chunk and:
+  - rejects oversized requests from Content-Length before reading anything (413)
+  - stops reading as soon as the file part passes the size cap (413)
+  - sniffs the magic bytes of the first chunk and rejects non-images (415)
+  - writes the file part straight into one bytearray (reserved up to
+    INITIAL_BUFFER_BYTES from Content-Length, then grown by doubling as data
+    arrives), which is handed to analyze_image() without further bytes copies
+
+Configuration (environment variables):
+  MAX_UPLOAD_MB     maximum image size in MB (default: 30)
+"""
+import os
+from typing import Optional, Tuple
+
+from fastapi import Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # Older python-multipart releases
+    import multipart
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import parse_options_header
+
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "30")) * 1024 * 1024)
+
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Most memory reserved for an upload before its bytes arrive: Content-Length
+# is client-supplied, so slow clients claiming large bodies must not commit RAM
+INITIAL_BUFFER_BYTES = 1024 * 1024
+
+# Enough leading bytes to recognise every supported format
+SNIFF_BYTES = 12
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+class UploadRejected(Exception):
+    """The upload was refused before analysis; carries the HTTP status."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_image_format(head) -> Optional[str]:
+    """Identify an image format from its leading bytes, or None."""
+    head = bytes(head[:SNIFF_BYTES])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+class _ImagePartCollector:
+    """multipart callbacks that keep only the first file part named field_name."""
+
+    def __init__(self, field_name: str, max_bytes: int, capacity: int):
+        self.field_name = field_name
+        self.max_bytes = max_bytes
+        # Reserve from Content-Length when known (capped); trimmed in place at the end
+        self.buffer = bytearray(min(capacity, INITIAL_BUFFER_BYTES))
+        self.size = 0
+        self.filename = None
+        self.done = False
+        self.sniffed = False
+
+        self._collecting = False
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def on_part_begin(self):
+        self._disposition = b""
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        self._collecting = (
+            not self.done and name == self.field_name and b"filename" in options
+        )
+        if self._collecting:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data, start, end):
+        if not self._collecting:
+            return
+        length = end - start
+        new_size = self.size + length
+        if new_size > self.max_bytes:
+            raise UploadRejected(413, f"File exceeds the {self.max_bytes // (1024 * 1024)}MB upload limit")
+        if new_size > len(self.buffer):
+            # Double (up to the cap) so large uploads are copied O(log n) times
+            grown = max(new_size, min(2 * len(self.buffer), self.max_bytes))
+            self.buffer.extend(bytes(grown - len(self.buffer)))
+        self.buffer[self.size:new_size] = memoryview(data)[start:end]
+        self.size = new_size
+        if not self.sniffed and self.size >= SNIFF_BYTES:
+            self._sniff()
+
+    def on_part_end(self):
+        if self._collecting:
+            if not self.sniffed:
+                self._sniff()
+            self._collecting = False
+            self.done = True
+
+    def _sniff(self):
+        self.sniffed = True
+        if sniff_image_format(self.buffer[:SNIFF_BYTES]) is None:
+            raise UploadRejected(415, "Unsupported file type: expected JPEG, PNG, WebP, GIF, BMP or TIFF")
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+
+def limit_request_body(request: Request, max_bytes: int) -> Request:
+    """
+    The same request with its body capped at max_bytes, for endpoints that
+    let Starlette parse the form (request.form()): a larger Content-Length
+    is refused up front, a longer body as soon as it passes the cap.
+
+    Raises:
+        UploadRejected: 413, from here or while the body is read
+    """
+    detail = f"Request exceeds the {max_bytes // (1024 * 1024)}MB upload limit"
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadRejected(413, detail)
+
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise UploadRejected(413, detail)
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def read_image_upload(request: Request, field_name: str = "file",
+                            max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, bytearray]:
+    """
+    Stream a multipart/form-data body and return (filename, image bytes).
+
+    Raises:
+        UploadRejected: Wrong content type, too large, not an image or no file part
+    """
+    content_type = request.headers.get("content-type", "")
+    disposition, params = parse_options_header(content_type)
+    if disposition != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data upload")
+
+    max_body = max_bytes + MULTIPART_OVERHEAD
+    content_length = request.headers.get("content-length")
+    capacity = 0
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) > max_body:
+            raise UploadRejected(413, f"File exceeds the {max_bytes // (1024 * 1024)}MB upload limit")
+        capacity = int(content_length)
+
+    collector = _ImagePartCollector(field_name, max_bytes, capacity)
+    parser = multipart.MultipartParser(params[b"boundary"], collector.callbacks())
+
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        # Other parts are not buffered, but they still must not stream forever
+        if received > max_body:
+            raise UploadRejected(413, f"File exceeds the {max_bytes // (1024 * 1024)}MB upload limit")
+        try:
+            if chunk:
+                parser.write(chunk)
+        except FormParserError as e:
+            raise UploadRejected(400, f"Malformed multipart body: {str(e)}")
+        if collector.done:
+            break
+    parser.finalize()
+
+    if not collector.done or collector.size == 0:
+        raise UploadRejected(400, f"Missing file field '{field_name}'")
+
+    # Trim the unused tail in place (no copy of the image data)
+    del collector.buffer[collector.size:]
+    return collector.filename or "image.jpg", collector.buffer
@@ -0,0 +1,352 @@
+"""
+Analysis Jobs - asynchronous analyses behind POST /jobs and GET /jobs/{id}.
+
+/analyze holds the client connection open for the whole analysis, so under
+load requests run into proxy timeouts. A job only needs its upload accepted:
+  - submit() stores the image and a "queued" job record and returns at once
+  - JobRunner tasks take jobs off the queue and run them on the analysis
+    engine, never more at once than the runner concurrency
+  - finished jobs ("done" / "failed") keep their result for JOB_RESULT_TTL
+    seconds; queued jobs beyond JOB_QUEUE_SIZE (or, in memory, beyond
+    JOB_QUEUE_MB of queued uploads) are refused (JobQueueFull -> 503)
+  - wait() wakes GET /jobs/{id}/events as soon as a job finishes
+
+Backends:
+  memory   in-process queue and records (default); jobs live and die with the
+           process that accepted them
+  redis    any Redis-compatible server (Redis, Valkey, KeyDB, ...) at REDIS_URL;
+           the queue is shared, so every API replica works it off and can
+           answer for every job. Needs redis-py >= 5.0.1 (requirements-redis.txt)
+           for the async aclose() methods.
+
+Configuration (environment variables):
+  JOB_BACKEND       "memory" (default) or "redis"
+  REDIS_URL         server for the redis backend (default: redis://localhost:6379/0)
+  JOB_QUEUE_SIZE    jobs allowed to wait (default: 1000)
+  JOB_QUEUE_MB      memory backend: upload bytes allowed to wait, in MB (default: 512)
+  JOB_RESULT_TTL    seconds a finished job stays retrievable (default: 600)
+  JOB_RUNNERS       jobs run at once per API process (default: ANALYSIS_WORKERS, read by main.py)
+  JOB_CAPACITY_WAIT seconds a running job waits for a free worker (default: 30, read by main.py)
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import orjson
+
+
+FINISHED = ("done", "failed")
+
+# Queued/running records in Redis expire after this long even if no runner
+# ever finishes them (e.g. every replica was restarted mid-job)
+PENDING_TTL = 24 * 3600
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the queue has no room for another job."""
+
+    def __init__(self, retry_after: int = 5):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class JobFailed(Exception):
+    """Raised by a job handler; carries the HTTP status reported for the job."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def new_job(filename: str, options: Optional[dict] = None) -> dict:
+    """A fresh "queued" job record."""
+    return {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "filename": filename,
+        "options": options or {},
+        "created_at": time.time(),
+    }
+
+
+class MemoryJobBackend:
+    name = "memory"
+
+    def __init__(self, queue_size: int = 1000, result_ttl: float = 600.0, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Upload bytes held by queued jobs; JOB_QUEUE_SIZE alone
+                would allow queue_size times MAX_UPLOAD_MB of process memory
+        """
+        self.queue_size = queue_size
+        self.result_ttl = result_ttl
+        self.max_bytes = max_bytes
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._queued_bytes = 0
+        self._jobs = {}
+        self._expiry = OrderedDict()  # finished job id -> expires_at (finish order == expiry order)
+        self._finished = {}           # job id -> asyncio.Event, created by waiters
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expiry:
+            job_id, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            del self._expiry[job_id]
+            self._jobs.pop(job_id, None)
+            self._finished.pop(job_id, None)
+
+    async def submit(self, job: dict, payload: bytes):
+        if self._queued_bytes + len(payload) > self.max_bytes:
+            raise JobQueueFull()
+        try:
+            self._queue.put_nowait((job["id"], payload))
+        except asyncio.QueueFull:
+            raise JobQueueFull()
+        self._queued_bytes += len(payload)
+        self._jobs[job["id"]] = dict(job)
+
+    async def next(self):
+        """Wait for the next job; returns (job, payload)."""
+        while True:
+            job_id, payload = await self._queue.get()
+            self._queued_bytes -= len(payload)
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job), payload
+
+    async def update(self, job_id: str, **fields):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        if job["status"] in FINISHED:
+            self._expire()
+            self._expiry[job_id] = time.monotonic() + self.result_ttl
+            event = self._finished.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        self._expire()
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """The job once it is finished, or its current state after timeout seconds."""
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await self.get(job_id)
+
+    def stats(self) -> dict:
+        running = sum(job["status"] == "running" for job in self._jobs.values())
+        return {
+            "backend": self.name,
+            "queued": self._queue.qsize(),
+            "queued_bytes": self._queued_bytes,
+            "running": running,
+            "finished": len(self._expiry),
+        }
+
+    async def close(self):
+        pass
+
+
+class RedisJobBackend:
+    name = "redis"
+
+    def __init__(self, url: str = "redis://localhost:6379/0", queue_size: int = 1000, result_ttl: float = 600.0,
+                 prefix: str = "realorai:jobs:", client=None):
+        """
+        Args:
+            url: Redis-compatible server
+            prefix: Key prefix, so several deployments can share one server
+            client: Pre-configured redis.asyncio client (tests); created from url otherwise
+        """
+        if client is None:
+            # Optional dependency, only needed for this backend
+            import redis
+            if tuple(int(part) for part in redis.__version__.split(".")[:3] if part.isdigit()) < (5, 0, 1):
+                raise RuntimeError(f"JOB_BACKEND=redis needs redis-py >= 5.0.1 (installed: {redis.__version__})")
+            import redis.asyncio
+            client = redis.asyncio.from_url(url)
+        self._redis = client
+        self.queue_size = queue_size
+        self.result_ttl = result_ttl
+        self.prefix = prefix
+        self._queue_key = f"{prefix}queue"
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}job:{job_id}"
+
+    def _payload_key(self, job_id):
+        return f"{self.prefix}payload:{job_id}"
+
+    def _channel(self, job_id):
+        return f"{self.prefix}finished:{job_id}"
+
+    async def submit(self, job: dict, payload: bytes):
+        # Not atomic with the push: concurrent submits may overshoot by a few jobs
+        if await self._redis.llen(self._queue_key) >= self.queue_size:
+            raise JobQueueFull()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job["id"]), orjson.dumps(job), ex=PENDING_TTL)
+            pipe.set(self._payload_key(job["id"]), bytes(payload), ex=PENDING_TTL)
+            pipe.lpush(self._queue_key, job["id"])
+            await pipe.execute()
+
+    async def next(self):
+        """Wait for the next job; returns (job, payload)."""
+        while True:
+            # Short blocking pops keep the task responsive to cancellation
+            item = await self._redis.brpop([self._queue_key], timeout=1)
+            if item is None:
+                continue
+            job_id = item[1].decode()
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.get(self._job_key(job_id))
+                pipe.get(self._payload_key(job_id))
+                pipe.delete(self._payload_key(job_id))
+                job, payload, _ = await pipe.execute()
+            if job is not None and payload is not None:
+                return orjson.loads(job), payload
+
+    async def update(self, job_id: str, **fields):
+        key = self._job_key(job_id)
+        raw = await self._redis.get(key)
+        if raw is None:
+            return
+        job = orjson.loads(raw)
+        job.update(fields)
+        finished = job["status"] in FINISHED
+        await self._redis.set(key, orjson.dumps(job), ex=int(self.result_ttl) if finished else PENDING_TTL)
+        if finished:
+            await self._redis.publish(self._channel(job_id), job["status"])
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        raw = await self._redis.get(self._job_key(job_id))
+        return orjson.loads(raw) if raw is not None else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """The job once it is finished, or its current state after timeout seconds."""
+        pubsub = self._redis.pubsub()
+        try:
+            # Subscribe before reading the record, so a finish in between is not missed
+            await pubsub.subscribe(self._channel(job_id))
+            job = await self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            deadline = time.monotonic() + timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    break
+            return await self.get(job_id)
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    def stats(self) -> dict:
+        # Queue depth lives on the server; /health stays free of network calls
+        return {"backend": self.name}
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def job_backend_from_env():
+    queue_size = int(os.environ.get("JOB_QUEUE_SIZE", "1000"))
+    result_ttl = float(os.environ.get("JOB_RESULT_TTL", "600"))
+    if os.environ.get("JOB_BACKEND", "memory").lower() == "redis":
+        try:
+            return RedisJobBackend(
+                os.environ.get("REDIS_URL", "redis://localhost:6379/0"), queue_size=queue_size, result_ttl=result_ttl
+            )
+        except ImportError:
+            logging.warning("redis library not installed, using the in-process job queue")
+    max_bytes = int(float(os.environ.get("JOB_QUEUE_MB", "512")) * 1024 * 1024)
+    return MemoryJobBackend(queue_size=queue_size, result_ttl=result_ttl, max_bytes=max_bytes)
+
+
+class JobRunner:
+    """Background tasks that take jobs off a backend and run them through handler."""
+
+    def __init__(self, backend, handler: Callable[[dict, bytes], Awaitable[dict]], concurrency: int = 1):
+        """
+        Args:
+            handler: async (job, payload) -> result dict; raises JobFailed for expected failures
+            concurrency: Jobs processed at once by this process
+        """
+        self.backend = backend
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self._tasks = []
+
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"job-runner-{i}") for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            try:
+                job, payload = await self.backend.next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Backend unreachable (e.g. Redis restarting): back off and retry
+                logging.error(f"Job queue unavailable: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            await self._process(job, payload)
+
+    async def _process(self, job: dict, payload: bytes):
+        job_id = job["id"]
+        try:
+            await self.backend.update(job_id, status="running", started_at=time.time())
+            result = await self.handler(job, payload)
+            fields = {"status": "done", "result": result}
+            self.completed += 1
+        except asyncio.CancelledError:
+            # Shutting down mid-job: report it instead of leaving it "running"
+            await asyncio.shield(self.backend.update(
+                job_id, status="failed", error="Interrupted by a server restart, please resubmit",
+                status_code=503, finished_at=time.time()
+            ))
+            raise
+        except JobFailed as e:
+            fields = {"status": "failed", "error": e.detail, "status_code": e.status_code}
+            self.failed += 1
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {str(e)}")
+            fields = {"status": "failed", "error": str(e), "status_code": 500}
+            self.failed += 1
+        try:
+            await self.backend.update(job_id, finished_at=time.time(), **fields)
+        except Exception as e:
+            logging.error(f"Could not store the result of job {job_id}: {e}")
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "runners": self.concurrency,
+                "completed": self.completed, "failed": self.failed}
@@ -1,20 +1,106 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse
 from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, List
+from contextlib import asynccontextmanager
 import os
-import json
-import io
-import csv
 import logging
+import asyncio
+import base64
+import hashlib
+import tarfile
+import tempfile
+import zipfile
+import gzip
+import bz2
+import lzma
+import orjson
+import time
+import functools
+import contextlib
+import threading
+from datetime import datetime
 
 # Logic Imports
-from forensics import analyze_image
-from dotenv import load_dotenv
+# forensics (cv2 + numpy) and supabase are not imported here: the lifespan
+# preloads them in the background, see startup.py
+import startup
+from engine import AnalysisEngine, EngineBusy, AnalysisTimeout
+from cache import ResultCache, TTLStore, content_key
+from ingest import read_image_upload, limit_request_body, sniff_image_format, UploadRejected
+from ingest import MAX_UPLOAD_BYTES, SNIFF_BYTES
+from ratelimit import RateLimiter, RateLimitMiddleware, Client
+from jobs import JobRunner, JobFailed, JobQueueFull, job_backend_from_env, new_job, FINISHED
+from feedback_store import LocalFeedbackStore, encode_pages, EXPORT_FORMATS, FIELDS as FEEDBACK_FIELDS
+import metrics
+
+# Only imports python-dotenv when a .env file exists
+startup.load_env_file(os.path.dirname(os.path.abspath(__file__)))
+
+# Leveled logging; LOG_LEVEL=DEBUG also enables the per-image forensics debug line
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+# Add a Server-Timing header with the per-stage breakdown to /analyze responses
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Dedicated analysis engine (bounded queue, per-job timeout, worker recycling)
+# Configured through ANALYSIS_* environment variables, see engine.py
+# Every worker warms itself up (imports + one synthetic analysis) when it starts
+engine = AnalysisEngine.from_env(initializer=startup.warm_worker)
+
+# Content-addressed result cache (memory LRU + optional SQLite tier), see cache.py
+result_cache = ResultCache.from_env()
+
+# Short-lived store for gradient visualizations fetched by ID (raw JPEG bytes)
+gradient_store = TTLStore(
+    ttl=float(os.environ.get("GRADIENT_TTL", "300")),
+    max_bytes=int(float(os.environ.get("GRADIENT_STORE_MB", "32")) * 1024 * 1024)
+)
+
+# Queue behind POST /jobs (in-process or Redis, see jobs.py); the runner is
+# created below the job handler and started by the lifespan
+job_backend = job_backend_from_env()
+
+# Background startup steps reported by /ready
+readiness = startup.Readiness()
+
+
+def forensics():
+    """The forensics module; waits for the background import if it is still running."""
+    return startup.module("forensics")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine.start()
+    if feedback_writer is not None:
+        await feedback_writer.start()
+    # Heavy imports, the Supabase client and the warm-up of every engine worker
+    # run concurrently in the background; /ready reports 200 once they are done
+    warmup = asyncio.create_task(readiness.run({
+        "imports": startup.preload("forensics"),
+        "supabase": asyncio.to_thread(get_supabase),
+        "engine": engine.warm_up(startup.warm_worker),
+    }))
+    await job_runner.start()
+    yield
+    warmup.cancel()
+    # Jobs still running are marked failed (503) so clients resubmit them
+    await job_runner.stop()
+    await job_backend.close()
+    if feedback_writer is not None:
+        await feedback_writer.stop()
+    engine.shutdown(wait=False)
+    if result_cache.disk is not None:
+        result_cache.disk.close()
+    if _feedback_store is not None:
+        _feedback_store.close()
 
-load_dotenv()
 
 # Configure FastAPI for Railway deployment
 # Using ORJSONResponse for faster JSON serialization (2-3x faster than standard json)
@@ -22,9 +108,15 @@ app = FastAPI(
     title="RealorAI Backend",
     description="AI Image Detector API",
     version="1.0.0",
-    default_response_class=ORJSONResponse
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Per-client token buckets on the analysis endpoints (RATE_LIMIT_* variables, see
+# ratelimit.py). Added before CORS so it runs inside it and 429s keep their CORS headers.
+rate_limiter = RateLimiter.from_env()
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # 1. CORS Setup (Critical for frontend connection)
 # Allow all origins for Railway deployment (frontend and backend are separate services)
 app.add_middleware(
@@ -35,19 +127,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histograms for /metrics (outermost middleware, so it sees everything)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Scrape-time gauges backed by the engine and cache counters
+metrics.REGISTRY.gauge("analysis_queue_depth", "Admitted analyses waiting for a worker.",
+                       callback=lambda: engine.queue_depth)
+metrics.REGISTRY.gauge("analysis_in_flight", "Admitted analyses (running + waiting).",
+                       callback=lambda: engine.stats()["in_flight"])
+metrics.REGISTRY.counter("analysis_engine_jobs_total", "Engine job outcomes.", ("outcome",),
+                         callback=lambda: {(outcome,): engine.stats()[outcome]
+                                           for outcome in ("completed", "rejected", "timed_out", "failed")})
+metrics.REGISTRY.counter("result_cache_lookups_total", "Result cache lookups by outcome.", ("outcome",),
+                         callback=lambda: {(outcome,): result_cache.stats()[outcome]
+                                           for outcome in ("memory_hits", "disk_hits", "misses")})
+metrics.REGISTRY.gauge("result_cache_bytes", "Bytes held by the in-memory result cache.",
+                       callback=lambda: result_cache.stats()["bytes"])
+metrics.REGISTRY.counter("feedback_writer_records_total",
+                         "Feedback records written to Supabase, spilled locally or replayed from the spill.",
+                         ("outcome",),
+                         callback=lambda: {} if feedback_writer is None else
+                         {(outcome,): feedback_writer.stats()[outcome] for outcome in ("written", "spilled", "replayed")})
+metrics.REGISTRY.gauge("analysis_fair_waiting", "Admitted analyses waiting in the fair queue.",
+                       callback=lambda: engine.stats()["fair_waiting"] or 0)
+metrics.REGISTRY.counter("rate_limit_requests_total", "Rate-limited requests by outcome.", ("outcome",),
+                         callback=lambda: {(outcome,): rate_limiter.stats()[outcome] for outcome in ("allowed", "limited")})
+metrics.REGISTRY.gauge("rate_limit_clients", "Clients with a token bucket in memory.",
+                       callback=lambda: rate_limiter.stats()["clients"])
+metrics.REGISTRY.counter("analysis_jobs_total", "Asynchronous jobs finished by this process.", ("outcome",),
+                         callback=lambda: {(outcome,): job_runner.stats()[outcome] for outcome in ("completed", "failed")})
+metrics.REGISTRY.gauge("analysis_jobs_queued", "Asynchronous jobs waiting for a runner (in-process backend).",
+                       callback=lambda: job_runner.stats().get("queued", 0))
+
 # 2. Supabase Setup
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-supabase = None
-if SUPABASE_URL and SUPABASE_KEY:
+
+@functools.lru_cache(maxsize=None)
+def get_supabase():
+    """
+    Supabase client, or None when not configured or unavailable.
+    Created on first use (the lifespan does that in the background):
+    importing the supabase package alone takes about half a second.
+    """
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        return None
     try:
-        from supabase import create_client, Client
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        from supabase import create_client
+        return create_client(SUPABASE_URL, SUPABASE_KEY)
     except ImportError:
         logging.warning("Supabase library not installed")
     except Exception as e:
         logging.warning(f"Failed to initialize Supabase: {e}")
+    return None
+
+
+# Local feedback fallback (SQLite WAL, see feedback_store.py); opened on first use.
+# With Supabase it only holds spilled records, checked by the writer on start.
+# Imports feedback_local.json once.
+_feedback_store = None
+
+
+def get_feedback_store() -> LocalFeedbackStore:
+    global _feedback_store
+    if _feedback_store is None:
+        _feedback_store = LocalFeedbackStore.from_env()
+    return _feedback_store
+
+
+# Batched, non-blocking Supabase inserts (see feedback_writer.py); failed
+# batches spill to the local store and are replayed once Supabase accepts
+# inserts again. Started and drained by the lifespan.
+feedback_writer = None
+if SUPABASE_URL and SUPABASE_KEY:
+    from feedback_writer import FeedbackWriter
+    feedback_writer = FeedbackWriter.from_env(
+        SUPABASE_URL, SUPABASE_KEY, spill_store=get_feedback_store
+    )
 
 # 3. Data Models
 class FeedbackSchema(BaseModel):
@@ -60,208 +217,711 @@ class FeedbackSchema(BaseModel):
     timestamp: str
 
 
-def classify_trust_score(score: int) -> str:
+def build_analysis_response(filename: str, result: dict, visualization: str = "none",
+                            gradient_id: Optional[str] = None, gradient_jpeg: Optional[bytes] = None) -> dict:
     """
-    Classify trust score into categories.
-    Returns the classification string.
+    Shape an analyze_image() result into the /analyze response schema.
+    Shared by the single-image and batch endpoints.
+    
+    visualization: "none" (default), "inline" (base64 gradient_image) or
+    "url" (gradient_url pointing at GET /analyze/gradient/{id})
     """
-    if 0 <= score <= 20:
-        return "ai_generated"
-    elif 21 <= score <= 40:
-        return "likely_artificial"
-    elif 41 <= score <= 49:
-        return "mixed_signals"
-    elif 50 <= score <= 65:
-        return "low_quality_compressed"
-    elif 66 <= score <= 85:
-        return "digital_processed"
-    elif 86 <= score <= 100:
-        return "authentic_capture"
-    else:
-        # Fallback for edge cases
-        if score < 0:
-            return "ai_generated"
-        else:
-            return "authentic_capture"
+    # Get trust_score from analysis
+    trust_score = result.get("trust_score", 0)
+    
+    # Classify the score
+    classification = forensics().classify_trust_score(trust_score)
+    metrics.analysis_classifications.inc(classification=classification)
+    
+    response = {
+        "filename": filename,
+        "trust_score": trust_score,
+        "classification": classification,
+        "meta": result.get("meta", {})
+    }
+    if visualization == "inline" and gradient_jpeg is not None:
+        response["gradient_image"] = base64.b64encode(gradient_jpeg).decode("utf-8")
+    elif visualization == "url" and gradient_id is not None:
+        response["gradient_id"] = gradient_id
+        response["gradient_url"] = f"/analyze/gradient/{gradient_id}"
+    return response
+
+
+def make_gradient_id(key: str, preview_dim: Optional[int]) -> str:
+    return hashlib.sha256(f"{key}:{preview_dim or 0}".encode()).hexdigest()[:32]
+
+
+async def analyze_cached(contents, visualize: bool = False, preview_dim: Optional[int] = None,
+                         client: Optional[Client] = None, queue_wait: Optional[float] = None):
+    """
+    analyze_image() behind the result cache.
+    A hit returns without touching the engine or decoding the image.
+    The gradient visualization is only rendered when requested (and not
+    already in the gradient store). client picks the fair-queue share,
+    queue_wait is passed to engine.run().
+    
+    Returns:
+        (result, gradient_id, gradient_jpeg) - the last two are None unless visualize.
+        result["timings"] holds the stage timings when the engine ran (not on hits).
+    """
+    key = content_key(contents)
+    result = result_cache.get(key)
+    gradient_id = gradient_jpeg = None
+    if visualize:
+        gradient_id = make_gradient_id(key, preview_dim)
+        gradient_jpeg = gradient_store.get(gradient_id)
+    
+    if result is None or (visualize and gradient_jpeg is None):
+        result = await engine.run(
+            forensics().analyze_image, contents, visualize=visualize, preview_dim=preview_dim,
+            client=client.key if client else None, weight=client.weight if client else 1.0,
+            queue_wait=queue_wait
+        )
+        gradient_jpeg = result.pop("gradient_jpeg", None)
+        timings = result.pop("timings", {})
+        result_cache.put(key, result)
+        if gradient_jpeg is not None:
+            gradient_store.put(gradient_id, gradient_jpeg)
+        # Cached copy is already serialized; the timings only travel to the caller
+        metrics.observe_stages(timings)
+        near_duplicate = result.get("meta", {}).get("near_duplicate")
+        if near_duplicate is not None:
+            metrics.analysis_near_duplicates.inc(match="known_ai" if near_duplicate["known_ai"] else "result")
+        result["timings"] = timings
+    return result, gradient_id, gradient_jpeg
+
+
+# Query parameters controlling the optional gradient visualization
+VisualizationQuery = Query(
+    "none", pattern="^(none|inline|url)$",
+    description="Gradient visualization: none, inline (base64 JPEG) or url (fetch raw JPEG by ID)"
+)
+PreviewQuery = Query(None, ge=32, le=8192, description="Longest side of the visualization preview")
+
+
+# OpenAPI description of the multipart body that read_image_upload() parses by hand
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
 
 
 # 4. The Critical Analysis Endpoint (RESTORED)
-# NOTE: Using async def but running CPU-heavy analyze_image() in thread pool
-# This prevents blocking the event loop while still allowing async file I/O
-@app.post("/analyze")
-async def upload_analyze(file: UploadFile = File(...)):
+# NOTE: Using async def but running CPU-heavy analyze_image() on the analysis engine
+# This prevents blocking the event loop and caps concurrent decodes
+@app.post("/analyze", openapi_extra=UPLOAD_OPENAPI)
+async def upload_analyze(request: Request, response: Response, visualization: str = VisualizationQuery,
+                         preview: Optional[int] = PreviewQuery):
+    start = time.perf_counter()
     try:
-        # Read file into memory (async I/O - fast, non-blocking)
-        contents = await file.read()
-        
-        # Run CPU-heavy analysis in thread pool to avoid blocking event loop
-        import asyncio
-        import concurrent.futures
+        # Stream the upload into one size-capped buffer; non-images are
+        # rejected from their first bytes, before the engine is involved
+        filename, contents = await read_image_upload(request)
         
-        # Use asyncio.to_thread (Python 3.9+) or run_in_executor for older versions
-        try:
-            result = await asyncio.to_thread(analyze_image, contents)
-        except AttributeError:
-            # Fallback for Python < 3.9
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                result = await loop.run_in_executor(executor, analyze_image, contents)
-        
-        # Get trust_score from analysis
-        trust_score = result.get("trust_score", 0)
+        # Run CPU-heavy analysis on the engine (unless cached); rejects instead of queueing forever
+        result, gradient_id, gradient_jpeg = await analyze_cached(
+            contents, visualize=visualization != "none", preview_dim=preview, client=request.state.client
+        )
         
-        # Classify the score
-        classification = classify_trust_score(trust_score)
+        if SERVER_TIMING:
+            timings = result.get("timings")
+            response.headers["Server-Timing"] = metrics.server_timing_header(
+                timings or {"cache": 0.0}, {"total": time.perf_counter() - start}
+            )
         
         # Return JSON to frontend (ORJSONResponse handles serialization)
-        return {
-            "filename": file.filename or "image.jpg",
-            "trust_score": trust_score,
-            "classification": classification,
-            "gradient_image": result.get("gradient_image", ""),
-            "meta": result.get("meta", {})
-        }
+        return build_analysis_response(filename, result, visualization, gradient_id, gradient_jpeg)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except EngineBusy as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except AnalysisTimeout as e:
+        logging.error(f"Analysis timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except forensics().ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except forensics().UnreadableImageHeader as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         logging.error(f"Analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# 5. Feedback Endpoint
-@app.post("/feedback")
-async def submit_feedback(feedback: FeedbackSchema):
-    if not supabase:
-        # Fallback to local JSON file
-        feedback_data = {
-            "filename": feedback.filename,
-            "ai_score": feedback.ai_score,
-            "user_verdict": feedback.user_verdict,
-            "actual_category": feedback.actual_category,
-            "comments": feedback.comments,
-            "contribute_data": feedback.contribute_data,
-            "timestamp": feedback.timestamp,
-        }
+# 4b. Batch Analysis Endpoint
+# Accepts many files (multipart) and/or zip/tar archives and streams one NDJSON
+# line per image as soon as it finishes, in completion order.
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "200"))
+# Whole batch request (spooled to disk while parsed); default: every image at the upload cap
+BATCH_MAX_BYTES = int(float(os.environ.get("BATCH_MAX_MB", "0")) * 1024 * 1024) or MAX_UPLOAD_BYTES * BATCH_MAX_FILES
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith(".") and "__MACOSX" not in name and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _checked_reader(size: int, open_member, lock: threading.Lock):
+    """
+    Validate one batch item without loading it: declared size against the
+    upload limit and magic bytes from its first few bytes. Returns read(),
+    which raises UploadRejected for items that failed, and otherwise reads
+    at most MAX_UPLOAD_BYTES + 1 bytes (a lying size header cannot inflate it).
+    """
+    limit_mb = MAX_UPLOAD_BYTES // (1024 * 1024)
+    rejection = None
+    if size > MAX_UPLOAD_BYTES:
+        rejection = UploadRejected(413, f"File exceeds the {limit_mb}MB upload limit")
+    else:
+        with lock, open_member() as member:
+            if sniff_image_format(member.read(SNIFF_BYTES)) is None:
+                rejection = UploadRejected(415, "Unsupported file type: expected JPEG, PNG, WebP, GIF, BMP or TIFF")
+    
+    def read():
+        if rejection is not None:
+            raise rejection
+        # Archive members share one file object: one reader at a time
+        with lock, open_member() as member:
+            contents = member.read(MAX_UPLOAD_BYTES + 1)
+        if len(contents) > MAX_UPLOAD_BYTES:
+            raise UploadRejected(413, f"File exceeds the {limit_mb}MB upload limit")
+        return contents
+    
+    return read
+
+
+# Compressed tar streams: (magic bytes, opener of the decompressed stream)
+COMPRESSED_TAR_FORMATS = ((b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open))
+
+
+def _uncompressed_tar(fileobj, max_bytes: int = BATCH_MAX_BYTES):
+    """
+    fileobj itself for a plain tar, else its decompressed contents in a
+    temporary file. Members are read lazily and out of order, and every
+    backward seek in a compressed stream decompresses it again from the
+    start, so compressed archives are decompressed exactly once here.
+    
+    Raises:
+        UploadRejected: The decompressed archive exceeds max_bytes
+    """
+    head = fileobj.read(6)
+    fileobj.seek(0)
+    for magic, open_stream in COMPRESSED_TAR_FORMATS:
+        if head.startswith(magic):
+            spool = tempfile.TemporaryFile()
+            copied = 0
+            with open_stream(fileobj) as stream:
+                while chunk := stream.read(1024 * 1024):
+                    copied += len(chunk)
+                    if copied > max_bytes:
+                        spool.close()
+                        raise UploadRejected(413, f"Archive exceeds {max_bytes // (1024 * 1024)}MB uncompressed")
+                    spool.write(chunk)
+            spool.seek(0)
+            return spool
+    return fileobj
+
+
+def list_batch_items(files: List[UploadFile], max_items: int = BATCH_MAX_FILES):
+    """
+    (filename, read) pairs for every image in the upload, checked but not read.
+    read() returns the bytes lazily so only images currently being analyzed
+    are held in memory; archives are read member by member. Blocking file
+    I/O: run both this and read() off the event loop.
+    
+    Raises:
+        HTTPException: More than max_items images
+        UploadRejected: A compressed archive is too large once decompressed
+    """
+    items = []
+    
+    def add(name, read):
+        if len(items) >= max_items:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {max_items} images")
+        items.append((name, read))
+    
+    for upload in files:
+        name = upload.filename or "image.jpg"
+        lower = name.lower()
+        lock = threading.Lock()
         
-        feedback_file = "feedback_local.json"
-        if os.path.exists(feedback_file):
-            with open(feedback_file, "r") as f:
-                feedbacks = json.load(f)
+        if lower.endswith(".zip"):
+            archive = zipfile.ZipFile(upload.file)
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    add(info.filename, _checked_reader(
+                        info.file_size, functools.partial(archive.open, info), lock
+                    ))
+        elif lower.endswith(ARCHIVE_EXTENSIONS):
+            archive = tarfile.open(fileobj=_uncompressed_tar(upload.file), mode="r:")
+            for member in archive:
+                if member.isfile() and _is_image_name(member.name):
+                    add(member.name, _checked_reader(
+                        member.size, functools.partial(archive.extractfile, member), lock
+                    ))
         else:
-            feedbacks = []
-        
-        feedbacks.append(feedback_data)
-        
-        with open(feedback_file, "w") as f:
-            json.dump(feedbacks, f, indent=2)
-        
-        return {"status": "success", "mode": "local"}
+            def open_upload(upload=upload):
+                upload.file.seek(0)
+                # Leave the spooled file open for the later read()
+                return contextlib.nullcontext(upload.file)
+            
+            size = upload.size
+            if size is None:
+                size = upload.file.seek(0, os.SEEK_END)
+            add(name, _checked_reader(size, open_upload, lock))
+    return items
+
+
+async def run_with_backpressure(contents: bytes, wait: Optional[float] = None, **kwargs):
+    """
+    Run analyze_cached, waiting out EngineBusy instead of failing.
+    Batch items share capacity with /analyze, so they back off politely.
     
-    try:
-        # Insert into Supabase (without timestamp - Supabase auto-generates it)
-        data = {
-            "filename": feedback.filename,
-            "ai_score": feedback.ai_score,
-            "user_verdict": feedback.user_verdict,
-            "actual_category": feedback.actual_category,
-            "comments": feedback.comments,
-            "contribute_data": feedback.contribute_data,
+    wait: Seconds to wait for engine capacity (admission and a free worker);
+    the analysis timeout only starts once a worker has the image. Default:
+    engine.timeout, shared with the analysis itself.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (engine.timeout if wait is None else wait)
+    while True:
+        try:
+            queue_wait = None if wait is None else max(0.0, deadline - loop.time())
+            return await analyze_cached(contents, queue_wait=queue_wait, **kwargs)
+        except EngineBusy:
+            if loop.time() >= deadline:
+                raise
+            await asyncio.sleep(min(0.25, engine.avg_job_seconds / 2))
+
+
+# OpenAPI description of the multipart body parsed in upload_analyze_batch()
+BATCH_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"]
+                }
+            }
         }
-        supabase.table("feedback").insert(data).execute()
-        return {"status": "success", "mode": "database"}
+    }
+}
+
+
+@app.post("/analyze/batch", openapi_extra=BATCH_UPLOAD_OPENAPI)
+async def upload_analyze_batch(request: Request, visualization: str = VisualizationQuery,
+                               preview: Optional[int] = PreviewQuery):
+    # Parsed here rather than as a File(...) parameter, so the total size is
+    # capped before Starlette spools the body
+    try:
+        form = await limit_request_body(request, BATCH_MAX_BYTES).form(max_files=BATCH_MAX_FILES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    try:
+        files = [upload for upload in form.getlist("files") if not isinstance(upload, str)]
+        if not files:
+            raise HTTPException(status_code=400, detail="Missing file field 'files'")
+        try:
+            # Archive listing and member sniffing decompress data: keep it off the event loop
+            items = await asyncio.to_thread(list_batch_items, files)
+        except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError, lzma.LZMAError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        if not items:
+            raise HTTPException(status_code=400, detail="No images found in upload")
+    except BaseException:
+        await form.close()
+        raise
+    
+    # The rate limiter took one token for the request: charge the other images too
+    if rate_limiter.is_limited(request.scope):
+        rate_limiter.charge(request.state.client, len(items) - 1)
+    
+    # At most one batch item per worker is in flight; the rest wait here
+    # (not in the engine queue) so a single batch cannot crowd out /analyze.
+    slots = asyncio.Semaphore(engine.workers)
+    
+    async def analyze_one(index, filename, read):
+        async with slots:
+            try:
+                contents = await asyncio.to_thread(read)
+                result, gradient_id, gradient_jpeg = await run_with_backpressure(
+                    contents, visualize=visualization != "none", preview_dim=preview, client=request.state.client
+                )
+                line = build_analysis_response(filename, result, visualization, gradient_id, gradient_jpeg)
+            except UploadRejected as e:
+                line = {"filename": filename, "error": e.detail, "status_code": e.status_code}
+            except EngineBusy:
+                line = {"filename": filename, "error": "Server is busy, please retry", "status_code": 503}
+            except AnalysisTimeout as e:
+                line = {"filename": filename, "error": str(e), "status_code": 504}
+            except forensics().ImageTooLarge as e:
+                line = {"filename": filename, "error": str(e), "status_code": 413}
+            except forensics().UnreadableImageHeader as e:
+                line = {"filename": filename, "error": str(e), "status_code": 415}
+            except Exception as e:
+                logging.error(f"Batch analysis failed for {filename}: {str(e)}")
+                line = {"filename": filename, "error": str(e), "status_code": 500}
+        line["index"] = index
+        return line
+    
+    async def stream_results():
+        tasks = [asyncio.create_task(analyze_one(i, name, read)) for i, (name, read) in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield orjson.dumps(await next_done) + b"\n"
+        finally:
+            # Client went away: stop scheduling the remaining images
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await form.close()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+# 4c. Gradient Visualization by ID (raw JPEG, no base64 inflation)
+@app.get("/analyze/gradient/{gradient_id}")
+async def get_gradient(gradient_id: str):
+    jpeg = gradient_store.get(gradient_id)
+    if jpeg is None:
+        raise HTTPException(status_code=404, detail="Visualization not found or expired")
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={"Cache-Control": f"private, max-age={int(gradient_store.ttl)}"}
+    )
+
+
+# 4d. Asynchronous Jobs
+# POST /jobs answers 202 with a job ID as soon as the upload is stored; the
+# analysis runs in the background. Clients poll GET /jobs/{id} or listen on
+# GET /jobs/{id}/events (Server-Sent Events) for the result.
+JOB_RUNNERS = int(os.environ.get("JOB_RUNNERS", "0")) or engine.workers
+# Seconds a running job waits for a free worker before it fails with 503; the
+# runner holds one of its JOB_RUNNERS slots meanwhile
+JOB_CAPACITY_WAIT = float(os.environ.get("JOB_CAPACITY_WAIT", "30"))
+JOB_KEEPALIVE = 15.0  # Seconds between SSE comments, so proxies keep the stream open
+
+
+async def run_job(job: dict, contents: bytes) -> dict:
+    """Job handler: the /analyze response for one stored upload."""
+    options = job["options"]
+    visualization = options.get("visualization", "none")
+    try:
+        # Runners share the engine with /analyze: a job waits up to
+        # JOB_CAPACITY_WAIT for a free worker, and only the analysis itself is
+        # held to the timeout
+        result, gradient_id, gradient_jpeg = await run_with_backpressure(
+            contents, wait=JOB_CAPACITY_WAIT, visualize=visualization != "none", preview_dim=options.get("preview"),
+            client=Client(*options["client"]) if options.get("client") else None
+        )
+    except EngineBusy:
+        raise JobFailed(503, "Server is busy, please resubmit the job")
+    except AnalysisTimeout as e:
+        raise JobFailed(504, str(e))
+    except forensics().ImageTooLarge as e:
+        raise JobFailed(413, str(e))
+    except forensics().UnreadableImageHeader as e:
+        raise JobFailed(415, str(e))
+    return build_analysis_response(job["filename"], result, visualization, gradient_id, gradient_jpeg)
+
+
+job_runner = JobRunner(job_backend, run_job, concurrency=JOB_RUNNERS)
+
+
+def job_view(job: dict) -> dict:
+    """Public representation of a job record."""
+    view = {"job_id": job["id"]}
+    view.update((key, value) for key, value in job.items() if key not in ("id", "options"))
+    return view
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@app.post("/jobs", status_code=202, openapi_extra=UPLOAD_OPENAPI)
+async def submit_job(request: Request, visualization: str = VisualizationQuery,
+                     preview: Optional[int] = PreviewQuery):
+    try:
+        filename, contents = await read_image_upload(request)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    # The submitting client keeps its fair-queue share when the job runs
+    job = new_job(filename, {"visualization": visualization, "preview": preview,
+                             "client": list(request.state.client)})
+    try:
+        await job_backend.submit(job, contents)
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is full, please retry",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        logging.error(f"Feedback submission failed: {str(e)}")
-        return {"status": "error", "detail": str(e)}
+        logging.error(f"Job submission failed: {str(e)}")
+        raise HTTPException(status_code=503, detail="Job queue unavailable")
+    
+    status_url = f"/jobs/{job['id']}"
+    return ORJSONResponse(
+        {"job_id": job["id"], "status": job["status"], "status_url": status_url, "events_url": f"{status_url}/events"},
+        status_code=202,
+        headers={"Location": status_url}
+    )
 
 
-# 6. Admin View Endpoint
-@app.get("/admin/view")
-async def view_admin_data(key: str = ""):
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_backend.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job_view(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    job = await job_backend.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    async def events(job):
+        # One "status" event now, then a single "done" or "failed" event with the result
+        yield sse_event("status", job_view(job))
+        while job["status"] not in FINISHED:
+            job = await job_backend.wait(job_id, JOB_KEEPALIVE)
+            if job is None:
+                yield sse_event("failed", {"job_id": job_id, "status": "failed", "error": "Job expired",
+                                           "status_code": 404})
+                return
+            if job["status"] not in FINISHED:
+                yield b": keepalive\n\n"
+        yield sse_event(job["status"], job_view(job))
+    
+    return StreamingResponse(
+        events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# 5. Feedback Endpoint
+@app.post("/feedback")
+async def submit_feedback(feedback: FeedbackSchema):
+    feedback_data = {
+        "filename": feedback.filename,
+        "ai_score": feedback.ai_score,
+        "user_verdict": feedback.user_verdict,
+        "actual_category": feedback.actual_category,
+        "comments": feedback.comments,
+        "contribute_data": feedback.contribute_data,
+        "timestamp": feedback.timestamp,
+    }
+    
+    if feedback_writer is None:
+        # Fallback to the local store (O(1) append, no whole-file rewrite)
+        await asyncio.to_thread(get_feedback_store().insert, feedback_data)
+        return {"status": "success", "mode": "local"}
+    
+    # Queued for the background batch insert (timestamp is dropped - Supabase
+    # auto-generates created_at); returns without waiting on the network
+    feedback_writer.submit(feedback_data)
+    return {"status": "success", "mode": "database"}
+
+
+# 6. Admin Data Access (paginated; never loads the whole table)
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_EXPORT_PAGE_SIZE", "500"))
+
+
+def check_admin_key(key: str):
     # Basic protection
     admin_pass = os.environ.get("ADMIN_PASSWORD", "MydatabaseID92")
     if key != admin_pass:
         raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def feedback_filters(since: Optional[str], until: Optional[str], verdict: Optional[str]) -> Dict:
+    for name, value in (("since", since), ("until", until)):
+        if value:
+            try:
+                datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"'{name}' must be an ISO date or timestamp")
+    return {"since": since or None, "until": until or None, "verdict": verdict or None}
+
+
+def supabase_feedback_query(since=None, until=None, verdict=None, count=None, before=None):
+    query = get_supabase().table("feedback").select("*", count=count)
+    if since:
+        query = query.gte("created_at", since)
+    if until:
+        query = query.lt("created_at", until)
+    if before:
+        query = query.lte("created_at", before)
+    if verdict:
+        query = query.eq("user_verdict", verdict)
+    return query.order("created_at", desc=True)
+
+
+def fetch_supabase_page(offset: int, limit: int, count=None, **filters):
+    return supabase_feedback_query(count=count, **filters).range(offset, offset + limit - 1).execute()
+
+
+async def supabase_feedback_pages(page_size: int = ADMIN_PAGE_SIZE, **filters):
+    # Keyset pagination on created_at: rows inserted during an export are newer
+    # than the cursor, so they never shift the pages. Rows of one batched insert
+    # share created_at, so the cursor is inclusive and skips the tied rows
+    # already exported.
+    before, tied = None, 0
+    while True:
+        response = await asyncio.to_thread(fetch_supabase_page, tied, page_size, before=before, **filters)
+        rows = response.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]["created_at"]
+        at_last = sum(row["created_at"] == last for row in rows)
+        tied = tied + at_last if last == before else at_last
+        before = last
+
+
+async def local_feedback_pages(page_size: int = ADMIN_PAGE_SIZE, **filters):
+    pages = get_feedback_store().iter_pages(page_size, **filters)
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        yield page
+
+
+@app.get("/admin/view")
+async def view_admin_data(
+    key: str = "",
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    since: Optional[str] = Query(None, description="ISO date/timestamp, inclusive"),
+    until: Optional[str] = Query(None, description="ISO date/timestamp, exclusive"),
+    verdict: Optional[str] = None
+):
+    check_admin_key(key)
+    filters = feedback_filters(since, until, verdict)
     
-    if supabase:
+    if await asyncio.to_thread(get_supabase) is not None:
         try:
-            response = supabase.table("feedback").select("*").order("created_at", desc=True).execute()
-            return {"count": len(response.data) if response.data else 0, "data": response.data or []}
+            response = await asyncio.to_thread(fetch_supabase_page, offset, limit, count="exact", **filters)
+            data = response.data or []
+            total = response.count if response.count is not None else offset + len(data)
+            return {"count": len(data), "total": total, "limit": limit, "offset": offset, "data": data}
         except Exception as e:
-            logging.error(f"Supabase error: {e}, falling back to local file")
-    
-    # Fallback to local JSON file
-    feedback_file = "feedback_local.json"
-    if not os.path.exists(feedback_file):
-        return {"count": 0, "data": [], "message": "No data yet"}
+            logging.error(f"Supabase error: {e}, falling back to local store")
     
+    # Fallback to the local store
     try:
-        with open(feedback_file, "r") as f:
-            feedbacks = json.load(f)
-        
-        if isinstance(feedbacks, list):
-            return {"count": len(feedbacks), "data": feedbacks}
-        else:
-            return {"count": 1, "data": [feedbacks]}
-    except json.JSONDecodeError:
-        return {"error": "Could not parse database file"}
+        store = get_feedback_store()
+        total = await asyncio.to_thread(store.count, **filters)
+        data = await asyncio.to_thread(store.page, limit, offset, **filters)
     except Exception as e:
         return {"error": str(e)}
+    
+    result = {"count": len(data), "total": total, "limit": limit, "offset": offset, "data": data}
+    if total == 0:
+        result["message"] = "No data yet"
+    return result
 
 
-# 7. Admin Download Endpoint
+# 7. Admin Download Endpoint (streams page by page)
 @app.get("/admin/download")
-async def download_admin_data(key: str = ""):
-    # Basic protection
-    admin_pass = os.environ.get("ADMIN_PASSWORD", "MydatabaseID92")
-    if key != admin_pass:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+async def download_admin_data(
+    key: str = "",
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson|parquet)$"),
+    since: Optional[str] = Query(None, description="ISO date/timestamp, inclusive"),
+    until: Optional[str] = Query(None, description="ISO date/timestamp, exclusive"),
+    verdict: Optional[str] = None
+):
+    check_admin_key(key)
+    filters = feedback_filters(since, until, verdict)
     
-    feedbacks = []
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
     
-    if supabase:
+    # Fetch the first page up front: it picks the source (Supabase or local
+    # fallback) and lets an empty table still get a JSON error response
+    pages, first, fields = None, None, None
+    if await asyncio.to_thread(get_supabase) is not None:
         try:
-            response = supabase.table("feedback").select("*").execute()
-            feedbacks = response.data if response.data else []
+            pages = supabase_feedback_pages(**filters)
+            first = await anext(pages, None)
         except Exception as e:
-            logging.error(f"Supabase error: {e}, falling back to local file")
+            logging.error(f"Supabase error: {e}, falling back to local store")
+            pages, first = None, None
     
-    # Fallback to local JSON file
-    if not feedbacks:
-        feedback_file = "feedback_local.json"
-        if not os.path.exists(feedback_file):
-            return {"error": "No data to download"}
-        
+    if first is None:
         try:
-            with open(feedback_file, "r") as f:
-                feedbacks = json.load(f)
-            
-            if not isinstance(feedbacks, list):
-                feedbacks = [feedbacks]
+            pages = local_feedback_pages(**filters)
+            first = await anext(pages, None)
+            fields = list(FEEDBACK_FIELDS)
         except Exception as e:
-            return {"error": f"Failed to read local file: {str(e)}"}
+            return {"error": f"Failed to read local store: {str(e)}"}
     
-    if not feedbacks:
+    if first is None:
         return {"error": "No data to download"}
     
-    try:
-        # Convert to CSV using built-in csv library (no pandas needed)
-        output = io.StringIO()
-        if len(feedbacks) > 0:
-            # Get headers from first row
-            headers = list(feedbacks[0].keys())
-            writer = csv.DictWriter(output, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(feedbacks)
-        
-        output.seek(0)
-        
-        # Return as file download
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=feedback_data.csv"}
-        )
-    except Exception as e:
-        logging.error(f"CSV generation failed: {str(e)}")
-        return {"error": f"Failed to generate CSV: {str(e)}"}
+    async def all_pages():
+        yield first
+        try:
+            async for page in pages:
+                yield page
+        except Exception as e:
+            # Headers are already sent; the export ends early
+            logging.error(f"Export aborted: {str(e)}")
+    
+    media_type, extension = EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        encode_pages(all_pages(), fmt, fields),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=feedback_data.{extension}"}
+    )
+
+
+# 7b. Admin Client Counters (rate limiter buckets and fair queue)
+@app.get("/admin/clients")
+def view_client_counters(key: str = "", limit: int = Query(50, ge=1, le=1000)):
+    check_admin_key(key)
+    return {
+        "rate_limit": rate_limiter.stats(),
+        "fair_waiting": engine.stats()["fair_waiting"],
+        "clients": rate_limiter.clients(limit)
+    }
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 # Health check endpoints
@@ -269,7 +929,23 @@ async def download_admin_data(key: str = ""):
 def home():
     return {"status": "Backend is running", "port": os.environ.get("PORT", "not set")}
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until imports and worker warm-up are done (liveness is /health)"""
+    status = readiness.status()
+    if not readiness.ready:
+        return ORJSONResponse(status, status_code=503)
+    return status
+
 @app.get("/health")
 def health():
     """Health check endpoint for Railway"""
-    return {"status": "healthy", "service": "RealorAI Backend"}
+    return {
+        "status": "healthy",
+        "service": "RealorAI Backend",
+        "engine": engine.stats(),
+        "cache": result_cache.stats(),
+        "feedback_writer": feedback_writer.stats() if feedback_writer is not None else None,
+        "jobs": job_runner.stats(),
+        "rate_limit": rate_limiter.stats()
+    }
@@ -0,0 +1,229 @@
+"""
+Metrics - minimal Prometheus-style instrumentation (no extra dependency).
+
+  - Counter / Gauge / Histogram with labels, thread-safe
+  - Gauges can be backed by a callback evaluated at scrape time
+    (engine queue depth, cache counters)
+  - MetricsMiddleware records request latency per route template
+  - render() produces the Prometheus text exposition format for /metrics
+
+Stage timings measured inside forensics travel back with the analysis
+result (see analyze_image), so they also work with a process pool.
+"""
+import math
+import threading
+import time
+
+
+# Seconds; covers cache hits (sub-ms) up to timed-out analyses
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _ValueMetric(_Metric):
+    """Counter/Gauge storage; optionally backed by a callback evaluated at scrape time."""
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        # callback() -> number (no labels) or {label tuple: number}
+        self._callback = callback
+
+    def render(self):
+        if self._callback is not None:
+            value = self._callback()
+            items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Counter(_ValueMetric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Request level
+http_requests = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route, method and status.", ("method", "route", "status")
+)
+http_request_seconds = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")
+)
+
+# Analysis level
+analysis_stage_seconds = REGISTRY.histogram(
+    "analysis_stage_duration_seconds", "Time spent in each analyze_image stage.", ("stage",)
+)
+analysis_classifications = REGISTRY.counter(
+    "analysis_classification_total", "Analysis results per classify_trust_score bucket.", ("classification",)
+)
+analysis_near_duplicates = REGISTRY.counter(
+    "analysis_near_duplicate_total", "Analyses answered by the near-duplicate index.", ("match",)
+)
+
+
+def observe_stages(timings: dict):
+    """Record the per-stage timings returned by analyze_image()."""
+    for stage, seconds in timings.items():
+        analysis_stage_seconds.observe(seconds, stage=stage)
+
+
+def server_timing_header(timings: dict, extra: dict = None) -> str:
+    """Format stage timings (seconds) as a Server-Timing header value."""
+    entries = dict(timings)
+    if extra:
+        entries.update(extra)
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in entries.items())
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (safe for streaming responses) timing every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; using its path
+            # template keeps label cardinality bounded (no IDs in labels)
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope.get("method", "GET")
+            http_request_seconds.observe(time.perf_counter() - start, method=method, route=route_path)
+            http_requests.inc(method=method, route=route_path, status=status["code"])
@@ -0,0 +1,229 @@
+"""
+Rate Limiting - per-client token buckets in front of the analysis endpoints.
+
+A single client hammering /analyze used to take the whole engine. Now:
+  - every request is attributed to a client: a configured API key
+    (X-API-Key header) or else the client IP
+  - POST requests to the analysis endpoints take one token from that
+    client's bucket, refilled at RATE_LIMIT_RATE per second up to
+    RATE_LIMIT_BURST; an empty bucket answers 429 with Retry-After
+  - endpoints doing more than one analysis per request (/analyze/batch)
+    charge() the rest once they know the count; the bucket may go negative,
+    so the client waits for the whole batch to be paid off
+  - the client identity (request.state.client) also picks the client's
+    share in the engine's fair queue, so admitted work is interleaved
+    across clients instead of served first come, first served
+
+API keys carry a weight: their bucket refills weight times faster, holds
+weight times more tokens and gets weight times the fair share of the engine.
+Unknown keys are ignored (limited by IP), so inventing keys gains nothing.
+
+Configuration (environment variables):
+  RATE_LIMIT_RATE         requests per second each client earns (default: 2, 0 = no limit)
+  RATE_LIMIT_BURST        requests a client may send at once (default: 20)
+  RATE_LIMIT_PATHS        comma-separated path prefixes whose POSTs are limited
+                          (default: /analyze,/jobs)
+  RATE_LIMIT_API_KEYS     comma-separated "key" or "key=weight" entries (default weight: 1)
+  RATE_LIMIT_TRUST_PROXY  number of proxies in front of the app that append to X-Forwarded-For
+                          (default: 0 = use the socket address; 1 behind Railway or Render).
+                          The client IP is the entry the outermost trusted proxy appended:
+                          entries further left are written by the client and never trusted
+  RATE_LIMIT_MAX_CLIENTS  buckets kept in memory, least recently seen dropped first (default: 10000)
+"""
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from starlette.responses import JSONResponse
+
+
+class Client(NamedTuple):
+    """Who a request is attributed to; key never contains the raw API key."""
+    key: str
+    weight: float = 1.0
+
+
+def parse_api_keys(value: str) -> Dict[str, float]:
+    """Parse "key1=4,key2" into {"key1": 4.0, "key2": 1.0}."""
+    keys = {}
+    for entry in value.split(","):
+        key, _, weight = entry.strip().partition("=")
+        if key:
+            keys[key] = float(weight) if weight else 1.0
+    return keys
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 2.0, burst: float = 20.0, paths=("/analyze", "/jobs"),
+                 api_keys: Optional[Dict[str, float]] = None, trust_proxy: int = 0, max_clients: int = 10000):
+        """
+        Args:
+            rate: Tokens per second per client (0 disables limiting; clients are still identified)
+            burst: Bucket size
+            paths: Path prefixes whose POST requests cost a token
+            api_keys: Known API key -> weight
+            trust_proxy: Trusted proxy hops appending to X-Forwarded-For (0 = ignore the header)
+            max_clients: Buckets kept (LRU)
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.paths = tuple(paths)
+        self.trust_proxy = trust_proxy
+        self.max_clients = max_clients
+        # Hash keys once: client ids are shown on /admin/clients and must not leak them
+        self._api_keys = {
+            key: Client("key:" + hashlib.sha256(key.encode()).hexdigest()[:12], weight)
+            for key, weight in (api_keys or {}).items()
+        }
+        self._buckets = OrderedDict()  # client key -> [tokens, updated, allowed, limited]
+
+        # Counters for operators
+        self.allowed = 0
+        self.limited = 0
+
+    @classmethod
+    def from_env(cls):
+        paths = os.environ.get("RATE_LIMIT_PATHS", "/analyze,/jobs")
+        return cls(
+            rate=float(os.environ.get("RATE_LIMIT_RATE", "2")),
+            burst=float(os.environ.get("RATE_LIMIT_BURST", "20")),
+            paths=[path.strip() for path in paths.split(",") if path.strip()],
+            api_keys=parse_api_keys(os.environ.get("RATE_LIMIT_API_KEYS", "")),
+            trust_proxy=int(os.environ.get("RATE_LIMIT_TRUST_PROXY", "0")),
+            max_clients=int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000")),
+        )
+
+    def identify(self, scope) -> Client:
+        """The client an ASGI request is attributed to."""
+        api_key = _header(scope, b"x-api-key")
+        if api_key and api_key in self._api_keys:
+            return self._api_keys[api_key]
+        ip = None
+        if self.trust_proxy > 0:
+            # Repeated header lines form one list, in order
+            forwarded = ",".join(
+                value.decode("latin-1") for key, value in scope.get("headers", ()) if key == b"x-forwarded-for"
+            )
+            if forwarded:
+                # Each trusted proxy appended one entry; count them from the right
+                hops = [entry.strip() for entry in forwarded.split(",")]
+                ip = hops[-min(self.trust_proxy, len(hops))]
+        if not ip:
+            ip = scope["client"][0] if scope.get("client") else "unknown"
+        return Client("ip:" + ip)
+
+    def is_limited(self, scope) -> bool:
+        return (self.rate > 0 and scope.get("method") == "POST"
+                and any(scope["path"].startswith(path) for path in self.paths))
+
+    def _bucket(self, client: Client, now: float):
+        """The client's bucket, refilled up to now."""
+        rate, burst = self.rate * client.weight, self.burst * client.weight
+        bucket = self._buckets.get(client.key)
+        if bucket is None:
+            bucket = self._buckets[client.key] = [burst, now, 0, 0]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client.key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def take(self, client: Client, now: Optional[float] = None):
+        """
+        Take one token from the client's bucket.
+
+        Returns:
+            (allowed, retry_after_seconds)
+        """
+        now = time.monotonic() if now is None else now
+        rate = self.rate * client.weight
+        bucket = self._bucket(client, now)
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            bucket[2] += 1
+            self.allowed += 1
+            return True, 0
+        bucket[3] += 1
+        self.limited += 1
+        return False, max(1, math.ceil((1.0 - bucket[0]) / rate))
+
+    def charge(self, client: Client, cost: float, now: Optional[float] = None):
+        """
+        Take cost more tokens for a request already admitted by take(),
+        going into debt if needed: later requests wait until it is repaid.
+        """
+        if self.rate <= 0 or cost <= 0:
+            return
+        bucket = self._bucket(client, time.monotonic() if now is None else now)
+        bucket[0] -= cost
+        bucket[2] += int(cost)
+        self.allowed += int(cost)
+
+    def clients(self, limit: int = 50):
+        """The most active clients (by requests) with their bucket state."""
+        now = time.monotonic()
+        rows = [
+            {
+                "client": key,
+                "allowed": allowed,
+                "limited": limited,
+                "tokens": round(tokens, 2),
+                "idle_seconds": round(now - updated, 1),
+            }
+            for key, (tokens, updated, allowed, limited) in self._buckets.items()
+        ]
+        rows.sort(key=lambda row: row["allowed"] + row["limited"], reverse=True)
+        return rows[:limit]
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware: stores request.state.client and answers 429 when its bucket is empty."""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client = self.limiter.identify(scope)
+        scope.setdefault("state", {})["client"] = client
+        if self.limiter.is_limited(scope):
+            allowed, retry_after = self.limiter.take(client)
+            if not allowed:
+                response = JSONResponse(
+                    {"detail": "Too many requests, please retry"},
+                    status_code=429,
+                    headers={
+                        "Retry-After": str(retry_after),
+                        "X-RateLimit-Limit": str(int(self.limiter.burst * client.weight)),
+                        "X-RateLimit-Remaining": "0",
+                    },
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Bulk Scoring - offline CLI that rescores image collections without the HTTP server.
+
+Calls forensics.analyze_image() directly in a process pool:
+  - walks directories, .zip and .tar(.gz/.bz2/.xz) archives (also archives found
+    while walking); only files with an image extension are scored
+  - the main process reads and hashes the images and hands them to the workers
+    in chunks, with at most 2 chunks per worker in flight so memory stays bounded
+  - results stream to CSV, JSONL or Parquet (one row per image)
+  - a checkpoint file lists the SHA-256 of every image whose row has been
+    written; a rerun with the same output skips those images, so an
+    interrupted run resumes where it stopped (identical images are scored once);
+    rows that reached the output but not the checkpoint (a crash in between)
+    are read back from the output on resume, so no image gets a second row
+  - throughput is reported on stderr while running
+
+Parquet files cannot be appended to, so Parquet output is written as complete
+part files (scores-00000.parquet, scores-00001.parquet, ...) of --part-rows rows.
+A part is written under a temporary name and renamed once complete, so its
+rows (and their hashes) appear in one step; rows of an unfinished part are
+rescored on resume.
+
+Usage (from the repository root, or `python score.py` from the backend directory):
+  python -m backend.score photos/ archive.tar.gz --out scores.csv
+  python -m backend.score photos.zip --out scores.jsonl --workers 8 --chunk-size 32
+  python -m backend.score /data --out scores.parquet --part-rows 100000
+  python -m backend.score /data --out scores.csv --fresh      # ignore the checkpoint
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import logging
+import os
+import signal
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import orjson
+
+try:
+    from . import forensics
+    from .cache import analysis_version
+except ImportError:  # Run as a script from the backend directory
+    import forensics
+    from cache import analysis_version
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Output columns, in order
+FIELDS = ("source", "sha256", "bytes", "trust_score", "classification", "version", "seconds", "error")
+
+# A chunk is closed at this many images or bytes, whichever comes first
+CHUNK_MAX_BYTES = 64 * 1024 * 1024
+
+
+def truncate_partial_line(path: str, terminator: bytes) -> None:
+    """Cut off a row left half-written by a crash (everything after the last terminator)."""
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 65536)
+            f.seek(start)
+            # Overlap by the terminator length so a terminator split across blocks is found
+            block = f.read(min(end, pos + len(terminator) - 1) - start)
+            index = block.rfind(terminator)
+            if index >= 0:
+                f.truncate(start + index + len(terminator))
+                return
+            pos = start
+        f.truncate(0)
+
+
+def is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def archive_kind(path: str):
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return "zip"
+    if lower.endswith(TAR_EXTENSIONS):
+        return "tar"
+    return None
+
+
+def iter_archive(path: str):
+    """Yield (source, bytes) for every image member of a zip or tar archive."""
+    if archive_kind(path) == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image(info.filename):
+                    yield f"{path}::{info.filename}", archive.read(info)
+        return
+
+    # Stream mode reads the (compressed) archive front to back exactly once
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if member.isfile() and is_image(member.name):
+                yield f"{path}::{member.name}", archive.extractfile(member).read()
+
+
+def iter_sources(paths):
+    """
+    Yield (source, bytes) for every image below the given paths.
+
+    Args:
+        paths: Image files, archives or directories (walked recursively, in sorted order)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from iter_sources([os.path.join(root, name)])
+        elif archive_kind(path):
+            try:
+                yield from iter_archive(path)
+            except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+                logging.error(f"Skipping unreadable archive {path}: {e}")
+        elif is_image(path):
+            try:
+                with open(path, "rb") as f:
+                    yield path, f.read()
+            except OSError as e:
+                logging.error(f"Skipping unreadable file {path}: {e}")
+        elif not os.path.exists(path):
+            logging.error(f"No such file or directory: {path}")
+
+
+def init_worker():
+    # Ctrl+C is handled by the main process, which shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Parallelism comes from the process pool; OpenCV's own thread pool in
+    # every worker would only oversubscribe the cores
+    cv2.setNumThreads(1)
+
+
+def score_chunk(items, target_dim):
+    """
+    Score one chunk inside a worker process.
+
+    Args:
+        items: List of (source, sha256, bytes)
+        target_dim: Analysis resolution passed to analyze_image()
+
+    Returns:
+        One row dict (FIELDS) per item; failures are reported in "error"
+    """
+    rows = []
+    for source, digest, data in items:
+        row = dict.fromkeys(FIELDS)
+        row.update(source=source, sha256=digest, bytes=len(data), version=analysis_version(target_dim))
+        start = time.perf_counter()
+        try:
+            result = forensics.analyze_image(data, target_dim=target_dim)
+            row["trust_score"] = result.get("trust_score", 0)
+            row["classification"] = forensics.classify_trust_score(row["trust_score"])
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+        row["seconds"] = round(time.perf_counter() - start, 4)
+        rows.append(row)
+    return rows
+
+
+class CsvWriter:
+    def __init__(self, path: str, append: bool):
+        # Hashes of the rows already in the output (see Checkpoint)
+        self.written = set()
+        if append and os.path.exists(path):
+            truncate_partial_line(path, b"\r\n")
+            with open(path, newline="", encoding="utf-8") as f:
+                self.written.update(row["sha256"] for row in csv.DictReader(f))
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "a" if exists else "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+        if not exists:
+            self._writer.writeheader()
+
+    def write(self, rows) -> list:
+        """Write rows; returns the rows that are now safely on disk."""
+        self._writer.writerows(rows)
+        self._file.flush()
+        return rows
+
+    def close(self) -> list:
+        self._file.close()
+        return []
+
+
+class JsonlWriter:
+    def __init__(self, path: str, append: bool):
+        self.written = set()
+        if append and os.path.exists(path):
+            truncate_partial_line(path, b"\n")
+            with open(path, "rb") as f:
+                self.written.update(orjson.loads(line)["sha256"] for line in f if line.strip())
+        self._file = open(path, "ab" if append else "wb")
+
+    def write(self, rows) -> list:
+        self._file.write(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+        self._file.flush()
+        return rows
+
+    def close(self) -> list:
+        self._file.close()
+        return []
+
+
+class ParquetWriter:
+    """Buffers rows and writes them as complete part files of part_rows rows."""
+
+    def __init__(self, path: str, append: bool, part_rows: int = 100000):
+        # Optional dependency, only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa, self._pq = pa, pq
+        self._schema = pa.schema([
+            ("source", pa.string()), ("sha256", pa.string()), ("bytes", pa.int64()),
+            ("trust_score", pa.int32()), ("classification", pa.string()), ("version", pa.string()),
+            ("seconds", pa.float64()), ("error", pa.string()),
+        ])
+        self._stem = path[:-len(".parquet")] if path.endswith(".parquet") else path
+        self._part_rows = part_rows
+        self._rows = []
+        pattern = glob.escape(self._stem) + "-[0-9][0-9][0-9][0-9][0-9].parquet"
+        # Parts a crash left unfinished
+        for part in glob.glob(pattern + ".tmp"):
+            os.remove(part)
+        existing = glob.glob(pattern)
+        if existing and not append:
+            for part in existing:
+                os.remove(part)
+            existing = []
+        self._next_part = len(existing)
+        self.written = set()
+        for part in existing:
+            self.written.update(pq.read_table(part, columns=["sha256"]).column("sha256").to_pylist())
+
+    def _write_part(self) -> list:
+        rows, self._rows = self._rows, []
+        if not rows:
+            return []
+        path = f"{self._stem}-{self._next_part:05d}.parquet"
+        self._pq.write_table(self._pa.Table.from_pylist(rows, schema=self._schema), path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._next_part += 1
+        return rows
+
+    def write(self, rows) -> list:
+        self._rows.extend(rows)
+        if len(self._rows) >= self._part_rows:
+            return self._write_part()
+        return []
+
+    def close(self) -> list:
+        return self._write_part()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+class Checkpoint:
+    """
+    Append-only file of processed image hashes (one hex SHA-256 per line).
+
+    Hashes are recorded after their rows are on disk; written (the hashes found
+    in the output) fills in rows written just before a crash, so they are not
+    scored and written again.
+    """
+
+    def __init__(self, path: str, fresh: bool = False, written=()):
+        self.done = set()
+        if os.path.exists(path) and not fresh:
+            with open(path, "r") as f:
+                self.done.update(line.strip() for line in f if line.strip())
+        self._file = open(path, "w" if fresh else "a")
+        missing = set(written) - self.done
+        if missing and not fresh:
+            logging.info(f"Recovered {len(missing)} scored images from the output")
+            self.done |= missing
+            self.record([{"sha256": digest} for digest in sorted(missing)])
+
+    def record(self, rows):
+        if rows:
+            self._file.write("".join(row["sha256"] + "\n" for row in rows))
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    def __init__(self, interval: float = 1.0, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.start = self._last = time.perf_counter()
+        self.scored = self.errors = self.skipped = self.bytes = 0
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            f"{self.scored} scored, {self.errors} errors, {self.skipped} skipped | "
+            f"{self.scored / elapsed:.1f} img/s, {self.bytes / elapsed / 1e6:.1f} MB/s, {elapsed:.0f}s"
+        )
+
+    def update(self, rows=(), skipped=0, force=False):
+        for row in rows:
+            self.scored += 1
+            self.bytes += row["bytes"]
+            self.errors += row["error"] is not None
+        self.skipped += skipped
+        now = time.perf_counter()
+        # On a terminal redraw one line; in logs print a line every 10 intervals
+        interval = self.interval if self.tty else self.interval * 10
+        if force or now - self._last >= interval:
+            self._last = now
+            end = "\n" if force or not self.tty else ""
+            print(("\r" if self.tty else "") + self.line(), end=end, file=self.stream, flush=True)
+
+
+def run(paths, out, fmt=None, workers=None, chunk_size=16, target_dim=forensics.TARGET_DIM,
+        checkpoint=None, fresh=False, part_rows=100000, progress_interval=1.0) -> Progress:
+    """
+    Score every image below paths and stream the rows to out.
+
+    Args:
+        paths: Files, archives or directories
+        out: Output file (format from the extension unless fmt is given)
+        workers: Worker processes (default: os.cpu_count())
+        chunk_size: Images per task sent to a worker
+        checkpoint: Checkpoint file (default: out + ".checkpoint")
+        fresh: Ignore and overwrite an existing checkpoint and output
+
+    Returns:
+        The final Progress counters
+    """
+    fmt = fmt or os.path.splitext(out)[1].lstrip(".").lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported output format '{fmt}' (use one of {', '.join(WRITERS)})")
+    workers = workers or os.cpu_count() or 1
+
+    writer = WRITERS[fmt](out, not fresh, part_rows) if fmt == "parquet" else WRITERS[fmt](out, not fresh)
+    checkpoint = Checkpoint(checkpoint or out + ".checkpoint", fresh=fresh, written=writer.written)
+    if checkpoint.done:
+        logging.info(f"Resuming: {len(checkpoint.done)} images already scored")
+    progress = Progress(progress_interval)
+    # Hashes dispatched in this run (identical images are scored once)
+    seen = set(checkpoint.done)
+
+    def collect(futures):
+        for future in futures:
+            rows = future.result()
+            checkpoint.record(writer.write(rows))
+            progress.update(rows)
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    pending = set()
+    try:
+        chunk, chunk_bytes = [], 0
+        for source, data in iter_sources(paths):
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in seen:
+                progress.update(skipped=1)
+                continue
+            seen.add(digest)
+            chunk.append((source, digest, data))
+            chunk_bytes += len(data)
+            if len(chunk) < chunk_size and chunk_bytes < CHUNK_MAX_BYTES:
+                continue
+
+            # Backpressure: never read further ahead than 2 chunks per worker
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(score_chunk, chunk, target_dim))
+            chunk, chunk_bytes = [], 0
+
+        if chunk:
+            pending.add(executor.submit(score_chunk, chunk, target_dim))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        # On interruption, drop queued chunks (they are rescored on resume) but
+        # keep the rows of chunks that finished in the meantime
+        executor.shutdown(wait=True, cancel_futures=True)
+        collect(f for f in pending if f.done() and not f.cancelled() and f.exception() is None)
+        checkpoint.record(writer.close())
+        checkpoint.close()
+        progress.update(force=True)
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score images in directories and archives without the HTTP server")
+    parser.add_argument("paths", nargs="+", help="Image files, directories, .zip or .tar(.gz/.bz2/.xz) archives")
+    parser.add_argument("--out", required=True, help="Output file (.csv, .jsonl or .parquet)")
+    parser.add_argument("--format", dest="fmt", choices=sorted(WRITERS), help="Output format (default: from --out)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Images per task sent to a worker")
+    parser.add_argument("--target-dim", type=int, default=forensics.TARGET_DIM,
+                        help="Analysis resolution (longest side, 0 = native)")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <out>.checkpoint)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint and overwrite the output")
+    parser.add_argument("--part-rows", type=int, default=100000, help="Rows per Parquet part file")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="Seconds between progress updates")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(levelname)s: %(message)s")
+    try:
+        run(args.paths, args.out, fmt=args.fmt, workers=args.workers, chunk_size=args.chunk_size,
+            target_dim=args.target_dim, checkpoint=args.checkpoint, fresh=args.fresh,
+            part_rows=args.part_rows, progress_interval=args.progress_interval)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    except ValueError as e:
+        parser.error(str(e))
+    except ImportError as e:
+        parser.error(f"Parquet output needs pyarrow ({e})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Startup - cold-start helpers for the API process and the analysis workers.
+
+main.py used to import cv2/numpy (forensics), supabase and python-dotenv at
+module import, and the first /analyze then paid again for OpenCV/BLAS
+initialization and thread-pool spin-up. Instead:
+  - python-dotenv is only imported when there is a .env file to load
+  - preload() imports heavy modules on worker threads from the lifespan, in
+    parallel with the rest of the startup work; code that needs them calls
+    module(), which waits for an import still in progress (Python's import lock)
+  - warm_worker() is the engine's worker initializer: it imports forensics and
+    pushes a synthetic image through analyze_image() once per worker process,
+    so recycled workers start warm as well; it then installs the process's
+    near-duplicate index (see dedup.py)
+  - Readiness tracks those background steps; /ready answers 503 until they
+    are done, while /health stays a plain liveness check
+
+Configuration (environment variables):
+  ANALYSIS_WARMUP    "1" (default) runs the synthetic analyses, "0" only imports
+"""
+import asyncio
+import importlib
+import logging
+import os
+import threading
+import time
+
+
+WARMUP = os.environ.get("ANALYSIS_WARMUP", "1") == "1"
+
+# Large enough for the resize step (above the 2048px analysis size) and a few tiles
+WARMUP_SIZE = (2560, 1920)
+
+_warm_lock = threading.Lock()
+_warm = False
+
+
+def load_env_file(start_dir: str):
+    """
+    Load the nearest .env file (start_dir or a parent), like load_dotenv().
+
+    Returns:
+        The loaded path, or None (python-dotenv is not imported then)
+    """
+    path = os.path.abspath(start_dir)
+    while True:
+        candidate = os.path.join(path, ".env")
+        if os.path.isfile(candidate):
+            from dotenv import load_dotenv
+            load_dotenv(candidate)
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def module(name: str):
+    """Imported module by name; waits if another thread is still importing it."""
+    return importlib.import_module(name)
+
+
+async def preload(*names):
+    """Import the given modules concurrently on worker threads."""
+    await asyncio.gather(*(asyncio.to_thread(importlib.import_module, name) for name in names))
+
+
+def synthetic_jpeg(width: int = WARMUP_SIZE[0], height: int = WARMUP_SIZE[1], seed: int = 0) -> bytes:
+    """Camera-like JPEG (smooth scene plus grain) that exercises every analysis stage."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(0, 256, (height // 64, width // 64, 3), dtype=np.uint8)
+    img = cv2.resize(scene, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+    ok, buffer = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+    if not ok:
+        raise RuntimeError("Could not encode the warm-up image")
+    return buffer.tobytes()
+
+
+def warm_worker():
+    """
+    Engine worker initializer (also submitted once per worker by AnalysisEngine.warm_up).
+
+    The first call in a process imports forensics and runs the default, tiled
+    and visualization paths on a synthetic image; later calls return at once.
+    Never raises: a failing initializer would break the whole pool.
+
+    Returns:
+        The process id, so the caller can count warmed processes
+    """
+    global _warm
+    with _warm_lock:
+        if _warm:
+            return os.getpid()
+        try:
+            start = time.perf_counter()
+            forensics = importlib.import_module("forensics")
+            if WARMUP:
+                image_bytes = synthetic_jpeg()
+                forensics.analyze_image(image_bytes)
+                forensics.analyze_image(image_bytes, tiled=True)
+                forensics.analyze_image(image_bytes, visualize=True)
+            logging.debug(f"Worker {os.getpid()} warmed up in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logging.warning(f"Worker warm-up failed: {e}")
+        try:
+            # Installed after the synthetic analyses, so those are never indexed
+            importlib.import_module("forensics").near_duplicate_index = (
+                importlib.import_module("dedup").NearDuplicateIndex.from_env()
+            )
+        except Exception as e:
+            logging.warning(f"Near-duplicate index disabled: {e}")
+        _warm = True
+    return os.getpid()
+
+
+class Readiness:
+    """Outcome of the background startup steps, reported by /ready."""
+
+    def __init__(self):
+        self.ready = False
+        self.steps = {}
+        self._start = time.perf_counter()
+        self._seconds = None
+
+    async def _step(self, name, awaitable):
+        start = time.perf_counter()
+        try:
+            await awaitable
+            self.steps[name] = {"seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            # Still report ready: the service works, only the first request is slower
+            logging.error(f"Startup step '{name}' failed: {e}")
+            self.steps[name] = {"seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+
+    async def run(self, steps: dict):
+        """Run the named awaitables concurrently, then mark the process ready."""
+        await asyncio.gather(*(self._step(name, awaitable) for name, awaitable in steps.items()))
+        self._seconds = round(time.perf_counter() - self._start, 3)
+        self.ready = True
+        logging.info(f"Ready after {self._seconds}s: {self.steps}")
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming_up",
+            "seconds": self._seconds if self.ready else round(time.perf_counter() - self._start, 3),
+            "steps": self.steps,
+        }
@@ -8,7 +8,7 @@ import requests
 
 def test_analyze(image_path: str):
     """Test the /analyze endpoint with an image file."""
-    url = "http://localhost:8001/analyze"
+    url = "http://localhost:8001/analyze?visualization=inline"
     
     try:
         with open(image_path, 'rb') as f:
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Sampled ELA against the full JPEG round trip (the reference): both must reach
+the same ELA_AI_THRESHOLD decision, including images right at the threshold.
+Usage: python -m pytest test_ela.py
+"""
+import pytest
+
+import forensics
+from benchmark import graded_image
+
+# (blur, noise) fixtures from clean AI-like to grainy camera-like; the middle
+# rows straddle ELA_AI_THRESHOLD (full scores between about 1.38 and 1.60)
+FIXTURES = [
+    (0.0, 0), (0.0, 4), (0.0, 24),
+    (1.0, 0), (1.0, 0.5), (1.0, 0.75), (1.0, 1),
+    (2.0, 1.25), (2.0, 1.5), (2.0, 1.75),
+    (2.0, 0), (3.0, 0),
+]
+# Analysis-size shapes: multiple of the 16px MCU and not (partial edge tiles)
+SHAPES = [(2048, 1536), (2048, 1365)]
+
+
+@pytest.mark.parametrize("width,height", SHAPES)
+@pytest.mark.parametrize("blur,noise", FIXTURES)
+def test_sampled_ela_agrees_with_full(width, height, blur, noise):
+    img = graded_image(width, height, noise, blur, seed=1)
+    threshold = forensics.ELA_AI_THRESHOLD
+    full = forensics.calculate_ela_score(img, mode="full")
+    sampled = forensics.calculate_ela_score(img, mode="sampled", threshold=threshold)
+
+    assert (sampled < threshold) == (full < threshold)
+    assert abs(sampled - full) <= forensics.ELA_TOLERANCE * full
+    if abs(full - threshold) <= forensics.ELA_TOLERANCE * threshold:
+        # Near the threshold every tile is used, which reproduces the full score
+        assert sampled == pytest.approx(full, rel=1e-6)
+
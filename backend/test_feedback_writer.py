@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+FeedbackWriter against a local stub PostgREST server: batching, retry with
+backoff, spilling to the local store and replaying the spill.
+Usage: python -m pytest test_feedback_writer.py
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from feedback_store import LocalFeedbackStore
+from feedback_writer import FeedbackWriter
+
+
+class StubPostgREST:
+    """Answers POST /rest/v1/feedback with scripted statuses (then `default`) and records what it got."""
+
+    def __init__(self, statuses=(), default=201):
+        self.statuses = list(statuses)
+        self.default = default
+        self.attempts = []   # (monotonic time, status, row count) per request
+        self.rows = []       # rows of accepted inserts
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                rows = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = stub.statuses.pop(0) if stub.statuses else stub.default
+                stub.attempts.append((time.monotonic(), status, len(rows)))
+                if status < 300:
+                    stub.rows.extend(rows)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubPostgREST()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    local = LocalFeedbackStore(str(tmp_path / "feedback.db"), legacy_json=None)
+    yield local
+    local.close()
+
+
+def record(i):
+    return {"filename": f"{i}.jpg", "ai_score": i, "user_verdict": "real", "actual_category": None,
+            "comments": None, "contribute_data": True, "timestamp": "2026-01-01T00:00:00"}
+
+
+def make_writer(stub, store, **options):
+    options = {"batch_size": 50, "flush_interval": 0.05, "backoff": 0.05, "max_retries": 3, **options}
+    return FeedbackWriter(stub.url, "key", spill_store=lambda: store, **options)
+
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_batches_records_into_multi_row_inserts(stub, store):
+    async def scenario():
+        writer = make_writer(stub, store)
+        await writer.start()
+        for i in range(120):
+            writer.submit(record(i))
+        await wait_until(lambda: len(stub.rows) == 120)
+        await writer.stop()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert [count for _, _, count in stub.attempts] == [50, 50, 20]
+    assert sorted(row["ai_score"] for row in stub.rows) == list(range(120))
+    assert "timestamp" not in stub.rows[0]  # Supabase sets created_at itself
+    assert stats["written"] == 120 and stats["spilled"] == 0
+
+
+def test_retries_transient_errors_with_exponential_backoff(stub, store):
+    stub.statuses = [503, 503, 429]
+
+    async def scenario():
+        writer = make_writer(stub, store)
+        await writer.start()
+        writer.submit(record(1))
+        await wait_until(lambda: stub.rows)
+        await writer.stop()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert [status for _, status, _ in stub.attempts] == [503, 503, 429, 201]
+    assert stats["retries"] == 3 and stats["written"] == 1 and stats["spilled"] == 0
+    # Delays are backoff * 2**attempt with +-50% jitter
+    gaps = [later[0] - earlier[0] for earlier, later in zip(stub.attempts, stub.attempts[1:])]
+    for attempt, gap in enumerate(gaps):
+        assert gap >= 0.05 * 2 ** attempt * 0.5
+
+
+def test_spills_after_retries_and_replays_once_the_remote_is_back(stub, store):
+    stub.default = 503
+
+    async def scenario():
+        writer = make_writer(stub, store, max_retries=1)
+        await writer.start()
+        for i in range(3):
+            writer.submit(record(i))
+        await wait_until(lambda: writer.stats()["spilled"] == 3)
+        assert store.spilled_count() == 3 and not stub.rows
+
+        # Remote recovers: the next successful insert also delivers the spill
+        stub.default = 201
+        writer.submit(record(3))
+        await wait_until(lambda: len(stub.rows) == 4)
+        await writer.stop()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert sorted(row["ai_score"] for row in stub.rows) == [0, 1, 2, 3]
+    assert store.spilled_count() == 0
+    assert stats["replayed"] == 3
+
+
+def test_client_errors_are_not_retried(stub, store):
+    stub.statuses = [400]
+
+    async def scenario():
+        writer = make_writer(stub, store)
+        await writer.start()
+        writer.submit(record(1))
+        await wait_until(lambda: writer.stats()["spilled"] == 1)
+        await writer.stop()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(stub.attempts) == 1 and stats["retries"] == 0
+    assert store.spilled_count() == 1
+
+
+def test_replays_spilled_records_on_start(stub, store):
+    store.spill_many([record(i) for i in range(70)])
+
+    async def scenario():
+        writer = make_writer(stub, store)
+        await writer.start()
+        await wait_until(lambda: len(stub.rows) == 70)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert [count for _, _, count in stub.attempts] == [50, 20]
+    assert store.spilled_count() == 0
+
+
+def test_stop_spills_a_full_queue_within_the_timeout(stub, store):
+    stub.default = 503
+
+    async def scenario():
+        writer = make_writer(stub, store, queue_size=5, batch_size=2, max_retries=100, backoff=0.2)
+        await writer.start()
+        await wait_until(lambda: not writer._replay_pending)
+        for i in range(20):
+            writer.submit(record(i))
+        await asyncio.sleep(0.1)
+        for i in range(20, 40):
+            writer.submit(record(i))
+        started = time.monotonic()
+        await writer.stop(timeout=0.5)
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 1.5
+    assert store.spilled_count() == 40 and not stub.rows
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Bulk scoring resume: a crash between writing rows and recording their hashes
+must not produce duplicate rows.
+Usage: python -m pytest test_score.py
+"""
+import csv
+
+import cv2
+import numpy as np
+import orjson
+import pytest
+
+import score
+
+
+@pytest.fixture
+def images(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for i in range(6):
+        pixels = (np.random.RandomState(i).rand(48, 48, 3) * 255).astype(np.uint8)
+        cv2.imwrite(str(folder / f"{i}.jpg"), pixels)
+    return str(folder)
+
+
+def read_hashes(out, fmt):
+    with open(out, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            return [row["sha256"] for row in csv.DictReader(f)]
+        return [orjson.loads(line)["sha256"] for line in f]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_resume_after_crash_between_output_and_checkpoint(images, tmp_path, fmt):
+    out = str(tmp_path / f"scores.{fmt}")
+    score.run([images], out, workers=1, chunk_size=2)
+    assert len(read_hashes(out, fmt)) == 6
+
+    # Crash: the last two rows reached the output but not the checkpoint, and
+    # a third row was cut off halfway
+    with open(out + ".checkpoint") as f:
+        recorded = f.readlines()
+    with open(out + ".checkpoint", "w") as f:
+        f.writelines(recorded[:4])
+    with open(out, "ab") as f:
+        f.write(b'{"source": "torn' if fmt == "jsonl" else b"torn,row")
+
+    progress = score.run([images], out, workers=1, chunk_size=2)
+    hashes = read_hashes(out, fmt)
+    assert progress.scored == 0 and progress.skipped == 6
+    assert len(hashes) == len(set(hashes)) == 6
+    with open(out + ".checkpoint") as f:
+        assert sorted(line.strip() for line in f) == sorted(hashes)
+
+
+def test_version_column_matches_the_cache_version(images, tmp_path):
+    out = str(tmp_path / "scores.csv")
+    score.run([images], out, workers=1, target_dim=1024)
+    with open(out, newline="", encoding="utf-8") as f:
+        versions = {row["version"] for row in csv.DictReader(f)}
+    assert versions == {score.analysis_version(1024)}
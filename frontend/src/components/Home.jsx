@@ -140,7 +140,8 @@ export default function Home() {
     const formData = new FormData();
     formData.append('file', file);
     try {
-      const resp = await fetch(`${API_URL}/analyze`, {
+      // The gradient visualization is opt-in; the result card displays it inline
+      const resp = await fetch(`${API_URL}/analyze?visualization=inline`, {
         method: 'POST',
         body: formData,
       });